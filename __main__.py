@@ -1,23 +1,107 @@
 import twlog
 import twargs
+import config
 
-import web
 import work
+import pipeline
+import plan
+import ledger
+import runner
+import roster
+import takeout
+import metrics
+import os
 import sys
+import json
 import time
 
 
 t = time.time()
 logger = twlog.TimeWatchLogger()
-logger.info('Start')
 
 a = twargs.TWArgs()
 args = a.parse_args(sys.argv)
+twlog.configure(level=args.log_level, levels=args.log_levels, json_file=args.log_json)
+logger.info('Start')
+
+
+def load_config():
+    return config.load(args.parameters_file)
+
+
+if args.metrics_dir:
+    metrics.enable()
 
+try:
+    if args.import_takeout:
+        takeout.import_takeout(args.import_takeout, store_dir=takeout.store_dir_from_params(load_config().params))
 
-with web.Timewatch(params_file=args.parameters_file) as tw:
-    for d in work.date_list(start_date=args.start_date, end_date=args.end_date):
-        tw.update_date(d)
+    if args.roster:
+        results = roster.run_roster(roster_file=args.roster, start_date=args.start_date, end_date=args.end_date,
+                                    processes=args.processes, per_tenant=args.per_tenant, backend=args.backend,
+                                    url=args.timewatch_url, lookahead=args.lookahead, batch_month=args.batch_month,
+                                    reconcile=args.reconcile, seed=args.seed)
+        print(roster.format_report(results))
+        if args.metrics_dir:
+            roster.write_report(results, os.path.join(args.metrics_dir, 'twu-roster.json'))
+    elif args.replay:
+        # replay and daemon pull in the http backend - only the modes that use them import them
+        import replay
+        comparison = replay.replay(args.replay)
+        print(replay.format_comparison(comparison))
+        if args.metrics_dir:
+            replay.write_comparison(comparison, os.path.join(args.metrics_dir, 'twu-replay.json'))
+    elif args.daemon:
+        import daemon
+        daemon.Daemon(config.ConfigFile(args.parameters_file), start_date=args.start_date, backend=args.backend,
+                      url=args.timewatch_url, lookahead=args.lookahead, batch_month=args.batch_month,
+                      reconcile=args.reconcile, seed=args.seed).serve()
+    elif args.daemon_request:
+        import daemon
+        message = {'command': args.daemon_request}
+        if args.daemon_request == 'run':
+            message['start'] = args.start_date.strftime('%d-%m-%Y')
+            message['end'] = (args.end_date or args.start_date).strftime('%d-%m-%Y')
+        print(json.dumps(daemon.request(daemon.socket_path(load_config()), message)))
+    elif args.start_date and args.end_date:
+        if args.report:
+            book = ledger.Ledger.from_params(load_config().params)
+            records = []
+            if book is not None:
+                records = book.range(args.start_date, args.end_date)
+                book.close()
+            rows = ledger.report_rows(records)
+            print(plan.format_plan(rows, fields=ledger.REPORT_FIELDS))
+            print(', '.join('{}: {}'.format(k, v) for k, v in ledger.report_totals(records).items()))
+            if args.plan_output:
+                plan.write_plan(rows, args.plan_output, fields=ledger.REPORT_FIELDS)
+        elif args.plan:
+            planner = work.WorkPlanner(load_config(), seed=args.seed, dry_run=True)
+            try:
+                dates = list(work.date_list(start_date=args.start_date, end_date=args.end_date))
+                planner.prepare(dates)
+                rows = plan.plan_rows(pipeline.prefetch(planner.query, dates, lookahead=args.lookahead))
+            finally:
+                planner.close()
+            print(plan.format_plan(rows))
+            if args.plan_output:
+                plan.write_plan(rows, args.plan_output)
+        elif args.record:
+            import replay
+            results = replay.record(parameters_file=args.parameters_file, archive=args.record,
+                                    start_date=args.start_date, end_date=args.end_date, url=args.timewatch_url,
+                                    lookahead=args.lookahead, batch_month=args.batch_month,
+                                    reconcile=args.reconcile, seed=args.seed)
+            print(', '.join('{}: {}'.format(k, results[k]) for k in replay.RESULT_FIELDS))
+        else:
+            runner.run_range(config_file=config.ConfigFile(args.parameters_file), start_date=args.start_date,
+                             end_date=args.end_date, backend=args.backend, url=args.timewatch_url, lookahead=args.lookahead,
+                             batch_month=args.batch_month, reconcile=args.reconcile, seed=args.seed)
+finally:
+    if args.metrics_dir:
+        metrics.write_json(os.path.join(args.metrics_dir, 'twu-metrics.json'))
+        metrics.write_prometheus(os.path.join(args.metrics_dir, 'twu.prom'))
+        logger.info('Metrics written to %s', args.metrics_dir)
 
 
 logger.info('Finished in {:.2f} seconds'.format(time.time() - t))
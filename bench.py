@@ -0,0 +1,224 @@
+"""
+Offline benchmark suite.
+Runs scripted scenarios (a single day, a month, a year, dense and sparse timelines) against the
+local mock TimeWatch server with synthetic timelines, and reports per stage latency,
+throughput in dates per minute and peak memory. No browser and no network are needed.
+Every scenario runs in a process of its own, so its peak memory is not the one of the scenarios before it.
+
+    python bench.py
+    python bench.py --scenario month month-dense --json bench.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import datetime as dt
+
+import twlog
+import work
+import kmlcache
+import geofence
+import kmlgen
+import mockserver
+import httpbackend
+import pipeline
+
+logger = twlog.TimeWatchLogger()
+
+WORK_SITE = (32.166525, 34.812895)
+
+# name -> (first date, number of days, placemarks per day)
+SCENARIOS = {
+    'day': (dt.datetime(2020, 7, 1), 1, 200),
+    'month': (dt.datetime(2020, 7, 1), 31, 200),
+    'year': (dt.datetime(2019, 1, 1), 365, 200),
+    'month-sparse': (dt.datetime(2020, 7, 1), 31, 20),
+    'month-dense': (dt.datetime(2020, 7, 1), 31, 5000),
+}
+
+
+def make_params(base_dir):
+    """parameters file content for a benchmark run - everything is kept under `base_dir`"""
+    return {
+        'params_version': '1.0.0',
+        'download_dir': os.path.join(base_dir, 'downloads'),
+        'kml_cache': {'dir': os.path.join(base_dir, 'kml'), 'max_size_mb': 4096},
+        'takeout': {'store': os.path.join(base_dir, 'takeout')},
+        'journal_dir': os.path.join(base_dir, 'journal'),
+        'ledger': {'dir': os.path.join(base_dir, 'ledger')},
+        'session': {'enabled': False},
+        # the mock server is local - pacing would measure the token bucket, not the work
+        'requests': {'timewatch': {'rate': 0}, 'timeline': {'rate': 0}},
+        'user': {'company': '1', 'worker': '2', 'pswd': '3'},
+        'work': {
+            'location': {'lat': WORK_SITE[0], 'long': WORK_SITE[1]},
+            'weekend': ['Friday', 'Saturday'],
+            'work_day': {'randomize': True, 'max_length': 10, 'nominal_length': 9,
+                         'minimal_start_time': '07:00', 'maximal_end_time': '20:00'}
+        },
+        'home': {'work_from_home_excuse_index': 5},
+        'holiday': {'holiday_eve_index': 3, 'holiday_eve_text': [], 'holiday_index': 4, 'holiday_text': []}
+    }
+
+
+def run_scenario(name, lookahead=3, batch_month=False, trace_memory=False):
+    """
+    Run a single scenario end to end.
+
+    :param str name: scenario name, a key of SCENARIOS
+    :param int lookahead: pipeline look-ahead (see pipeline.prefetch)
+    :param bool batch_month: use the month batch mode
+    :param bool trace_memory: measure the peak of python allocations with tracemalloc.
+        tracemalloc slows every allocation down - latencies of such a run are not comparable.
+    :return dict: measured results - max_rss_mb is the peak of the whole process (see run_isolated)
+    """
+    first_date, num_days, density = SCENARIOS[name]
+    dates = list(work.date_list(start_date=first_date, end_date=first_date + dt.timedelta(days=num_days - 1)))
+    base_dir = tempfile.mkdtemp(prefix='twu-bench-')
+    try:
+        params = make_params(base_dir)
+        params_file = os.path.join(base_dir, 'params.json')
+        with open(params_file, 'w') as f:
+            f.write(json.dumps(params))
+
+        # every other week day at the office - the timelines are served from the kml cache, no download
+        cache = kmlcache.KMLCache.from_params(params)
+        for i, d in enumerate(dates):
+            cache.put(d, kmlgen.generate_kml(d, WORK_SITE, placemarks=density, at_work=i % 2 == 0, seed=i))
+
+        parse_times = []
+        for i, d in enumerate(dates[:min(len(dates), 10)]):
+            kml_data = cache.get(d)
+            t = time.perf_counter()
+            work.KMLData(kml_data=kml_data).get_work_times(work_fence=geofence.Geofence([WORK_SITE]))
+            parse_times.append(time.perf_counter() - t)
+
+        query_times = []
+        update_times = []
+
+        def timed_query(d):
+            t = time.perf_counter()
+            wd = tw.planner.query(d)
+            query_times.append(time.perf_counter() - t)
+            return wd
+
+        if trace_memory:
+            tracemalloc.start()
+        with mockserver.MockTimewatchServer() as server:
+            t_start = time.perf_counter()
+            with httpbackend.HttpTimewatch(params_file=params_file, url=server.url, batch_month=batch_month) as tw:
+                t_login = time.perf_counter() - t_start
+                for wd in pipeline.prefetch(timed_query, dates, lookahead=lookahead):
+                    t = time.perf_counter()
+                    tw.update_date(wd.date, work_date=wd)
+                    update_times.append(time.perf_counter() - t)
+            total = time.perf_counter() - t_start
+            page_loads = server.page_loads
+        peak_traced = None
+        if trace_memory:
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    return {
+        'scenario': name,
+        'dates': len(dates),
+        'placemarks_per_day': density,
+        'lookahead': lookahead,
+        'batch_month': batch_month,
+        'total_s': total,
+        'dates_per_minute': len(dates) / total * 60,
+        'login_s': t_login,
+        'stages': {
+            'kml_parse': _summary(parse_times),
+            'query_date': _summary(query_times),
+            'update_date': _summary(update_times),
+        },
+        'page_loads': page_loads,
+        'peak_traced_mb': peak_traced / 2 ** 20 if peak_traced is not None else None,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_isolated(name, verbose=False, **kwargs):
+    """
+    Run a single scenario in a new process - its max_rss_mb is the peak of this scenario only.
+
+    :param str name: scenario name, a key of SCENARIOS
+    :param bool verbose: keep debug logging on in the new process
+    :param kwargs: run_scenario arguments
+    :return dict: measured results
+    """
+    # spawned, not forked - a forked child starts with the memory of its parent
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_child, name, verbose, kwargs).result()
+
+
+def _run_child(name, verbose, kwargs):
+    if not verbose:
+        _quiet()
+    return run_scenario(name, **kwargs)
+
+
+def _summary(values):
+    """latency summary in milliseconds"""
+    if not values:
+        return {}
+    values = sorted(values)
+    return {'n': len(values),
+            'mean_ms': statistics.mean(values) * 1000,
+            'p50_ms': values[len(values) // 2] * 1000,
+            'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+            'max_ms': values[-1] * 1000}
+
+
+def print_report(results):
+    for r in results:
+        print('\n== {} - {} dates, {} placemarks/day, lookahead {}{}'.format(
+            r['scenario'], r['dates'], r['placemarks_per_day'], r['lookahead'],
+            ', batch month' if r['batch_month'] else ''))
+        print('   total {:.2f} s | {:.1f} dates/min | login {:.1f} ms | {} page loads | max rss {:.1f} MB{}'.format(
+            r['total_s'], r['dates_per_minute'], r['login_s'] * 1000, r['page_loads'], r['max_rss_mb'],
+            ' | peak traced {:.1f} MB'.format(r['peak_traced_mb']) if r['peak_traced_mb'] is not None else ''))
+        for stage, s in r['stages'].items():
+            if s:
+                print('   {:<12} n={:<4} mean {:8.2f} ms  p50 {:8.2f} ms  p95 {:8.2f} ms  max {:8.2f} ms'.format(
+                    stage, s['n'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['max_ms']))
+
+
+def _quiet():
+    """benchmarks measure the work, not the console - drop the debug output of all modules"""
+    twlog.configure(level='WARNING')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks against the mock TimeWatch server')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--lookahead', type=int, default=3)
+    parser.add_argument('--batch-month', dest='batch_month', action='store_true')
+    parser.add_argument('--trace-memory', dest='trace_memory', action='store_true',
+                        help='also measure peak python allocations (tracemalloc - slows the run down)')
+    parser.add_argument('--json', dest='json_file', help='also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='keep debug logging on')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        _quiet()
+    results = [run_isolated(s, verbose=args.verbose, lookahead=args.lookahead, batch_month=args.batch_month,
+                            trace_memory=args.trace_memory)
+               for s in args.scenario]
+    print_report(results)
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            f.write(json.dumps(results, indent=4))
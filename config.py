@@ -0,0 +1,305 @@
+"""
+This module compiles the JSON parameters file into a validated, read only configuration object.
+The file is checked against SCHEMA once, and every value the per date work needs is derived once:
+parsed work day times, the weekend as a set of weekday numbers, holiday headline sets,
+float work site coordinates, ...
+
+:class:`ConfigFile` reloads the configuration when the file changes, for long running processes.
+"""
+
+import calendar
+import collections
+import json
+import os
+import re
+import threading
+import time
+
+import twlog
+import worktimes
+
+logger = twlog.TimeWatchLogger()
+
+_NUMBER = (int, float)
+_ID = (int, str)
+_LOCATION = {'lat': (_NUMBER + (str,), True), 'long': (_NUMBER + (str,), True)}
+_ENDPOINT = {'rate': (_NUMBER, False), 'burst': (int, False), 'max_concurrency': (int, False),
+             'target_latency_seconds': (_NUMBER, False)}
+_TIME = re.compile(r'^\s*(?P<hour>\d{1,2}):(?P<minute>\d{2})\s*$')
+
+# key -> (spec, required). A spec is a type (or a tuple of types), a nested schema dict,
+# or a list holding the spec of the list items.
+SCHEMA = {
+    'params_version': (str, False),
+    'download_dir': (str, False),
+    'browser_profile': (str, False),
+    'journal_dir': (str, False),
+    'kml_cache': ({'enabled': (bool, False), 'dir': (str, False),
+                   'max_size_mb': (_NUMBER, False), 'max_age_days': (_NUMBER, False)}, False),
+    'takeout': ({'store': (str, False)}, False),
+    'ledger': ({'enabled': (bool, False), 'dir': (str, False)}, False),
+    'session': ({'enabled': (bool, False), 'dir': (str, False), 'max_age_hours': (_NUMBER, False)}, False),
+    'daemon': ({'schedule': ([str], False), 'state_dir': (str, False), 'socket': (str, False)}, False),
+    'requests': ({'timewatch': (_ENDPOINT, False), 'timeline': (_ENDPOINT, False), 'max_attempts': (int, False),
+                  'backoff_seconds': (_NUMBER, False), 'max_backoff_seconds': (_NUMBER, False)}, False),
+    'browsers': ({'max_instances': (int, False), 'max_rss_mb': (_NUMBER, False), 'log_file': (str, False)}, False),
+    'user': ({'company': (_ID, True), 'worker': (_ID, True), 'pswd': (_ID, True), 'token': (_ID, False)}, True),
+    'work': ({
+        'location': (_LOCATION, False),
+        'locations': ([_LOCATION], False),
+        'radius': (_NUMBER, False),
+        'weekend': ([str], True),
+        'work_day': ({
+            'randomize': (bool, True),
+            'max_length': (_NUMBER, True),
+            'nominal_length': (_NUMBER, True),
+            'minimal_start_time': (str, True),
+            'maximal_end_time': (str, True),
+            'start_window_minutes': (int, False),
+            'distribution': (str, False),
+            'seed': (int, False),
+        }, True),
+    }, True),
+    'home': ({'work_from_home_excuse_index': (_ID, True)}, True),
+    'holiday': ({'holiday_eve_index': (_ID, True), 'holiday_eve_text': ([_ID], True),
+                 'holiday_index': (_ID, True), 'holiday_text': ([_ID], True)}, True),
+}
+
+# work day settings - times are minutes after midnight, lengths are minutes
+WorkDay = collections.namedtuple('WorkDay', ['randomize', 'minimal_start', 'maximal_end', 'nominal_length',
+                                             'max_length', 'start_window', 'distribution', 'seed'])
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Config:
+    """
+    Validated parameters with their derived values. Attributes are plain values - read them freely
+    on the per date path. `params` keeps the raw parameters for the components built from them.
+    """
+
+    def __init__(self, params, file_name=None):
+        """
+        :param dict params: parsed JSON parameters file
+        :param str file_name: the file `params` were read from, if any
+        :raise ConfigError: if `params` do not match SCHEMA
+        """
+        errors = _validate(params, SCHEMA, '')
+        if errors:
+            raise ConfigError('invalid parameters{}:\n  {}'.format(
+                ' file ' + file_name if file_name else '', '\n  '.join(errors)))
+        self.params = params
+        self.file_name = file_name
+
+        user = params['user']
+        self.company = str(user['company'])
+        self.worker = str(user['worker'])
+        self.password = str(user['pswd'])
+        self.token = str(user['token']) if 'token' in user else None
+
+        self.download_dir = os.path.expanduser(params['download_dir']) if 'download_dir' in params \
+            else os.path.join(os.path.expanduser('~'), 'Downloads')
+        self.browser_profile = os.path.expanduser(params['browser_profile']) if 'browser_profile' in params \
+            else None
+
+        work = params['work']
+        locations = ([work['location']] if 'location' in work else []) + list(work.get('locations', []))
+        try:
+            self.sites = tuple((float(x['lat']), float(x['long'])) for x in locations)
+        except ValueError:
+            raise ConfigError('work location must have numeric lat and long values')
+        self.radius = float(work.get('radius', 300))
+        day_names = list(calendar.day_name)
+        unknown = [d for d in work['weekend'] if d not in day_names]
+        if unknown:
+            raise ConfigError('unknown weekend days: {}'.format(', '.join(unknown)))
+        self.weekend_days = frozenset(day_names.index(d) for d in work['weekend'])
+
+        work_day = work['work_day']
+        self.work_day = WorkDay(randomize=work_day['randomize'],
+                                minimal_start=_parse_minutes(work_day['minimal_start_time'], 'minimal_start_time'),
+                                maximal_end=_parse_minutes(work_day['maximal_end_time'], 'maximal_end_time'),
+                                nominal_length=int(round(work_day['nominal_length'] * 60)),
+                                max_length=int(round(work_day['max_length'] * 60)),
+                                start_window=work_day.get('start_window_minutes', 180),
+                                distribution=work_day.get('distribution', 'uniform'),
+                                seed=work_day.get('seed'))
+        if self.work_day.randomize:
+            # rejects infeasible work days (and unknown distributions) now, not when the first date is drawn
+            try:
+                worktimes.WorkTimeSampler.from_work_day(self.work_day, seed=0)
+            except ValueError as ex:
+                raise ConfigError('work.work_day: {}'.format(ex))
+
+        self.work_from_home_excuse = _parse_int(params['home']['work_from_home_excuse_index'],
+                                                'home.work_from_home_excuse_index')
+        holiday = params['holiday']
+        self.holiday_index = _parse_int(holiday['holiday_index'], 'holiday.holiday_index')
+        self.holiday_eve_index = _parse_int(holiday['holiday_eve_index'], 'holiday.holiday_eve_index')
+        self.holiday_text = frozenset(_parse_int(x, 'holiday.holiday_text') for x in holiday['holiday_text'])
+        self.holiday_eve_text = frozenset(_parse_int(x, 'holiday.holiday_eve_text')
+                                          for x in holiday['holiday_eve_text'])
+
+        daemon = params.get('daemon', {})
+        self.schedule = tuple(sorted(_parse_minutes(t, 'daemon.schedule') for t in daemon.get('schedule', ['18:00'])))
+        if not self.schedule:
+            raise ConfigError('daemon.schedule must list at least one time')
+        if params.get('browsers', {}).get('max_instances', 1) < 1:
+            raise ConfigError('browsers.max_instances must be at least 1')
+        requests = params.get('requests', {})
+        for name in ('timewatch', 'timeline'):
+            for key in ('burst', 'max_concurrency'):
+                if requests.get(name, {}).get(key, 1) < 1:
+                    raise ConfigError('requests.{}.{} must be at least 1'.format(name, key))
+        if requests.get('max_attempts', 1) < 1:
+            raise ConfigError('requests.max_attempts must be at least 1')
+
+
+def load(file_name):
+    """
+    :param str file_name: JSON parameters file
+    :return Config:
+    """
+    with open(file_name, 'r') as f:
+        try:
+            params = json.loads(f.read())
+        except ValueError as ex:
+            raise ConfigError('{} is not valid JSON: {}'.format(file_name, ex))
+    return Config(params, file_name=file_name)
+
+
+def as_config(params):
+    """
+    :param params: Config, or parsed JSON parameters file
+    :return Config:
+    """
+    return params if isinstance(params, Config) else Config(params)
+
+
+class ConfigFile:
+    """
+    A parameters file that is reloaded when it changes.
+
+    :attr:`current` checks the file modification time at most every `check_interval` seconds.
+    A changed file that fails to load is reported and the previous configuration is kept - the file is loaded
+    again on the following checks, until it loads.
+    """
+
+    def __init__(self, file_name, check_interval=2.0, prepare=None):
+        """
+        :param str file_name: JSON parameters file
+        :param float check_interval: seconds between checks of the file
+        :param prepare: optional function applied to the parsed params before they are compiled
+        """
+        self.file_name = file_name
+        self._check_interval = check_interval
+        self._prepare = prepare
+        self._lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._config = self._load()
+        self._failed_stamp = None
+        self._next_check = time.monotonic() + check_interval
+
+    @property
+    def current(self):
+        """
+        :return Config: the configuration of the current file content
+        """
+        if time.monotonic() >= self._next_check:
+            self.reload()
+        return self._config
+
+    def reload(self, force=False):
+        """
+        Reload the file if it changed since the last load.
+
+        :param bool force: reload even if the file did not change
+        :return bool: True if a new configuration was loaded
+        """
+        with self._lock:
+            self._next_check = time.monotonic() + self._check_interval
+            stamp = self._file_stamp()
+            if stamp == self._stamp and not force:
+                return False
+            try:
+                self._config = self._load()
+            except (OSError, ConfigError) as ex:
+                # reported once per change of the file
+                log = logger.error if stamp != self._failed_stamp else logger.debug
+                log('Parameters file changed but could not be loaded - keeping the previous one: %s', ex)
+                self._failed_stamp = stamp
+                return False
+            self._stamp = stamp
+            self._failed_stamp = None
+            logger.info('Reloaded parameters file %s', self.file_name)
+            return True
+
+    def _load(self):
+        with open(self.file_name, 'r') as f:
+            try:
+                params = json.loads(f.read())
+            except ValueError as ex:
+                raise ConfigError('{} is not valid JSON: {}'.format(self.file_name, ex))
+        if self._prepare is not None:
+            params = self._prepare(params)
+        return Config(params, file_name=self.file_name)
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.file_name)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+
+def _validate(value, spec, path):
+    """
+    :return list: error messages, empty if `value` matches `spec`
+    """
+    if isinstance(spec, dict):
+        if not isinstance(value, dict):
+            return ['{} must be an object'.format(path or 'parameters')]
+        errors = []
+        for key, (sub_spec, required) in spec.items():
+            sub_path = '{}.{}'.format(path, key) if path else key
+            if key not in value:
+                if required:
+                    errors.append('{} is missing'.format(sub_path))
+                continue
+            errors += _validate(value[key], sub_spec, sub_path)
+        for key in value:
+            if key not in spec:
+                logger.warning('Unknown parameter %s is ignored', '{}.{}'.format(path, key) if path else key)
+        return errors
+    if isinstance(spec, list):
+        if not isinstance(value, list):
+            return ['{} must be a list'.format(path)]
+        errors = []
+        for i, item in enumerate(value):
+            errors += _validate(item, spec[0], '{}[{}]'.format(path, i))
+        return errors
+    types = spec if isinstance(spec, tuple) else (spec,)
+    # bool is an int - only accepted where bool is expected
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        return ['{} must be {}'.format(path, ' or '.join(_type_name(t) for t in types))]
+    return []
+
+
+def _type_name(t):
+    return {int: 'an integer', float: 'a number', str: 'a string', bool: 'true or false'}.get(t, t.__name__)
+
+
+def _parse_int(value, name):
+    try:
+        return int(value)
+    except ValueError:
+        raise ConfigError('{} must be an integer, got {}'.format(name, value))
+
+
+def _parse_minutes(text, name):
+    match = _TIME.match(text)
+    if match is None or int(match.group('hour')) > 23 or int(match.group('minute')) > 59:
+        raise ConfigError('{} must be a HH:MM time, got {}'.format(name, text))
+    return int(match.group('hour')) * 60 + int(match.group('minute'))
@@ -0,0 +1,337 @@
+"""
+This module keeps TimeWatch filling as a long running service for a single worker.
+
+The daemon holds one :class:`runner.RangeRunner` - one authenticated TimeWatch session and one timeline browser -
+open for its whole life. On every ``daemon.schedule`` time (i.e. the end of the work day) it fills the dates since
+its watermark - the last date it filled, kept on disk - so a date is processed once, right after it is over.
+A local control socket accepts ad-hoc requests:
+
+    {"command": "run", "start": "01-07-2020", "end": "05-07-2020"}
+    {"command": "catch_up"}
+    {"command": "status"}
+    {"command": "stop"}
+
+Every request is a single JSON line, answered with a single JSON line. Requests are run one at a time,
+in the order they arrive.
+"""
+
+import concurrent.futures
+import datetime as dt
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+import twlog
+import runner
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'daemon')
+COMMANDS = ('run', 'catch_up', 'status', 'stop')
+
+_DATE_FORMAT = '%d-%m-%Y'
+
+
+class Daemon:
+    """
+    Scheduled and on demand filling of a single worker, through a session that is kept warm.
+    """
+
+    def __init__(self, config_file, start_date=None, **run_kwargs):
+        """
+        :param config.ConfigFile config_file: parameters file - ``daemon`` section: ``schedule`` (list of ``HH:MM``
+            times, default 18:00), ``state_dir`` (watermark and socket directory) and ``socket`` (socket file)
+        :param datetime start_date: first date to fill if there is no watermark yet - today if not given
+        :param run_kwargs: passed to runner.RangeRunner (backend, url, lookahead, batch_month, reconcile, seed)
+        """
+        self._config_file = config_file
+        conf = config_file.current
+        settings = conf.params.get('daemon', {})
+        state_dir = os.path.expanduser(settings.get('state_dir', DEFAULT_STATE_DIR))
+        os.makedirs(state_dir, mode=0o700, exist_ok=True)
+        name = '{}-{}'.format(conf.company, conf.worker)
+        self.socket_path = socket_path(conf)
+        self._watermark_file = os.path.join(state_dir, 'watermark-{}.json'.format(name))
+        self._start_date = _day(start_date) if start_date is not None else dt.date.today()
+        self._run_kwargs = run_kwargs
+        # put is reentrant - stop() runs in the SIGTERM handler, maybe while the main thread is in the queue
+        self._jobs = queue.SimpleQueue()
+        # a request is queued and the queue is drained under it - no request is left waiting after the drain
+        self._jobs_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._busy = False
+        self._due = None
+        self._server = None
+        self._runner = None
+
+    def serve(self):
+        """
+        Run until stopped (a ``stop`` request, SIGTERM or Ctrl-C). The dates missed while the daemon was down
+        are filled right away.
+        """
+        self._runner = runner.RangeRunner(self._config_file, **self._run_kwargs)
+        previous_handler = signal.signal(signal.SIGTERM, lambda *args: self.stop())
+        try:
+            self._start_control_socket()
+            self._catch_up()
+            self._due = self.next_run()
+            logger.info('Daemon started - watermark %s, next run at %s', _format(self.watermark()),
+                        self._due.strftime('%Y-%m-%d %H:%M'))
+            while not self._stop.is_set():
+                try:
+                    job = self._jobs.get(timeout=max(0.0, (self._due - dt.datetime.now()).total_seconds()))
+                except queue.Empty:
+                    job = None
+                if job is not None:
+                    self._execute(*job)
+                # a scheduled time that passed during a request is run right after it
+                if dt.datetime.now() >= self._due and not self._stop.is_set():
+                    self._catch_up()
+                    self._due = self.next_run()
+        except KeyboardInterrupt:
+            logger.info('Interrupted')
+        finally:
+            # before setting the event - the handler would set it too, reentering its lock
+            signal.signal(signal.SIGTERM, previous_handler)
+            self._stop.set()
+            self._stop_control_socket()
+            self._cancel_jobs()
+            self._runner.close()
+            logger.info('Daemon stopped')
+
+    def stop(self):
+        """
+        Stop after the current request - the ones still queued are answered with an error.
+        """
+        self._stop.set()
+        # wakes the main loop up
+        self._jobs.put(None)
+
+    def submit(self, request):
+        """
+        Queue a control request and wait for its result.
+
+        :param dict request: see the module documentation
+        :return dict: the answer - ``ok`` and either the result of the command or ``error``
+        """
+        command = request.get('command')
+        if command not in COMMANDS:
+            return {'ok': False, 'error': 'unknown command {} (expected one of {})'.format(command,
+                                                                                        ', '.join(COMMANDS))}
+        if command == 'status':
+            return {'ok': True, 'watermark': _format(self.watermark()), 'busy': self._busy,
+                    'next_run': (self._due or self.next_run()).strftime('%Y-%m-%d %H:%M'),
+                    'queued': self._jobs.qsize()}
+        if command == 'stop':
+            self.stop()
+            return {'ok': True}
+        future = concurrent.futures.Future()
+        with self._jobs_lock:
+            if self._stop.is_set():
+                return {'ok': False, 'error': 'the daemon is stopping'}
+            self._jobs.put((request, future))
+        return future.result()
+
+    def watermark(self):
+        """
+        :return date: last date filled by the schedule, or None
+        """
+        try:
+            with open(self._watermark_file, 'r') as f:
+                return dt.datetime.strptime(json.loads(f.read())['watermark'], '%Y-%m-%d').date()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def next_run(self, now=None):
+        """
+        :param datetime now: time to compute the next run from - now if not given
+        :return datetime: the next scheduled time
+        """
+        now = now if now is not None else dt.datetime.now()
+        schedule = self._config_file.current.schedule
+        midnight = dt.datetime(now.year, now.month, now.day)
+        for minutes in schedule:
+            t = midnight + dt.timedelta(minutes=minutes)
+            if t > now:
+                return t
+        return midnight + dt.timedelta(days=1, minutes=schedule[0])
+
+    def _execute(self, request, future):
+        self._busy = True
+        try:
+            if request['command'] == 'catch_up':
+                result = self._catch_up()
+            else:
+                start = dt.datetime.strptime(request['start'], _DATE_FORMAT)
+                end = dt.datetime.strptime(request.get('end', request['start']), _DATE_FORMAT)
+                if start > end:
+                    raise ValueError('start date is after end date')
+                result = {'ok': True, 'handled': self._fill(start, end)}
+        except Exception as ex:
+            logger.error('Request %s failed: %s', json.dumps(request), ex)
+            result = {'ok': False, 'error': '{}: {}'.format(type(ex).__name__, ex)}
+        finally:
+            self._busy = False
+        future.set_result(result)
+
+    def _catch_up(self):
+        """
+        Fill the dates after the watermark - up to today once the first scheduled time of today passed,
+        otherwise up to yesterday - and move the watermark.
+
+        :return dict: the answer of a ``catch_up`` request
+        """
+        now = dt.datetime.now()
+        first_run = dt.datetime(now.year, now.month, now.day) + dt.timedelta(
+            minutes=self._config_file.current.schedule[0])
+        end = now.date() if now >= first_run else now.date() - dt.timedelta(days=1)
+        watermark = self.watermark()
+        start = watermark + dt.timedelta(days=1) if watermark is not None else self._start_date
+        if start > end:
+            logger.debug('Nothing to fill - watermark %s', _format(watermark))
+            return {'ok': True, 'handled': 0, 'watermark': _format(watermark)}
+        try:
+            handled = self._fill(_datetime(start), _datetime(end))
+        except Exception as ex:
+            logger.error('Scheduled fill of %s to %s failed: %s', start, end, ex)
+            return {'ok': False, 'error': '{}: {}'.format(type(ex).__name__, ex)}
+        self._save_watermark(end)
+        return {'ok': True, 'handled': handled, 'watermark': _format(end)}
+
+    def _fill(self, start, end):
+        t = time.perf_counter()
+        try:
+            handled = self._runner.run(start, end)
+        except Exception:
+            # the session may be left on any page - the next range starts a new one
+            self._runner.close_session()
+            raise
+        logger.info('Filled %s to %s: %d dates in %.2f seconds', start.strftime(_DATE_FORMAT),
+                    end.strftime(_DATE_FORMAT), handled, time.perf_counter() - t)
+        return handled
+
+    def _cancel_jobs(self):
+        with self._jobs_lock:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    return
+                if job is not None:
+                    job[1].set_result({'ok': False, 'error': 'the daemon stopped'})
+
+    def _save_watermark(self, date):
+        tmp = self._watermark_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'watermark': date.strftime('%Y-%m-%d')}))
+        os.replace(tmp, self._watermark_file)
+
+    def _start_control_socket(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            logger.warning('No unix sockets on this platform - the daemon runs without a control socket')
+            return
+        self._remove_stale_socket()
+        self._server = _ControlServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._server.serve_forever, name='daemon-control', daemon=True).start()
+        logger.info('Control socket %s', self.socket_path)
+
+    def _remove_stale_socket(self):
+        """
+        Remove the socket file left by a daemon that did not stop cleanly.
+
+        :raises RuntimeError: if a daemon still answers on the socket, or the file is not a socket
+        """
+        try:
+            mode = os.lstat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError('{} exists and is not a socket'.format(self.socket_path))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(self.socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                logger.debug('removing stale control socket %s', self.socket_path)
+                os.remove(self.socket_path)
+                return
+        raise RuntimeError('a daemon is already running on {}'.format(self.socket_path))
+
+    def _stop_control_socket(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('a request is a JSON object')
+            answer = self.server.daemon.submit(request)
+        except ValueError as ex:
+            answer = {'ok': False, 'error': 'bad request: {}'.format(ex)}
+        self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _ControlServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, daemon):
+            self.daemon = daemon
+            super().__init__(path, _ControlHandler)
+
+
+def socket_path(conf):
+    """
+    :param config.Config conf: configuration of the worker
+    :return str: control socket file of the worker's daemon
+    """
+    settings = conf.params.get('daemon', {})
+    if 'socket' in settings:
+        return os.path.expanduser(settings['socket'])
+    return os.path.join(os.path.expanduser(settings.get('state_dir', DEFAULT_STATE_DIR)),
+                        'twu-{}-{}.sock'.format(conf.company, conf.worker))
+
+
+def request(path, message, timeout=None):
+    """
+    Send a request to a running daemon.
+
+    :param str path: control socket file
+    :param dict message: the request, see the module documentation
+    :param float timeout: seconds to wait for the answer - forever if not given
+    :return dict: the answer
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        with s.makefile('rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
+
+
+def _day(date):
+    return date.date() if isinstance(date, dt.datetime) else date
+
+
+def _datetime(date):
+    return dt.datetime(date.year, date.month, date.day)
+
+
+def _format(date):
+    return date.strftime('%Y-%m-%d') if date is not None else None
@@ -0,0 +1,292 @@
+"""
+This module manages the browser used for Google timeline downloads.
+A single browser is kept for all the downloads of a run, and download completion is detected
+through file system events (inotify on Linux) with a polling fallback on other systems.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import select
+import threading
+import time
+
+import twlog
+import supervisor
+
+logger = twlog.TimeWatchLogger()
+
+PARTIAL_SUFFIX = '.crdownload'
+# seconds for a download to start - a throttled or failed timeline request never does
+START_TIMEOUT = 120
+# every download leaves a tab open in the running browser - it is restarted after this many
+MAX_DOWNLOADS_PER_BROWSER = 50
+
+
+class DownloadTimeout(RuntimeError):
+    pass
+
+
+def chrome_command():
+    """
+    Command that starts chrome on the current os.
+
+    :return list: chrome executable (and arguments) without the url
+    """
+    if platform.system() == 'Linux':
+        return ['google-chrome']
+    elif platform.system() == 'Windows':
+        return ["C:\\Program Files (x86)\\Google\\Chrome\\Application\\chrome.exe"]
+    else:
+        raise ValueError(f'{platform.system()} is not a supported os')
+
+
+class DownloadManager:
+    """
+    Downloads files through one long lived chrome instance and waits for them to complete.
+
+    The first download starts the browser. Following downloads hand their url to the running
+    browser (chrome forwards a new launch to the existing instance), so only one cold start is paid.
+    Thread safe - downloads of several files may be waited for concurrently.
+
+    With a `profile_dir` the browser runs on its own chrome profile (and so as its own instance,
+    logged into its own google account) and saves the downloads into `download_dir`.
+    Without it the default profile and its download folder are used.
+
+    The browser is started through the process supervisor (see supervisor.BrowserSupervisor), and is restarted
+    between two downloads once its process tree uses more than the supervisor's ``max_rss_mb``, or once it
+    opened `max_downloads` downloads. A restart waits for the downloads still running in the browser.
+    """
+
+    def __init__(self, download_dir, timeout=500, poll_interval=0.1, profile_dir=None, start_timeout=START_TIMEOUT,
+                 max_downloads=MAX_DOWNLOADS_PER_BROWSER):
+        self._download_dir = download_dir
+        self._profile_dir = profile_dir
+        self._timeout = timeout
+        self._start_timeout = start_timeout
+        self._max_downloads = max_downloads
+        self._browser = None
+        self._browser_downloads = 0
+        self._launchers = []
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # downloads opened and not finished yet - notified when one finishes
+        self._in_flight = 0
+        self._finished = threading.Condition(self._lock)
+        self._watcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        """
+        Stop watching the download directory and close the download browser.
+        """
+        with self._lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+            if self._browser is not None:
+                logger.debug('closing download browser')
+                supervisor.supervisor().stop(self._browser)
+            self._browser = None
+            for p in self._launchers:
+                supervisor.supervisor().stop(p)
+            self._launchers = []
+
+    def download(self, url, file_name):
+        """
+        Open `url` in the download browser and wait for `file_name` to be fully written.
+
+        :param str url: download link
+        :param str file_name: full path of the file the browser saves
+        :return str: file_name
+        """
+        watcher = self._open(url)
+        try:
+            watcher.wait_for(file_name, timeout=self._timeout, start_timeout=self._start_timeout)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._finished.notify_all()
+        logger.debug('Finished kml file download: %s', file_name)
+        return file_name
+
+    def _open(self, url):
+        with self._lock:
+            if self._watcher is None:
+                # watch before the browser starts so no file event is missed
+                self._watcher = DirectoryWatcher(self._download_dir, poll_interval=self._poll_interval)
+            command = chrome_command()
+            if self._profile_dir is not None:
+                _prepare_profile(self._profile_dir, self._download_dir)
+                command.append('--user-data-dir={}'.format(self._profile_dir))
+            processes = supervisor.supervisor()
+            if self._restart_reason(processes) is not None:
+                # a download running in the browser would never finish in the next one
+                while self._in_flight:
+                    self._finished.wait()
+                # another download may have restarted it meanwhile
+                reason = self._restart_reason(processes)
+                if reason is not None:
+                    logger.info('download browser %s - restarting it', reason)
+                    processes.stop(self._browser)
+                    self._browser = None
+            if self._browser is None or self._browser.poll() is not None:
+                if self._browser is not None:
+                    processes.stop(self._browser)
+                self._browser = processes.start(command + [url], name='download browser')
+                self._browser_downloads = 1
+            else:
+                self._browser_downloads += 1
+                # the running browser takes the url over and this launcher exits right away
+                for p in [p for p in self._launchers if p.poll() is not None]:
+                    processes.stop(p)
+                self._launchers = [p for p in self._launchers if p.poll() is None]
+                self._launchers.append(processes.start(command + [url], name='download launcher', counted=False))
+            self._in_flight += 1
+            return self._watcher
+
+    def _restart_reason(self, processes):
+        """
+        :return str: why the running browser should be restarted before the next download - None if it should not
+        """
+        if self._browser is None:
+            return None
+        if processes.over_limit(self._browser):
+            # renderers of past downloads are never given back - a new browser starts small again
+            return 'uses {:.0f} MB'.format(self._browser.rss_mb)
+        if self._browser_downloads >= self._max_downloads:
+            # the tabs of past downloads are never closed
+            return 'opened {} downloads'.format(self._browser_downloads)
+        return None
+
+
+def _prepare_profile(profile_dir, download_dir):
+    """
+    Point the downloads of a chrome profile to `download_dir`, without a save-as prompt.
+    Other preferences of an existing profile are kept.
+    """
+    preferences_file = os.path.join(profile_dir, 'Default', 'Preferences')
+    os.makedirs(os.path.dirname(preferences_file), exist_ok=True)
+    os.makedirs(download_dir, exist_ok=True)
+    try:
+        with open(preferences_file, 'r') as f:
+            preferences = json.loads(f.read())
+    except (OSError, ValueError):
+        preferences = {}
+    download = preferences.setdefault('download', {})
+    if download.get('default_directory') == download_dir and download.get('prompt_for_download') is False:
+        return
+    download.update({'default_directory': download_dir, 'prompt_for_download': False})
+    with open(preferences_file, 'w') as f:
+        f.write(json.dumps(preferences))
+
+
+class DirectoryWatcher:
+    """
+    Wakes up waiters whenever a file in a directory is created, written or renamed.
+    Uses inotify when available, otherwise waiters simply poll every `poll_interval` seconds.
+    """
+
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory, poll_interval=0.1):
+        self._directory = directory
+        self._poll_interval = poll_interval
+        self._changed = threading.Condition()
+        self._closed = threading.Event()
+        self._fd = self._inotify_watch(directory)
+        self._thread = None
+        if self._fd is not None:
+            self._thread = threading.Thread(target=self._read_events, name='kml-download-watcher', daemon=True)
+            self._thread.start()
+            logger.debug('watching %s with inotify', directory)
+        else:
+            logger.debug('watching %s by polling every %s seconds', directory, poll_interval)
+
+    def wait_for(self, file_name, timeout, start_timeout=None):
+        """
+        Block until `file_name` exists and has no partial (`.crdownload`) counterpart.
+        The timeout is counted from the last time the partial file grew, so a slow but
+        progressing download is not aborted.
+
+        :param str file_name: full path of the expected file
+        :param float timeout: seconds to wait without any progress
+        :param float start_timeout: seconds to wait for the download to start - `timeout` if not given
+        :raises DownloadTimeout: if the download did not start within `start_timeout` seconds,
+            or no progress was seen for `timeout` seconds
+        """
+        partial_name = file_name + PARTIAL_SUFFIX
+        partial_size = None
+        start_timeout = timeout if start_timeout is None else min(timeout, start_timeout)
+        deadline = time.monotonic() + start_timeout
+        # with inotify the wait is woken by events - the timeout is only a safety net
+        wake_interval = 1.0 if self._fd is not None else self._poll_interval
+        with self._changed:
+            while True:
+                if os.path.exists(file_name) and not os.path.exists(partial_name):
+                    return
+                try:
+                    size = os.path.getsize(partial_name)
+                    if size != partial_size:
+                        if partial_size is None:
+                            logger.debug('download of %s started', file_name)
+                        partial_size = size
+                        deadline = time.monotonic() + timeout
+                except OSError:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if partial_size is None:
+                        raise DownloadTimeout('download of {} did not start within {} seconds'.format(
+                            file_name, start_timeout))
+                    raise DownloadTimeout(
+                        'more that {} seconds waiting for file to be download - stopping'.format(timeout))
+                self._changed.wait(min(remaining, wake_interval))
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _inotify_watch(self, directory):
+        if platform.system() != 'Linux':
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _read_events(self):
+        while not self._closed.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                os.read(self._fd, 4096)
+            except BlockingIOError:
+                continue
+            with self._changed:
+                self._changed.notify_all()
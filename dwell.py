@@ -0,0 +1,106 @@
+"""
+This module computes the time spent at work out of timeline records.
+
+Every record is a time interval, tagged inside or outside work by the geofence. Inside intervals are merged
+into stays with a sort and sweep (O(n log n), vectorized with numpy). The gap between two stays is kept only
+if the timeline shows the worker somewhere else meanwhile - a stretch without any data does not count as leaving.
+
+Stays belong to the (local) day they start on: a stay that crosses midnight is part of its first day,
+and its departure is on the next day.
+"""
+
+import datetime as dt
+from collections import namedtuple
+
+import numpy as np
+
+DayDwell = namedtuple('DayDwell', ['date', 'arrival', 'departure', 'dwell', 'gaps'])
+DayDwell.__doc__ = """
+Time at work of a single day.
+`arrival` and `departure` are timezone aware (local) datetime objects, `dwell` is the timedelta spent at work
+between them and `gaps` is a list of (left, returned) datetime tuples.
+"""
+
+
+def analyze(placemarks, work_fence, min_gap=0.0):
+    """
+    Time at work of every day of the placemarks.
+
+    :param list placemarks: list of kmlparse.Placemark
+    :param Geofence work_fence: work sites and radius
+    :param float min_gap: gaps shorter than this many seconds are not counted as leaving
+    :return dict: date -> DayDwell, for the days with time at work
+    """
+    if not placemarks:
+        return {}
+    count = len(placemarks)
+    begins = np.fromiter((p.begin.timestamp() for p in placemarks), dtype=np.float64, count=count)
+    ends = np.fromiter((p.end.timestamp() for p in placemarks), dtype=np.float64, count=count)
+    ends = np.maximum(ends, begins)
+    inside = work_fence.contains(np.fromiter((p.lon for p in placemarks), dtype=np.float64, count=count),
+                                 np.fromiter((p.lat for p in placemarks), dtype=np.float64, count=count))
+    stay_begins, stay_ends = stays(begins[inside], ends[inside], begins[~inside], ends[~inside], min_gap=min_gap)
+    return by_day(stay_begins, stay_ends)
+
+
+def merge(begins, ends):
+    """
+    Union of intervals - sorted by begin, then swept once. Touching or overlapping intervals are joined.
+
+    :param begins: array of interval begins
+    :param ends: array of interval ends
+    :return tuple: (begins, ends) arrays of the disjoint intervals of the union, in order
+    """
+    if not len(begins):
+        return np.zeros(0), np.zeros(0)
+    order = np.argsort(begins, kind='stable')
+    begins, ends = begins[order], ends[order]
+    # the furthest end reached so far - an interval beginning after it starts a new group
+    reach = np.maximum.accumulate(ends)
+    first = np.flatnonzero(np.concatenate(([True], begins[1:] > reach[:-1])))
+    return begins[first], np.maximum.reduceat(ends, first)
+
+
+def stays(inside_begins, inside_ends, outside_begins, outside_ends, min_gap=0.0):
+    """
+    Stays at work - the merged inside intervals, joined across gaps where the worker was not seen outside.
+
+    :param inside_begins: begins of the intervals at work
+    :param inside_ends: ends of the intervals at work
+    :param outside_begins: begins of the intervals away from work
+    :param outside_ends: ends of the intervals away from work
+    :param float min_gap: gaps shorter than this many seconds are joined as well
+    :return tuple: (begins, ends) arrays of the stays, in order
+    """
+    begins, ends = merge(inside_begins, inside_ends)
+    if len(begins) < 2:
+        return begins, ends
+    away_begins, away_ends = merge(outside_begins, outside_ends)
+    gap_begins, gap_ends = ends[:-1], begins[1:]
+    if len(away_begins):
+        # the first away interval that ends after the gap begins - the worker was away if it begins before the gap ends
+        j = np.minimum(np.searchsorted(away_ends, gap_begins, side='right'), len(away_begins) - 1)
+        away = (away_ends[j] > gap_begins) & (away_begins[j] < gap_ends)
+    else:
+        away = np.zeros(len(gap_begins), dtype=bool)
+    away &= gap_ends - gap_begins >= min_gap
+    first = np.flatnonzero(np.concatenate(([True], away)))
+    return begins[first], np.maximum.reduceat(ends, first)
+
+
+def by_day(stay_begins, stay_ends):
+    """
+    :param stay_begins: begins of the stays (unix time), in order
+    :param stay_ends: ends of the stays (unix time)
+    :return dict: date -> DayDwell - every stay is part of the local day it begins on
+    """
+    days = {}
+    for b, e in zip(stay_begins.tolist(), stay_ends.tolist()):
+        begin = dt.datetime.fromtimestamp(b).astimezone()
+        days.setdefault(begin.date(), []).append((begin, dt.datetime.fromtimestamp(e).astimezone()))
+    return {day: DayDwell(date=day,
+                          arrival=s[0][0],
+                          departure=s[-1][1],
+                          dwell=sum((e - b for b, e in s), dt.timedelta()),
+                          gaps=[(s[i][1], s[i + 1][0]) for i in range(len(s) - 1)])
+            for day, s in days.items()}
@@ -0,0 +1,128 @@
+"""
+This module reads and writes the TimeWatch date edit page in a fixed number of browser round-trips.
+A single injected script gathers everything a date needs from the page (headline, hour fields, excuse options
+and the update button) into an :class:`EditPage` snapshot. Writes are collected on the snapshot and applied
+together by a second script, right before the update button is clicked.
+"""
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+HOUR_FIELDS = ['{}{}'.format(e, row) for row in range(4) for e in ('ehh', 'xhh', 'emm', 'xmm')]
+HEADLINE_XPATH = '/html/body/div/span/form/table/tbody/tr[7]/td/table/tbody/tr/td[2]/font[2]/b'
+
+_UPDATE_BUTTONS = r"""
+function updateButtons() {
+    return Array.prototype.filter.call(document.getElementsByTagName('input'), function (e) {
+        return (e.src || '').indexOf('update.jpg') >= 0;
+    });
+}
+"""
+
+_READ_SCRIPT = _UPDATE_BUTTONS + r"""
+var headline = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+    .singleNodeValue;
+var fields = {};
+arguments[1].forEach(function (id) {
+    var e = document.getElementById(id);
+    if (e) { fields[id] = e.value; }
+});
+var excuse = document.getElementsByName('excuse')[0];
+return {
+    login: document.getElementById('compKeyboard') !== null,
+    headline: headline ? headline.innerText : null,
+    fields: fields,
+    excuse_options: excuse ? Array.prototype.map.call(excuse.options, function (o) { return o.text; }) : [],
+    excuse_index: excuse ? excuse.selectedIndex : -1,
+    update_buttons: updateButtons().length
+};
+"""
+
+_APPLY_SCRIPT = _UPDATE_BUTTONS + r"""
+var values = arguments[0];
+Object.keys(values).forEach(function (id) {
+    var e = document.getElementById(id);
+    if (e) {
+        e.value = values[id];
+        e.dispatchEvent(new Event('input', {bubbles: true}));
+        e.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+});
+if (arguments[1] !== null) {
+    var excuse = document.getElementsByName('excuse')[0];
+    excuse.selectedIndex = arguments[1];
+    excuse.dispatchEvent(new Event('change', {bubbles: true}));
+}
+var buttons = updateButtons();
+return buttons.length ? buttons[0] : null;
+"""
+
+
+class EditPage:
+    """
+    Snapshot of a loaded date edit page, and the writes pending for it.
+    """
+
+    def __init__(self, snapshot):
+        """
+        :param dict snapshot: result of the read script, see :meth:`read`
+        """
+        self.login_page = snapshot['login']
+        self.headline = snapshot['headline'] or ''
+        self.fields = dict(snapshot['fields'])
+        self.excuse_options = [text.strip() for text in snapshot['excuse_options']]
+        self.excuse_index = snapshot['excuse_index']
+        self.update_buttons = snapshot['update_buttons']
+        self._values = {}
+        self._excuse = None
+
+    @classmethod
+    def read(cls, driver):
+        """
+        Snapshot the current page of `driver` - a single round-trip.
+
+        :param driver: selenium web driver, on a date edit page
+        :return EditPage:
+        """
+        return cls(driver.execute_script(_READ_SCRIPT, HEADLINE_XPATH, HOUR_FIELDS))
+
+    def clear_hours(self):
+        for element_id in HOUR_FIELDS:
+            self._values[element_id] = ''
+
+    def value(self, element_id):
+        """
+        :return str: value of a field - with the pending writes
+        """
+        return self._values.get(element_id, self.fields.get(element_id, ''))
+
+    def type_value(self, element_id, value):
+        """
+        Append `value` to a field, like typing it in.
+
+        :param str element_id: id of the field
+        :param value: typed text
+        """
+        self._values[element_id] = self.value(element_id) + str(value)
+
+    def select_excuse(self, excuse_index):
+        """
+        :param int excuse_index: index of the option in the excuse list
+        """
+        self._excuse = excuse_index
+        logger.debug('Set excuse %s', self.excuse_options[excuse_index])
+
+    def submit(self, driver):
+        """
+        Apply the pending writes in one round-trip, then click the update button.
+        The click stays a native one, so the driver waits for the submitted page to load.
+
+        :param driver: selenium web driver, still on the snapshot page
+        """
+        button = driver.execute_script(_APPLY_SCRIPT, self._values, self._excuse)
+        if button is None:
+            raise ValueError('no update button found')
+        button.click()
+        self._values = {}
+        self._excuse = None
@@ -0,0 +1,52 @@
+"""
+This module decides whether locations are at work.
+All coordinates are checked at once with numpy: the haversine distance of every coordinate
+to every work site is computed in one batched operation and compared to a radius in meters.
+"""
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # meters, mean earth radius
+
+
+class Geofence:
+    """
+    Circles of `radius` meters around one or more work sites.
+    """
+
+    def __init__(self, sites, radius=300):
+        """
+        :param list sites: list of (lat, long) tuples in decimal degrees
+        :param float radius: distance in meters from a site that still counts as being at work
+        """
+        if not len(sites):
+            raise ValueError('geofence requires at least one work site')
+        sites = np.radians(np.asarray(sites, dtype=np.float64).reshape(-1, 2))
+        self._site_lats = sites[:, 0]
+        self._site_longs = sites[:, 1]
+        self._cos_site_lats = np.cos(self._site_lats)
+        self.radius = float(radius)
+
+    def distances(self, longs, lats):
+        """
+        Haversine distance of every coordinate to every work site.
+
+        :param longs: array like of longitudes in decimal degrees
+        :param lats: array like of latitudes in decimal degrees
+        :return: numpy array of shape (number of coordinates, number of sites) in meters
+        """
+        longs = np.radians(np.asarray(longs, dtype=np.float64))[:, np.newaxis]
+        lats = np.radians(np.asarray(lats, dtype=np.float64))[:, np.newaxis]
+        h = (np.sin((lats - self._site_lats) / 2) ** 2
+             + np.cos(lats) * self._cos_site_lats * np.sin((longs - self._site_longs) / 2) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+    def contains(self, longs, lats):
+        """
+        :param longs: array like of longitudes in decimal degrees
+        :param lats: array like of latitudes in decimal degrees
+        :return: boolean numpy array - True for every coordinate within radius of any work site
+        """
+        if not len(longs):
+            return np.zeros(0, dtype=bool)
+        return (self.distances(longs, lats) <= self.radius).any(axis=1)
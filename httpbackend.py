@@ -0,0 +1,349 @@
+"""
+This module fills TimeWatch over plain HTTP instead of driving a browser.
+Pages are fetched and forms are posted through one pooled keep-alive session.
+The decision logic is inherited from :class:`web.Timewatch` - only the page primitives differ.
+"""
+
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import twlog
+import web
+import editpage
+import sessionstore
+import pacing
+
+import datetime as dt
+
+logger = twlog.TimeWatchLogger()
+
+# seconds to connect, and to wait for the answer
+REQUEST_TIMEOUT = (10, 60)
+
+
+class HttpTimewatch(web.Timewatch):
+    """
+    Drop-in replacement of :class:`web.Timewatch` that logs in and posts the ``editwh2.php``
+    form directly. Same ``update_date`` contract, no browser.
+    Every request goes through the shared pacing.RequestScheduler (``timewatch`` endpoint).
+    """
+
+    def _start_session(self, chrome_driver_path: str) -> None:
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._page = None
+        self._form = None
+        self._form_templates = {}
+        self._token_page = ''
+
+    def _close_session(self) -> None:
+        self._session.close()
+
+    def login_into_time_watch(self) -> None:
+        """
+        Login into Timewatch website by posting the login form.
+        user login information from params file
+
+        :return: Nothing
+        """
+        logger.debug('Try to login to %s', self._url)
+        response = self._request('get', self._url)
+        response.raise_for_status()
+        page = _parse_page(response)
+        form = page.form_with_input('compKeyboard')
+        if form is None:
+            raise ValueError('no login form found in {}'.format(self._url))
+        form.set_value('compKeyboard', self.config.company)
+        form.set_value('nameKeyboard', self.config.worker)
+        form.set_value('pwKeyboard', self.config.password)
+        response = self._submit(form)
+        self._token_page = response.text
+        logger.info('Logged in for worker %s', self.config.worker)
+
+    def _set_token(self) -> None:
+        """
+        checks if user token has already been processed. if so, does nothing.
+        if not, recovers the user token from the page received after login.
+        :return: Nothing
+        """
+        if self._token is not None:
+            logger.debug('user token already set')
+            return
+        logger.debug('setting user token')
+        self._token = web._token_from_page(self._token_page)
+
+    def _session_cookies(self) -> list:
+        return [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires,
+                 'secure': bool(c.secure)} for c in self._session.cookies]
+
+    def _restore_cookies(self, cookies: list) -> None:
+        self._session.cookies.clear()
+        for c in cookies:
+            self._session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                                      expires=c['expires'], secure=c['secure'])
+
+    def _load_date_page(self, date: dt.datetime) -> None:
+        template = self._form_templates.get((date.year, date.month))
+        if template is not None and self._month_table(date) is not None:
+            # the month overview already has the headline - no need to get the edit page again
+            self._form = template.for_date(date)
+            self._form.select_text('excuse', self._month_table(date)[date].excuse)
+            return
+        self._page = self._get_page(self._generate_specific_date_url(edit_date=date))
+        self._form = self._page.form_with_input('ehh0')
+        if self._form is None:
+            raise ValueError('no edit form for date {}'.format(date.strftime('%d-%m-%Y')))
+        self._form.date = date
+        if self._batch_month and self._form.rebuildable():
+            self._form_templates[(date.year, date.month)] = self._form.for_date(date)
+
+    def forget_months(self) -> None:
+        super().forget_months()
+        self._form_templates = {}
+
+    def _get_page_source(self, url: str) -> str:
+        return self._get(url).text
+
+    def _get_date_text_ascii(self) -> list:
+        return [ord(x) for x in self._page.headline.strip()]
+
+    def _clear_all_hours(self) -> None:
+        for element_id in editpage.HOUR_FIELDS:
+            self._form.set_value(element_id, '')
+
+    def _enter_value(self, element_id: str, value: str) -> None:
+        element_id = '{}0'.format(element_id)
+        self._form.set_value(element_id, str(self._form.value(element_id)) + str(value))
+
+    def _get_excuse_texts(self) -> list:
+        return [text.strip() for _, text in self._form.selects.get('excuse', [])]
+
+    def _set_excuse_value(self, excuse_index: int) -> None:
+        if excuse_index:
+            options = self._form.selects['excuse']
+            self._form.fields['excuse'] = options[excuse_index][0]
+            logger.debug('Set excuse %s', options[excuse_index][1])
+
+    def _click_enter(self) -> None:
+        if len(self._form.update_buttons) > 1:
+            raise web.TooManyUpdateButtons('too many inputs with update.jpg image found')
+        self._submit(self._form)
+        self._form = None
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a request through the scheduler - again after a backoff on a connection error, a timeout
+        or a throttled answer. Form posts are sent again as well: they set the same values again.
+        """
+        def send():
+            response = self._session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            if response.status_code in pacing.RETRY_STATUSES:
+                raise pacing.Throttled('{} {}'.format(response.status_code, url),
+                                       retry_after=pacing.retry_after(response.headers.get('Retry-After')))
+            return response
+        return pacing.scheduler().call('timewatch', send,
+                                       retry_on=(requests.ConnectionError, requests.Timeout))
+
+    def _get(self, url):
+        response = self._request('get', url)
+        if response.status_code in (401, 403) or web._is_login_page(response.text):
+            raise sessionstore.SessionRejected(url)
+        response.raise_for_status()
+        return response
+
+    def _get_page(self, url):
+        return _parse_page(self._get(url))
+
+    def _submit(self, form):
+        url = urljoin(form.page_url, form.action)
+        if form.method == 'get':
+            response = self._request('get', url, params=form.fields)
+        else:
+            response = self._request('post', url, data=form.fields)
+        response.raise_for_status()
+        return response
+
+
+class Form:
+    """
+    Values of an html form, as the browser would submit them.
+    Inputs are addressed by their id (as in the selenium backend) and submitted by name.
+    """
+
+    def __init__(self, action, method):
+        self.action = action
+        self.method = method
+        self.page_url = ''
+        self.date = None
+        self.fields = {}
+        self.ids = {}
+        self.selects = {}
+        self.update_buttons = []
+        # names of the fields a user edits - text inputs, selects and text areas
+        self.visible = set()
+
+    def rebuildable(self):
+        """
+        :return bool: True if the only values of this (edit) form that belong to its date are the hours and
+            the excuse - the ones :meth:`for_date` forms get back from the month overview
+        """
+        known = set(self.ids.get(i, i) for i in editpage.HOUR_FIELDS) | {'excuse'}
+        return self.visible <= known
+
+    def for_date(self, date):
+        """
+        Pristine copy of this (edit) form for another date of the same month: the hidden fields, with the ones
+        holding this form's date (or the day after, as in the edit url) moved to `date`, empty hours and the
+        first excuse. None of the values of this form's date are carried over.
+
+        :param datetime date: date of the new form
+        :return Form: new form with the same hidden fields and options
+        """
+        form = Form(action=self.action, method=self.method)
+        form.page_url = self.page_url
+        form.ids = self.ids
+        form.selects = self.selects
+        form.update_buttons = self.update_buttons
+        form.visible = self.visible
+        form.date = date
+        replace = {}
+        if self.date is not None:
+            replace = {_url_date(self.date, 0): _url_date(date, 0), _url_date(self.date, 1): _url_date(date, 1)}
+        form.fields = {k: replace.get(v, v) for k, v in self.fields.items() if k not in self.visible}
+        for name in self.visible:
+            options = self.selects.get(name)
+            form.fields[name] = options[0][0] if options else ''
+        return form
+
+    def select_text(self, name, text):
+        """
+        Select the option of select `name` whose text is `text` - the first option if none matches.
+        """
+        options = self.selects.get(name)
+        if options:
+            self.fields[name] = next((v for v, t in options if t.strip() == text.strip()), options[0][0])
+
+    def set_value(self, element_id, value):
+        self.fields[self.ids.get(element_id, element_id)] = value
+
+    def value(self, element_id):
+        return self.fields.get(self.ids.get(element_id, element_id), '')
+
+
+def _parse_page(response):
+    page = PageParser()
+    page.feed(response.text)
+    page.close()
+    page.url = response.url
+    return page
+
+
+def _url_date(date, day_offset):
+    """date as written in the edit url - day_offset days later, as the url end date is"""
+    date = date + dt.timedelta(days=day_offset)
+    return '{}-{}-{}'.format(date.year, date.month, date.day)
+
+
+class PageParser(HTMLParser):
+    """
+    Collects the forms of a page and its headline (the bold text inside a ``font`` element
+    of the edit form, which holds the day description).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.url = ''
+        self.forms = []
+        self.headline = ''
+        self._form = None
+        self._select = None
+        self._option = None
+        self._font_depth = 0
+        self._bold = None
+
+    def form_with_input(self, element_id):
+        for form in self.forms:
+            if element_id in form.ids:
+                form.page_url = self.url
+                return form
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self._form = Form(action=attrs.get('action', ''), method=attrs.get('method', 'get').lower())
+            self.forms.append(self._form)
+        elif tag == 'font':
+            self._font_depth += 1
+        elif tag == 'b' and self._font_depth and self._form is not None:
+            self._bold = ''
+        elif self._form is None:
+            return
+        elif tag == 'input':
+            name = attrs.get('name')
+            if 'id' in attrs and name:
+                self._form.ids[attrs['id']] = name
+            input_type = attrs.get('type', 'text').lower()
+            if name and input_type not in ('hidden', 'image', 'submit', 'button', 'reset'):
+                self._form.visible.add(name)
+            if input_type == 'image' and 'update.jpg' in attrs.get('src', ''):
+                self._form.update_buttons.append(attrs)
+            elif name and input_type not in ('image', 'submit', 'button', 'reset') and \
+                    (input_type not in ('checkbox', 'radio') or 'checked' in attrs):
+                self._form.fields[name] = attrs.get('value', '')
+        elif tag == 'textarea' and attrs.get('name'):
+            # its text is not read - a form with one is never rebuilt for other dates
+            self._form.visible.add(attrs['name'])
+        elif tag == 'select':
+            self._select = attrs.get('name')
+            if self._select:
+                self._form.visible.add(self._select)
+                self._form.selects[self._select] = []
+                if 'id' in attrs:
+                    self._form.ids[attrs['id']] = self._select
+        elif tag == 'option' and self._select:
+            self._option = [attrs.get('value'), '']
+            self._form.selects[self._select].append(self._option)
+            if 'selected' in attrs or len(self._form.selects[self._select]) == 1:
+                self._form.fields[self._select] = self._option
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._resolve_selects()
+            self._form = None
+        elif tag == 'font':
+            self._font_depth = max(0, self._font_depth - 1)
+        elif tag == 'b' and self._bold is not None:
+            if not self.headline and self._bold.strip():
+                self.headline = self._bold
+            self._bold = None
+        elif tag == 'select':
+            self._select = None
+        elif tag == 'option':
+            self._option = None
+
+    def handle_data(self, data):
+        if self._bold is not None:
+            self._bold += data
+        if self._option is not None:
+            self._option[1] += data
+
+    def close(self):
+        super().close()
+        if self._form is not None:
+            self._resolve_selects()
+
+    def _resolve_selects(self):
+        """option values default to their text - resolve once the options were read"""
+        for name, options in self._form.selects.items():
+            for option in options:
+                if option[0] is None:
+                    option[0] = option[1].strip()
+            selected = self._form.fields.get(name)
+            if isinstance(selected, list):
+                self._form.fields[name] = selected[0]
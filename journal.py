@@ -0,0 +1,77 @@
+"""
+This module keeps a local journal of the dates committed to TimeWatch.
+Every successful submit is appended (and flushed to disk) right away, so an interrupted run
+can be resumed from the first date that was not committed.
+"""
+
+import json
+import os
+import threading
+
+import datetime as dt
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'journal')
+
+
+class Journal:
+    """
+    Append only JSON lines file of committed dates of a single worker.
+    """
+
+    def __init__(self, company, worker, journal_dir=DEFAULT_JOURNAL_DIR):
+        os.makedirs(journal_dir, exist_ok=True)
+        self._file_name = os.path.join(journal_dir, 'journal-{}-{}.jsonl'.format(company, worker))
+        self._lock = threading.Lock()
+        self._committed = {}
+        try:
+            with open(self._file_name, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._committed[entry['date']] = entry
+                    except (ValueError, KeyError):
+                        # a line cut by a crash while writing
+                        continue
+        except FileNotFoundError:
+            pass
+        logger.debug('journal %s has %d committed dates', self._file_name, len(self._committed))
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        :param dict params: parsed JSON parameters file
+        :return Journal: journal of the worker in ``user``, in ``journal_dir`` if set
+        """
+        journal_dir = os.path.expanduser(params['journal_dir']) if 'journal_dir' in params else DEFAULT_JOURNAL_DIR
+        return cls(company=params['user']['company'], worker=params['user']['worker'], journal_dir=journal_dir)
+
+    def get(self, date):
+        """
+        :param datetime date: date to look up
+        :return dict: what was written on `date` by its last commit (see :meth:`commit`) - None if never committed
+        """
+        return self._committed.get(self._key(date))
+
+    def commit(self, date, **values):
+        """
+        Record `date` as committed.
+
+        :param datetime date: committed date
+        :param values: what was written - kept for reference
+        """
+        entry = dict(date=self._key(date), committed=dt.datetime.now().isoformat(timespec='seconds'), **values)
+        line = json.dumps(entry, default=str) + '\n'
+        with self._lock:
+            with open(self._file_name, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._committed[entry['date']] = entry
+
+    @staticmethod
+    def _key(date):
+        return date.strftime('%Y-%m-%d')
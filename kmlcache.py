@@ -0,0 +1,261 @@
+"""
+This module keeps downloaded kml files on disk so a date is downloaded from google only once.
+Files are stored by the hash of their content and indexed by date.
+The cache is bounded by size and age, and the least recently used dates are evicted first.
+
+Several processes may share a cache directory (i.e. a standalone run next to the daemon): the index is changed
+under a file lock, and every change is merged into the index on disk, not written over it.
+"""
+
+import contextlib
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # windows - the cache is not shared safely between processes there
+    fcntl = None
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'kml')
+# cache hits whose access times are kept in memory before they are written to the index
+SAVE_EVERY_HITS = 100
+
+
+class KMLCache:
+    """
+    Content addressed kml cache keyed by date.
+
+    Layout of `cache_dir`:
+        * ``objects/<sha256>.kml`` - the kml content. Dates with identical content share one object.
+        * ``index.json`` - date (``YYYY-MM-DD``) -> digest, size, store and last access times.
+        * ``index.lock`` - lock file of the index.
+
+    Access times of cache hits are kept in memory, and written to the index with the next stored date,
+    every SAVE_EVERY_HITS hits and on :meth:`close`.
+    Today's (and future) timelines are still changing and are never stored.
+    Thread safe.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=50, max_age_days=365):
+        self._cache_dir = cache_dir
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+        self._index_file = os.path.join(cache_dir, 'index.json')
+        self._lock_file = os.path.join(cache_dir, 'index.lock')
+        self._max_size = int(max_size_mb * 1024 * 1024)
+        self._max_age = max_age_days * 24 * 3600
+        self._lock = threading.Lock()
+        # date -> last access time of the hits not written to the index yet
+        self._accessed = {}
+        # the index file as this process last wrote it - it is read again only if another process changed it
+        self._index_stamp = None
+        os.makedirs(self._objects_dir, exist_ok=True)
+        with self._lock, self._index_lock():
+            self._index = self._load_index()
+            self._evict()
+            # objects left by a run that stopped between writing an object and indexing it
+            self._remove_unreferenced(name[:-len('.kml')] for name in os.listdir(self._objects_dir)
+                                      if name.endswith('.kml'))
+            self._save_index()
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Build the cache from the ``kml_cache`` section of the parameters file.
+        Missing values fall back to the defaults. ``"kml_cache": {"enabled": false}`` disables the cache.
+
+        :param dict params: parsed JSON parameters file
+        :return: KMLCache or None if disabled
+        """
+        conf = params['kml_cache'] if 'kml_cache' in params else {}
+        if not conf.get('enabled', True):
+            return None
+        return cls(cache_dir=os.path.expanduser(conf.get('dir', DEFAULT_CACHE_DIR)),
+                   max_size_mb=conf.get('max_size_mb', 50),
+                   max_age_days=conf.get('max_age_days', 365))
+
+    def __contains__(self, date):
+        with self._lock:
+            return self._key(date) in self._index
+
+    def get(self, date):
+        """
+        :param datetime date: date of the timeline
+        :return bytes: cached kml content, or None on a miss
+        """
+        key = self._key(date)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                logger.debug('kml cache miss for %s', key)
+                return None
+            try:
+                with open(self._object_path(entry['digest']), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # evicted by another process sharing the cache - it updated the index on disk
+                del self._index[key]
+                self._accessed.pop(key, None)
+                return None
+            entry['accessed'] = self._accessed[key] = time.time()
+            if len(self._accessed) >= SAVE_EVERY_HITS:
+                self._sync()
+        logger.debug('kml cache hit for %s', key)
+        return data
+
+    def put(self, date, data):
+        """
+        Store the kml content of `date`. Dates from today onward are ignored.
+
+        :param datetime date: date of the timeline
+        :param bytes data: raw kml content
+        """
+        key = self._key(date)
+        if key >= dt.date.today().strftime('%Y-%m-%d'):
+            logger.debug('kml of %s is not final yet - not cached', key)
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        with self._lock, self._index_lock():
+            if not os.path.exists(path):
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            self._index = self._merged_index()
+            replaced = self._index.get(key)
+            now = time.time()
+            self._index[key] = {'digest': digest, 'size': len(data), 'stored': now, 'accessed': now}
+            dropped = self._evict()
+            if replaced is not None:
+                dropped.append(replaced['digest'])
+            self._remove_unreferenced(dropped)
+            self._save_index()
+        logger.debug('kml of %s cached as %s', key, digest)
+
+    def close(self):
+        """
+        Write the access times of the cache hits to the index.
+        """
+        with self._lock:
+            if self._accessed:
+                self._sync()
+
+    def _sync(self):
+        """
+        Write the access times of the hits to the index on disk, and take the changes of other processes.
+        Must be called with the lock held.
+        """
+        with self._index_lock():
+            self._index = self._merged_index()
+            self._save_index()
+
+    def _merged_index(self):
+        """
+        :return dict: the index on disk with the access times of the hits of this process.
+            Must be called with both locks held.
+        """
+        if self._index_stamp is not None and self._index_stamp == _stamp(self._index_file):
+            self._accessed = {}
+            return self._index
+        index = self._load_index()
+        for key, accessed in self._accessed.items():
+            if key in index:
+                index[key]['accessed'] = max(index[key]['accessed'], accessed)
+        self._accessed = {}
+        return index
+
+    def _evict(self):
+        """
+        Drop expired dates, then the least recently used ones until the cache fits its size limit.
+        Must be called with the lock held.
+
+        :return list: digests of the dropped dates - their objects may still be used by other dates
+        """
+        now = time.time()
+        dropped = []
+        for key in [k for k, e in self._index.items() if now - e['stored'] > self._max_age]:
+            logger.debug('kml cache entry %s expired', key)
+            dropped.append(self._index.pop(key)['digest'])
+
+        # dates sharing an object count its size once - it is freed with the last of them
+        users = {}
+        for e in self._index.values():
+            users[e['digest']] = users.get(e['digest'], 0) + 1
+        total = sum(e['size'] for e in {e['digest']: e for e in self._index.values()}.values())
+        for key, entry in sorted(self._index.items(), key=lambda x: x[1]['accessed']):
+            if total <= self._max_size:
+                break
+            del self._index[key]
+            dropped.append(entry['digest'])
+            users[entry['digest']] -= 1
+            if not users[entry['digest']]:
+                total -= entry['size']
+            logger.debug('kml cache entry %s evicted', key)
+        return dropped
+
+    def _remove_unreferenced(self, digests):
+        """
+        Remove the objects of `digests` that no date refers to. Must be called with both locks held.
+        """
+        referenced = set(e['digest'] for e in self._index.values())
+        for digest in set(digests) - referenced:
+            try:
+                os.remove(self._object_path(digest))
+            except OSError:
+                pass
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        """
+        Lock the index against the other processes sharing the cache directory.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(self._index_file, 'r') as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        tmp = self._index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self._index))
+        os.replace(tmp, self._index_file)
+        self._index_stamp = _stamp(self._index_file)
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_dir, digest + '.kml')
+
+    @staticmethod
+    def _key(date):
+        return date.strftime('%Y-%m-%d')
+
+
+def _stamp(file_name):
+    """
+    :return tuple: identity of the file's current content - None if there is no file
+    """
+    try:
+        st = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    # the index is replaced, never written in place - a new inode is a new content
+    return st.st_ino, st.st_mtime_ns, st.st_size
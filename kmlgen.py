@@ -0,0 +1,64 @@
+"""
+This module generates synthetic Google timeline kml for benchmarks and offline runs.
+A generated day is spent at home, commuting, and (on office days) at the work site,
+with a tunable number of placemarks spread evenly over the day.
+"""
+
+import datetime as dt
+import math
+import random
+
+import kmlparse
+
+HOME_OFFSET = (0.03, -0.04)  # degrees from the work site, ~5 km
+JITTER = 0.0002  # degrees, ~20 meters of gps noise
+
+
+def generate_day(date, work_site, placemarks=200, at_work=True, seed=None):
+    """
+    Placemarks of one synthetic day.
+
+    :param datetime date: the day (local time)
+    :param tuple work_site: (lat, long) of the work site in decimal degrees
+    :param int placemarks: number of placemarks in the day - the timeline density
+    :param bool at_work: True for an office day, False for a day spent at home
+    :param seed: random seed - the same seed gives the same day
+    :return tuple: (list of kmlparse.Placemark, arrival datetime or None, departure datetime or None)
+    """
+    rnd = random.Random(seed)
+    midnight = dt.datetime(date.year, date.month, date.day).astimezone()
+    arrival = midnight + dt.timedelta(hours=8, minutes=rnd.randint(0, 90))
+    departure = midnight + dt.timedelta(hours=17, minutes=rnd.randint(0, 120))
+    commute = dt.timedelta(minutes=40)
+    home = (work_site[0] + HOME_OFFSET[0], work_site[1] + HOME_OFFSET[1])
+
+    step = dt.timedelta(days=1) / max(1, placemarks)
+    out = []
+    for i in range(placemarks):
+        begin = midnight + step * i
+        if not at_work or begin < arrival - commute or begin >= departure + commute:
+            lat, long = home
+        elif arrival <= begin < departure:
+            lat, long = work_site
+        else:
+            # commuting - on the straight line between home and work
+            f = (arrival - begin) / commute if begin < arrival else (begin - departure) / commute
+            lat = work_site[0] + f * HOME_OFFSET[0]
+            long = work_site[1] + f * HOME_OFFSET[1]
+        out.append(kmlparse.Placemark(begin=begin, end=begin + step,
+                                      lon=long + rnd.uniform(-JITTER, JITTER),
+                                      lat=lat + rnd.uniform(-JITTER, JITTER)))
+    if not at_work:
+        return out, None, None
+    # the placemarks that actually fall at work bound the expected times
+    at_site = [p for p in out if math.hypot(p.lat - work_site[0], p.lon - work_site[1]) < 10 * JITTER]
+    return out, min(p.begin for p in at_site), max(p.end for p in at_site)
+
+
+def generate_kml(date, work_site, placemarks=200, at_work=True, seed=None):
+    """
+    Same as :func:`generate_day`, written as timeline kml.
+
+    :return bytes: kml data of the day
+    """
+    return kmlparse.dump_placemarks(generate_day(date, work_site, placemarks, at_work, seed)[0])
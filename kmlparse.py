@@ -0,0 +1,138 @@
+"""
+This module parses Google timeline kml data incrementally.
+Placemarks are yielded one at a time as compact records and their xml elements are freed right after,
+so memory stays flat regardless of how dense the timeline is.
+It also writes placemark records back as (minimal) timeline kml.
+"""
+
+import datetime as dt
+import io
+import re
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+
+Placemark = namedtuple('Placemark', ['begin', 'end', 'lon', 'lat'])
+Placemark.__doc__ = """
+Single timeline placemark.
+`begin` and `end` are timezone aware (UTC) datetime objects,
+`lon` and `lat` are the coordinate of the record in decimal degrees - the point of a place visit,
+or a single vertex of a track.
+"""
+
+_TZ_COLON = re.compile(r'([+-]\d\d):(\d\d)$')
+
+
+def iter_placemarks(source):
+    """
+    Stream placemark records out of kml data.
+    Placemarks without a time span or without coordinates are skipped.
+    A track (LineString) is split into one record per vertex, each covering an equal share of its time span.
+
+    :param source: raw kml (bytes) or a binary file handle opened on a kml file
+    :yields: Placemark
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    parents = []
+    begin = end = coords = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = _local_name(elem.tag)
+        if event == 'start':
+            if tag == 'Placemark':
+                begin = end = coords = None
+            parents.append(elem)
+            continue
+
+        parents.pop()
+        if tag == 'begin':
+            begin = elem.text
+        elif tag == 'end':
+            end = elem.text
+        elif tag == 'coordinates' and coords is None:
+            coords = elem.text
+        elif tag == 'Placemark':
+            points = coords.split() if coords else None
+            if begin and end and points:
+                begin, end = parse_time(begin), parse_time(end)
+                if len(points) == 1:
+                    lon, lat = points[0].split(',')[:2]
+                    yield Placemark(begin=begin, end=end, lon=float(lon), lat=float(lat))
+                else:
+                    # a track - every vertex gets an equal share of the time span
+                    step = (end - begin) / len(points)
+                    for i, point in enumerate(points):
+                        lon, lat = point.split(',')[:2]
+                        yield Placemark(begin=begin + step * i, end=begin + step * (i + 1),
+                                        lon=float(lon), lat=float(lat))
+            # free the placemark and every placemark before it
+            elem.clear()
+            if parents:
+                parents[-1].clear()
+
+
+def split_days(placemarks, first_date, last_date):
+    """
+    Bucket placemark records into the (local) days they cover, in a single pass.
+    A record that crosses midnight is put in every day it covers.
+
+    :param placemarks: iterable of Placemark, i.e. :func:`iter_placemarks` of a multi day kml
+    :param date first_date: first day kept
+    :param date last_date: last day kept (included)
+    :return dict: date -> list of Placemark, for the days with records
+    """
+    days = {}
+    for p in placemarks:
+        first = p.begin.astimezone().date()
+        # a record ending exactly at midnight does not cover the next day
+        last = (p.end - dt.timedelta(microseconds=1)).astimezone().date() if p.end > p.begin else first
+        day = max(first, first_date)
+        while day <= min(last, last_date):
+            days.setdefault(day, []).append(p)
+            day += dt.timedelta(days=1)
+    return days
+
+
+def dump_placemarks(placemarks):
+    """
+    Write placemark records as timeline kml - one Point placemark with a TimeSpan per record.
+
+    :param placemarks: iterable of Placemark
+    :return bytes: kml data, readable by :func:`iter_placemarks`
+    """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>']
+    for p in placemarks:
+        parts.append('<Placemark><Point><coordinates>{!r},{!r},0</coordinates></Point>'
+                     '<TimeSpan><begin>{}</begin><end>{}</end></TimeSpan></Placemark>'.format(
+                         p.lon, p.lat, format_time(p.begin), format_time(p.end)))
+    parts.append('</Document></kml>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def format_time(time):
+    """
+    :param datetime time: timezone aware datetime object
+    :return str: kml time stamp in UTC, i.e. ``2020-07-01T05:12:33.123Z``
+    """
+    return time.astimezone(dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_time(text):
+    """
+    Parse a kml time stamp (xsd:dateTime) such as ``2020-07-01T05:12:33.123Z``.
+
+    :param str text: time stamp
+    :return datetime: timezone aware datetime object
+    """
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+0000'
+    else:
+        text = _TZ_COLON.sub(r'\1\2', text)
+    fmt = '%Y-%m-%dT%H:%M:%S.%f%z' if '.' in text else '%Y-%m-%dT%H:%M:%S%z'
+    return dt.datetime.strptime(text, fmt)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
@@ -0,0 +1,403 @@
+"""
+This module keeps a persistent ledger of the decision and the written values of every date.
+The ledger of a worker is a single file of fixed size records - one per calendar day, at the offset
+of the day - memory mapped with numpy. A date is read or written in O(1), a year takes about 6 KB,
+and reports of any range are read without a browser and without TimeWatch.
+
+Decisions of past dates are reused by following runs as long as the parameters they were made with
+did not change (see :func:`params_hash`).
+
+Several processes may share a ledger (i.e. a standalone run next to the daemon): records are written and the
+file grown under a file lock, and a file grown or rewritten by another process is mapped again.
+"""
+
+import contextlib
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # windows - the ledger is not shared safely between processes there
+    fcntl = None
+
+import numpy as np
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_LEDGER_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'ledger')
+
+# code 0 is "not set" in all the enumerations - a zeroed record is an empty day
+MODES = ['', 'weekend', 'non_gps', 'gps']
+KINDS = ['', 'holiday', 'holiday_eve', 'non_gps', 'gps']
+SOURCES = ['', 'gps', 'spoofed', 'fixed']
+
+NO_TIME = 0xFFFF
+NO_EXCUSE = 0xFFFF
+MINUTES_PER_DAY = 24 * 60
+
+_MAGIC = b'TWULDG02'
+_HEADER = np.dtype([('magic', 'S8'), ('base', '<i4'), ('reserved', '<u4')])
+_RECORD = np.dtype([
+    ('mode', 'u1'),  # planner decision, MODES
+    ('kind', 'u1'),  # what was written to TimeWatch, KINDS - 0 if never written
+    ('source', 'u1'),  # SOURCES
+    ('excuse', '<u2'),  # written excuse index, NO_EXCUSE if none
+    ('start', '<u2'),  # minutes after the midnight that starts the day, NO_TIME if none
+    ('end', '<u2'),  # may be past the next midnight - a stay that crosses midnight ends on the next day
+    ('params_hash', '<u4'),  # see params_hash()
+    ('updated', '<u4'),  # unix time of the last change
+])
+
+# first version of the file: excuse was a signed byte (-1 if none) and the end was the time of day only
+_MAGIC_V1 = b'TWULDG01'
+_RECORD_V1 = np.dtype([('mode', 'u1'), ('kind', 'u1'), ('source', 'u1'), ('excuse', 'i1'), ('start', '<u2'),
+                       ('end', '<u2'), ('params_hash', '<u4'), ('updated', '<u4')])
+
+REPORT_FIELDS = ['date', 'weekday', 'mode', 'source', 'written', 'excuse', 'start', 'end']
+
+
+def params_hash(params):
+    """
+    :param dict params: parsed JSON parameters file
+    :return int: 32 bit hash of the parameters a date decision depends on (``work`` and ``home``)
+    """
+    relevant = {'work': params.get('work'), 'home': params.get('home')}
+    digest = hashlib.sha256(json.dumps(relevant, sort_keys=True).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'little')
+
+
+class Ledger:
+    """
+    Memory mapped day records of a single worker.
+
+    Layout of the file: a 16 bytes header (magic and the ordinal of the first day) followed by one
+    17 bytes record per day. The file covers whole years and grows by whole years.
+    A file of the first version is converted when it is opened.
+    Thread safe, and safe between processes where ``fcntl`` is available.
+    """
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._lock_file = file_name + '.lock'
+        self._lock = threading.Lock()
+        self._base = None
+        self._records = None
+        # (inode, size) of the mapped file - another process changed it when they differ
+        self._mapped = None
+        with self._file_lock():
+            if os.path.exists(file_name):
+                header = np.fromfile(file_name, dtype=_HEADER, count=1)
+                if len(header) == 1 and header['magic'][0] == _MAGIC_V1:
+                    _upgrade_v1(file_name, int(header['base'][0]))
+                elif len(header) != 1 or header['magic'][0] != _MAGIC:
+                    raise ValueError('{} is not a ledger file'.format(file_name))
+            self._sync()
+        logger.debug('Opened ledger %s', file_name)
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Open the ledger of the worker in ``user``, in the ``ledger`` section directory.
+        ``"ledger": {"enabled": false}`` disables the ledger.
+
+        :param dict params: parsed JSON parameters file
+        :return: Ledger or None if disabled
+        """
+        conf = params['ledger'] if 'ledger' in params else {}
+        if not conf.get('enabled', True):
+            return None
+        ledger_dir = os.path.expanduser(conf.get('dir', DEFAULT_LEDGER_DIR))
+        os.makedirs(ledger_dir, exist_ok=True)
+        return cls(os.path.join(ledger_dir, 'ledger-{}-{}.bin'.format(params['user']['company'],
+                                                                      params['user']['worker'])))
+
+    def close(self):
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+                self._records = None
+            self._mapped = None
+
+    def get(self, date):
+        """
+        :param datetime date: date to read
+        :return dict: the record of `date` (see :meth:`_to_dict`), or None if nothing was recorded
+        """
+        with self._lock:
+            i = self._offset(date)
+            if i is None or self._records[i]['updated'] == 0:
+                return None
+            return _to_dict(date, self._records[i])
+
+    def decision(self, date, p_hash):
+        """
+        Decision of a past run that can be reused: made with the same parameters, after the day was over.
+
+        :param datetime date: date to read
+        :param int p_hash: hash of the current parameters
+        :return dict: mode, source and work_day_times, or None if the date must be decided again
+        """
+        with self._lock:
+            i = self._offset(date)
+            if i is None:
+                return None
+            r = self._records[i]
+            if r['mode'] == 0 or r['params_hash'] != p_hash or r['updated'] < _day_end(date):
+                return None
+            start, end = int(r['start']), int(r['end'])
+            if start != NO_TIME and end != NO_TIME and end <= start:
+                logger.warning('Ledger decision of %s ends before it starts - deciding again', twlog.day(date))
+                return None
+            return {'mode': MODES[r['mode']], 'source': SOURCES[r['source']],
+                    'work_day_times': {'start': _time_of(date, start), 'end': _time_of(date, end)}
+                    if start != NO_TIME and end != NO_TIME else {}}
+
+    def record_decision(self, date, mode, source, work_day_times, p_hash):
+        """
+        Record the planner decision of a date.
+
+        :param datetime date: decided date
+        :param str mode: weekend, non_gps or gps
+        :param str source: gps, spoofed, fixed or ''
+        :param dict work_day_times: start and end datetime objects, or an empty dict / None
+        :param int p_hash: hash of the parameters the decision was made with
+        """
+        with self._lock, self._file_lock():
+            i = self._offset(date, grow=True)
+            r = self._records[i]
+            r['mode'] = MODES.index(mode)
+            r['source'] = SOURCES.index(source)
+            r['start'], r['end'] = _minutes(date, work_day_times)
+            r['params_hash'] = p_hash
+            r['updated'] = int(time.time())
+
+    def commit(self, date, kind, excuse):
+        """
+        Record what was written to TimeWatch for a date.
+
+        :param datetime date: written date
+        :param str kind: holiday, holiday_eve, non_gps or gps
+        :param excuse: written excuse index, or None
+        """
+        with self._lock, self._file_lock():
+            i = self._offset(date, grow=True)
+            r = self._records[i]
+            r['kind'] = KINDS.index(kind)
+            if excuse is not None and not 0 <= int(excuse) < NO_EXCUSE:
+                raise ValueError('excuse index {} does not fit the ledger'.format(excuse))
+            r['excuse'] = NO_EXCUSE if excuse is None else int(excuse)
+            r['updated'] = int(time.time())
+
+    def range(self, start_date, end_date):
+        """
+        :param datetime start_date: first date (included)
+        :param datetime end_date: last date (included)
+        :return list: dict per recorded date of the range, in date order (see :meth:`get`)
+        """
+        out = []
+        with self._lock:
+            self._sync()
+            if self._records is None:
+                return out
+            first = max(start_date.toordinal(), self._base)
+            last = min(end_date.toordinal(), self._base + len(self._records) - 1)
+            if first > last:
+                return out
+            block = np.array(self._records[first - self._base:last - self._base + 1])
+        for i in np.flatnonzero(block['updated']):
+            out.append(_to_dict(dt.date.fromordinal(first + int(i)), block[i]))
+        return out
+
+    def _offset(self, date, grow=False):
+        self._sync()
+        ordinal = date.toordinal()
+        if self._records is None or not self._base <= ordinal < self._base + len(self._records):
+            if not grow:
+                return None
+            self._grow(ordinal)
+        return ordinal - self._base
+
+    def _grow(self, ordinal):
+        """extend the file by whole years so that it covers `ordinal`"""
+        year = dt.date.fromordinal(ordinal).year
+        first = dt.date(year, 1, 1).toordinal()
+        last = dt.date(year + 1, 1, 1).toordinal()
+        if self._records is not None:
+            first = min(first, self._base)
+            last = max(last, self._base + len(self._records))
+        if self._base is not None and first < self._base:
+            # an earlier year - the records move, the file is rewritten
+            old = np.array(self._records) if self._records is not None else np.zeros(0, dtype=_RECORD)
+            self._records = None
+            records = np.zeros(last - first, dtype=_RECORD)
+            records[self._base - first:self._base - first + len(old)] = old
+            tmp = self._file_name + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_header(first))
+                f.write(records.tobytes())
+            os.replace(tmp, self._file_name)
+        else:
+            if self._records is not None:
+                self._records.flush()
+                self._records = None
+            else:
+                with open(self._file_name, 'wb') as f:
+                    f.write(_header(first))
+            with open(self._file_name, 'r+b') as f:
+                # the new records are zeros - empty days
+                f.truncate(_HEADER.itemsize + (last - first) * _RECORD.itemsize)
+        self._base = first
+        self._map()
+        logger.debug('Ledger %s now covers %s to %s', self._file_name,
+                     dt.date.fromordinal(first), dt.date.fromordinal(last - 1))
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """
+        Lock the file against the other processes sharing it - a grow in one process must not lose
+        the records written meanwhile by another.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stamp(self):
+        try:
+            st = os.stat(self._file_name)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size
+
+    def _sync(self):
+        """map the file again if another process grew or rewrote it since it was mapped"""
+        if self._stamp() == self._mapped:
+            return
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+        self._base = None
+        self._mapped = None
+        if os.path.exists(self._file_name):
+            self._base = int(np.fromfile(self._file_name, dtype=_HEADER, count=1)['base'][0])
+            self._map()
+
+    def _map(self):
+        self._mapped = self._stamp()
+        num_records = (os.path.getsize(self._file_name) - _HEADER.itemsize) // _RECORD.itemsize
+        self._records = np.memmap(self._file_name, dtype=_RECORD, mode='r+', offset=_HEADER.itemsize,
+                                  shape=(num_records,)) if num_records > 0 else None
+
+
+def report_rows(records):
+    """
+    :param list records: records from :meth:`Ledger.range`
+    :return list: one dict per record with the REPORT_FIELDS keys, for plan.format_plan / plan.write_plan
+    """
+    return [{'date': r['date'].strftime('%d-%m-%Y'),
+             'weekday': r['date'].strftime('%A'),
+             'mode': r['mode'],
+             'source': r['source'],
+             'written': r['kind'],
+             'excuse': '' if r['excuse'] is None else r['excuse'],
+             'start': r['start'] or '',
+             'end': r['end'] or ''} for r in records]
+
+
+def report_totals(records):
+    """
+    :param list records: records from :meth:`Ledger.range`
+    :return dict: number of written dates per kind, and the hours written
+    """
+    totals = {k: 0 for k in KINDS if k}
+    minutes = 0
+    for r in records:
+        if r['kind']:
+            totals[r['kind']] += 1
+            if r['kind'] in ('gps', 'non_gps') and r['start'] and r['end']:
+                # an inconsistent record counts as no time rather than negative time
+                minutes += max(0, _parse_minutes(r['end']) - _parse_minutes(r['start']))
+    totals['hours'] = round(minutes / 60, 2)
+    return totals
+
+
+def _to_dict(date, r):
+    """
+    :return dict: date, mode, source, kind ('' if never written), excuse (None if none),
+        start and end (``HH:MM`` or None) and params_hash
+    """
+    return {'date': date if not isinstance(date, dt.datetime) else date.date(),
+            'mode': MODES[r['mode']],
+            'kind': KINDS[r['kind']],
+            'source': SOURCES[r['source']],
+            'excuse': None if r['excuse'] == NO_EXCUSE or not r['kind'] else int(r['excuse']),
+            'start': _format_minutes(int(r['start'])),
+            'end': _format_minutes(int(r['end'])),
+            'params_hash': int(r['params_hash'])}
+
+
+def _header(base):
+    header = np.zeros(1, dtype=_HEADER)
+    header['magic'] = _MAGIC
+    header['base'] = base
+    return header.tobytes()
+
+
+def _minutes(date, work_day_times):
+    """start and end as minutes after the midnight that starts `date` - an end on the next day is past 1440"""
+    if not work_day_times:
+        return NO_TIME, NO_TIME
+    midnight = dt.datetime(date.year, date.month, date.day)
+    return tuple(min(NO_TIME - 1, max(0, int((work_day_times[k].replace(tzinfo=None) - midnight).total_seconds()
+                                             // 60)))
+                 for k in ('start', 'end'))
+
+
+def _format_minutes(minutes):
+    """``HH:MM`` - hours past 23 for an end on the next day"""
+    return None if minutes == NO_TIME else '{:02d}:{:02d}'.format(*divmod(minutes, 60))
+
+
+def _parse_minutes(text):
+    hours, minutes = text.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def _time_of(date, minutes):
+    return dt.datetime(date.year, date.month, date.day) + dt.timedelta(minutes=minutes)
+
+
+def _upgrade_v1(file_name, base):
+    """
+    Rewrite a first version ledger in the current layout. Its ends before their start were stays
+    that crossed midnight - they move to the next day.
+    """
+    old = np.fromfile(file_name, dtype=_RECORD_V1, offset=_HEADER.itemsize)
+    records = np.zeros(len(old), dtype=_RECORD)
+    for name in ('mode', 'kind', 'source', 'start', 'end', 'params_hash', 'updated'):
+        records[name] = old[name]
+    records['excuse'] = np.where(old['excuse'] < 0, NO_EXCUSE, old['excuse'].astype('<u2'))
+    crossing = (old['start'] != NO_TIME) & (old['end'] != NO_TIME) & (old['end'] < old['start'])
+    records['end'][crossing] += MINUTES_PER_DAY
+    tmp = file_name + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_header(base))
+        f.write(records.tobytes())
+    os.replace(tmp, file_name)
+    logger.info('Ledger %s converted to the current layout', file_name)
+
+
+def _day_end(date):
+    """unix time of the (local) midnight that ends `date`"""
+    return time.mktime((date + dt.timedelta(days=1)).timetuple()[:3] + (0, 0, 0, 0, 0, -1))
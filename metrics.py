@@ -0,0 +1,195 @@
+"""
+This module records how long every stage of a run takes, per stage and per date, and counts events
+(cache hits, retries, parsed placemarks, ...) and keeps peak values (i.e. browser memory).
+At the end of a run the results are written as a JSON summary and as a Prometheus text file
+for the node exporter textfile collector.
+
+Recording is off unless :func:`enable` is called - disabled spans and counts are no-ops.
+"""
+
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_lock = threading.Lock()
+_stages = {}
+_dates = {}
+_counters = {}
+_peaks = {}
+_started = None
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('_stage', '_date', '_start')
+
+    def __init__(self, stage, date):
+        self._stage = stage
+        self._date = date
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        _record(self._stage, time.perf_counter() - self._start, self._date)
+        return False
+
+
+def enable():
+    """Start recording. Clears anything recorded before."""
+    global _enabled, _started
+    reset()
+    _started = time.time()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _dates.clear()
+        _counters.clear()
+        _peaks.clear()
+
+
+def span(stage, date=None):
+    """
+    Time a block of code.
+
+        with metrics.span('kml_parse', date):
+            ...
+
+    :param str stage: stage name
+    :param datetime date: the date the stage works on, if any
+    :return: context manager
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(stage, date)
+
+
+def count(name, value=1):
+    """
+    Add `value` to counter `name`.
+
+    :param str name: counter name, i.e. ``kml_cache_hits``
+    :param int value: amount to add
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def peak(name, value):
+    """
+    Keep the highest `value` seen for `name`.
+
+    :param str name: gauge name, i.e. ``browser_peak_rss_mb``
+    :param float value: current value
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _peaks[name] = max(_peaks.get(name, value), value)
+
+
+def summary():
+    """
+    :return dict: stage durations (count, total, max), per date stage durations, counters and peaks
+    """
+    with _lock:
+        return {
+            'started': _started,
+            'duration': time.time() - _started if _started else 0.0,
+            'stages': {k: dict(v) for k, v in _stages.items()},
+            'dates': {k: dict(v) for k, v in _dates.items()},
+            'counters': dict(_counters),
+            'peaks': dict(_peaks),
+        }
+
+
+def write_json(file_name):
+    """Write :func:`summary` to `file_name`."""
+    _write_atomic(file_name, json.dumps(summary(), indent=4))
+
+
+def write_prometheus(file_name, prefix='twu'):
+    """
+    Write the stage durations and the counters in Prometheus text format.
+
+    :param str file_name: output file, i.e. ``<node exporter textfile dir>/twu.prom``
+    :param str prefix: metric name prefix
+    """
+    s = summary()
+    lines = ['# HELP {}_stage_duration_seconds Time spent in each stage of the last run.'.format(prefix),
+             '# TYPE {}_stage_duration_seconds summary'.format(prefix)]
+    for stage, v in sorted(s['stages'].items()):
+        lines.append('{}_stage_duration_seconds_sum{{stage="{}"}} {:.6f}'.format(prefix, stage, v['total']))
+        lines.append('{}_stage_duration_seconds_count{{stage="{}"}} {}'.format(prefix, stage, v['count']))
+    lines += ['# HELP {}_stage_duration_max_seconds Longest single run of each stage in the last run.'.format(prefix),
+              '# TYPE {}_stage_duration_max_seconds gauge'.format(prefix)]
+    for stage, v in sorted(s['stages'].items()):
+        lines.append('{}_stage_duration_max_seconds{{stage="{}"}} {:.6f}'.format(prefix, stage, v['max']))
+    lines += ['# HELP {}_events_total Events counted in the last run.'.format(prefix),
+              '# TYPE {}_events_total counter'.format(prefix)]
+    for name, v in sorted(s['counters'].items()):
+        lines.append('{}_events_total{{name="{}"}} {}'.format(prefix, name, v))
+    lines += ['# HELP {}_peak Highest value seen in the last run.'.format(prefix),
+              '# TYPE {}_peak gauge'.format(prefix)]
+    for name, v in sorted(s['peaks'].items()):
+        lines.append('{}_peak{{name="{}"}} {}'.format(prefix, name, v))
+    lines += ['# HELP {}_run_dates Dates processed in the last run.'.format(prefix),
+              '# TYPE {}_run_dates gauge'.format(prefix),
+              '{}_run_dates {}'.format(prefix, len(s['dates'])),
+              '# HELP {}_run_duration_seconds Duration of the last run.'.format(prefix),
+              '# TYPE {}_run_duration_seconds gauge'.format(prefix),
+              '{}_run_duration_seconds {:.6f}'.format(prefix, s['duration']),
+              '# HELP {}_run_timestamp_seconds End time of the last run.'.format(prefix),
+              '# TYPE {}_run_timestamp_seconds gauge'.format(prefix),
+              '{}_run_timestamp_seconds {:.3f}'.format(prefix, time.time())]
+    _write_atomic(file_name, '\n'.join(lines) + '\n')
+
+
+def _record(stage, seconds, date):
+    with _lock:
+        v = _stages.get(stage)
+        if v is None:
+            v = _stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        v['count'] += 1
+        v['total'] += seconds
+        v['max'] = max(v['max'], seconds)
+        if date is not None:
+            per_date = _dates.setdefault(date.strftime('%Y-%m-%d'), {})
+            per_date[stage] = per_date.get(stage, 0.0) + seconds
+
+
+def _write_atomic(file_name, text):
+    """the textfile collector may read at any time - never expose a half written file"""
+    directory = os.path.dirname(os.path.abspath(file_name))
+    os.makedirs(directory, exist_ok=True)
+    tmp = file_name + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, file_name)
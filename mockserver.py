@@ -0,0 +1,220 @@
+"""
+This module is a local stand-in for the TimeWatch punch pages.
+It serves the login page, the page received after login (with the employee token link),
+the month overview, the single day edit form and its submit target, and keeps what was submitted in memory.
+Used to exercise both backends offline:
+
+    python mockserver.py --port 8000
+    python . --timewatch-url http://127.0.0.1:8000/punch/punch.php --backend http ...
+"""
+
+import argparse
+import datetime as dt
+import html
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+EXCUSES = ['', 'sick day', 'vacation', 'holiday eve', 'holiday', 'work from home']
+
+_LOGIN_PAGE = '''<html><body><div id="cpick"><form action="punch2.php" method="post">
+<input type="text" id="compKeyboard" name="comp">
+<input type="text" id="nameKeyboard" name="name">
+<input type="password" id="pwKeyboard" name="pw">
+<input type="submit" value="enter">
+</form></div></body></html>'''
+
+_MAIN_PAGE = '''<html><body>
+<a href="editwh.php?ee={token}&e={company}&m=1&y=2020">edit hours</a>
+</body></html>'''
+
+_EDIT_PAGE = '''<html><body><div><span><form action="editwh3.php" method="post">
+<input type="hidden" name="e" value="{token}"><input type="hidden" name="tl" value="{token}">
+<input type="hidden" name="c" value="{company}"><input type="hidden" name="d" value="{date}">
+<table><tr><td><font>{date}</font> <font><b>{headline}</b></font></td></tr>
+{rows}
+<tr><td><select name="excuse">{options}</select></td></tr>
+<tr><td><input type="image" src="/images/update.jpg" name="update"></td></tr>
+</table></form></span></div></body></html>'''
+
+_MONTH_PAGE = '''<html><body><table>
+<tr><th>date</th><th>day</th><th>description</th><th>in</th><th>out</th><th>excuse</th></tr>
+{rows}
+</table></body></html>'''
+
+
+class TimewatchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        if self.server.throttle():
+            return self._send('too many requests', status=429, headers={'Retry-After': '0'})
+        if url.path.endswith('/punch.php'):
+            self._send(_LOGIN_PAGE)
+        elif url.path.endswith('/editwh.php'):
+            if not self._logged_in():
+                return self._send(_LOGIN_PAGE, status=403)
+            self._send(self.server.month_page(int(query.get('y', 0)), int(query.get('m', 0))))
+        elif url.path.endswith('/editwh2.php'):
+            if not self._logged_in():
+                return self._send(_LOGIN_PAGE, status=403)
+            self._send(self.server.edit_page(query.get('d', '')))
+        else:
+            self._send('not found', status=404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode(), keep_blank_values=True).items()}
+        if self.server.throttle():
+            return self._send('too many requests', status=429, headers={'Retry-After': '0'})
+        if url.path.endswith('/punch2.php'):
+            if not self.server.check_login(form):
+                return self._send(_LOGIN_PAGE, status=403)
+            session_id = uuid.uuid4().hex
+            self.server.sessions.add(session_id)
+            self._send(_MAIN_PAGE.format(token=self.server.token, company=form.get('comp', '')),
+                       headers={'Set-Cookie': 'PHPSESSID={}; Path=/'.format(session_id)})
+        elif url.path.endswith('/editwh3.php'):
+            if not self._logged_in():
+                return self._send(_LOGIN_PAGE, status=403)
+            self.server.store_punch(form)
+            self._send('<html><body>saved</body></html>')
+        else:
+            self._send('not found', status=404)
+
+    def log_message(self, format, *args):
+        logger.debug('mock timewatch: ' + format, *args)
+
+    def _logged_in(self):
+        cookies = self.headers.get('Cookie', '')
+        return any(c.strip().split('=', 1)[-1] in self.server.sessions
+                   for c in cookies.split(';') if c.strip().startswith('PHPSESSID='))
+
+    def _send(self, body, status=200, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockTimewatchServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded mock TimeWatch server.
+
+    :param tuple address: (host, port) - port 0 picks a free port
+    :param dict holidays: date (``YYYY-M-D`` as in the edit url) -> headline text of that date
+    :param dict user: accepted login - company, worker and pswd. None accepts any login.
+    :param int throttle_every: answer every n-th request with 429 Too Many Requests, as a throttling site does
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), holidays=None, user=None, token='1234', throttle_every=0):
+        super().__init__(address, TimewatchHandler)
+        self.holidays = holidays or {}
+        self.user = user
+        self.token = token
+        self.sessions = set()
+        self.punches = {}
+        self.page_loads = 0
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/punch/punch.php'.format(*self.server_address[:2])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-timewatch', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exception):
+        self.shutdown()
+        self.server_close()
+
+    def throttle(self):
+        """
+        :return bool: True if the current request is to be answered with 429
+        """
+        with self._lock:
+            self.requests += 1
+            if self.throttle_every and self.requests % self.throttle_every == 0:
+                self.throttled += 1
+                return True
+            return False
+
+    def check_login(self, form):
+        if self.user is None:
+            return True
+        return (form.get('comp') == str(self.user['company']) and form.get('name') == str(self.user['worker'])
+                and form.get('pw') == str(self.user['pswd']))
+
+    def edit_page(self, date):
+        with self._lock:
+            punch = self.punches.get(date, {})
+            self.page_loads += 1
+        rows = ''.join(
+            '<tr><td>' + ''.join('<input type="text" id="{0}{1}" name="{0}{1}" value="{2}">'.format(
+                e, row, html.escape(punch.get('{}{}'.format(e, row), ''))) for e in ['ehh', 'emm', 'xhh', 'xmm'])
+            + '</td></tr>' for row in range(4))
+        options = ''.join('<option value="{}"{}>{}</option>'.format(
+            i, ' selected' if str(i) == punch.get('excuse', '0') else '', html.escape(text))
+            for i, text in enumerate(EXCUSES))
+        return _EDIT_PAGE.format(token=self.token, company='', date=html.escape(date),
+                                 headline=html.escape(self.holidays.get(date, 'regular day')),
+                                 rows=rows, options=options)
+
+    def month_page(self, year, month):
+        rows = []
+        day = dt.date(year, month, 1)
+        while day.month == month:
+            key = '{}-{}-{}'.format(day.year, day.month, day.day)
+            with self._lock:
+                punch = self.punches.get(key, {})
+            start = '{}:{}'.format(punch['ehh0'], punch['emm0'].zfill(2)) if punch.get('ehh0') else ''
+            end = '{}:{}'.format(punch['xhh0'], punch['xmm0'].zfill(2)) if punch.get('xhh0') else ''
+            excuse = EXCUSES[int(punch.get('excuse', 0))]
+            rows.append('<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format(
+                day.strftime('%d-%m-%Y'), day.strftime('%A'), html.escape(self.holidays.get(key, 'regular day')),
+                start, end, html.escape(excuse)))
+            day += dt.timedelta(days=1)
+        with self._lock:
+            self.page_loads += 1
+        return _MONTH_PAGE.format(rows=''.join(rows))
+
+    def store_punch(self, form):
+        with self._lock:
+            self.punches[form.get('d', '')] = form
+        logger.debug('mock timewatch stored %s', form.get('d', ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in server for the TimeWatch punch pages')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--throttle-every', dest='throttle_every', type=int, default=0,
+                        help='answer every n-th request with 429 Too Many Requests')
+    args = parser.parse_args()
+    with MockTimewatchServer(address=(args.host, args.port), throttle_every=args.throttle_every) as server:
+        logger.info('Mock TimeWatch serving on %s', server.url)
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,97 @@
+"""
+This module parses the TimeWatch month overview page (``editwh.php``).
+One page load gives the headline (day description - holiday, holiday eve, etc.) of every day of the month,
+so holidays are checked without opening the edit page of each date.
+"""
+
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+import datetime as dt
+
+DayRow = namedtuple('DayRow', ['date', 'headline', 'start', 'end', 'excuse'])
+DayRow.__doc__ = """
+A day of the month overview.
+`date` is a datetime.date, `headline` the day description,
+`start`/`end` the first punch in/out as ``HH:MM`` ('' if empty) and `excuse` the excuse text ('' if none).
+"""
+
+_DATE_PATTERN = re.compile(r'(?P<day>\d{1,2})-(?P<month>\d{1,2})-(?P<year>\d{4})')
+
+
+class MonthTable:
+    """
+    Days of a month overview page, by date.
+    Column layout of the day rows in the overview table - date first, then the day name.
+    """
+
+    COLUMNS = {'date': 0, 'headline': 2, 'start': 3, 'end': 4, 'excuse': 5}
+
+    def __init__(self, page_source):
+        parser = _TableParser()
+        parser.feed(page_source)
+        parser.close()
+        self.days = {}
+        for cells in parser.rows:
+            row = self._day_row(cells)
+            if row is not None:
+                self.days[row.date] = row
+
+    def __contains__(self, date):
+        return _as_date(date) in self.days
+
+    def __getitem__(self, date):
+        return self.days[_as_date(date)]
+
+    def headline_ascii(self, date):
+        """
+        :param datetime date: date in the month
+        :return list: ascii values of the headline of `date` - as compared against the holiday texts
+        """
+        return [ord(x) for x in self[date].headline.strip()]
+
+    def _day_row(self, cells):
+        if len(cells) <= max(self.COLUMNS.values()):
+            return None
+        match = _DATE_PATTERN.search(cells[self.COLUMNS['date']])
+        if not match:
+            return None
+        return DayRow(date=dt.date(int(match.group('year')), int(match.group('month')), int(match.group('day'))),
+                      headline=cells[self.COLUMNS['headline']].strip(),
+                      start=cells[self.COLUMNS['start']].strip(),
+                      end=cells[self.COLUMNS['end']].strip(),
+                      excuse=cells[self.COLUMNS['excuse']].strip())
+
+
+class _TableParser(HTMLParser):
+    """Collects the text of the cells of every table row."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._row = []
+            self._cell = None
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = ''
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._row is not None and self._cell is not None:
+            self._row.append(self._cell)
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell += data
+
+
+def _as_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
@@ -0,0 +1,275 @@
+"""
+This module paces the requests the tool sends - TimeWatch page loads and form posts, and timeline downloads.
+
+Every endpoint has a token bucket (a steady request rate with a burst allowance) and a concurrency limit that
+adapts to what the endpoint answers: it grows by one slot per window of fast successful requests and is halved
+on an error, a throttled answer or a request slower than the endpoint's target latency (AIMD).
+A request that fails with a retryable error is sent again after a jittered exponential backoff, so only that
+request is repeated - the dates already done stay done.
+
+Limits apply per process: a roster of workers running on several processes gets them in every process.
+"""
+
+import json
+import math
+import random
+import threading
+import time
+
+import twlog
+import metrics
+
+logger = twlog.TimeWatchLogger()
+
+# endpoint -> rate (requests per second), burst, max_concurrency, target_latency_seconds (None: latency is ignored)
+DEFAULT_ENDPOINTS = {
+    'timewatch': {'rate': 10.0, 'burst': 20, 'max_concurrency': 4, 'target_latency_seconds': 5.0},
+    'timeline': {'rate': 0.2, 'burst': 2, 'max_concurrency': 2, 'target_latency_seconds': None},
+}
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+# answers of a server that is overloaded or throttling - worth sending the request again
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class Throttled(Exception):
+    """
+    Raised by a request the endpoint refused for now (i.e. an HTTP 429) - it is sent again after a backoff.
+
+    :param float retry_after: seconds the endpoint asked to wait, if it did
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    `rate` requests per second on average, up to `burst` at once. Thread safe - waiting callers are served
+    in the order they asked.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param float rate: tokens added per second - None for no limit
+        :param int burst: bucket size
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if the bucket is empty.
+
+        :return float: seconds waited
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # the token is reserved now - a negative balance is the queue of callers in front of the next token
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit adjusted by additive increase and multiplicative decrease. Thread safe.
+    """
+
+    def __init__(self, maximum, target_latency=None, minimum=1):
+        """
+        :param int maximum: highest limit - also the starting one
+        :param float target_latency: seconds above which a successful request counts as congestion
+        :param int minimum: lowest limit
+        """
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.limit = float(self.maximum)
+        self._in_flight = 0
+        self._changed = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free slot.
+
+        :return float: seconds waited
+        """
+        t = time.monotonic()
+        with self._changed:
+            while self._in_flight >= max(self.minimum, math.floor(self.limit)):
+                self._changed.wait()
+            self._in_flight += 1
+        return time.monotonic() - t
+
+    def release(self, latency=None, congested=False):
+        """
+        Free a slot and adapt the limit.
+
+        :param float latency: seconds the successful request took - None if it did not succeed
+        :param bool congested: the request failed with a sign of overload (error, throttled answer)
+        """
+        with self._changed:
+            self._in_flight -= 1
+            if congested or (latency is not None and self.target_latency is not None
+                             and latency > self.target_latency):
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None:
+                # one more slot once a whole window of requests succeeded
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._changed.notify_all()
+
+
+class Endpoint:
+    """
+    Rate and concurrency limits of one endpoint.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency, target_latency_seconds=None):
+        self.name = name
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.concurrency = AdaptiveLimit(maximum=max_concurrency, target_latency=target_latency_seconds)
+
+
+class RequestScheduler:
+    """
+    Sends requests through the limits of their endpoint, and retries the failed ones.
+    """
+
+    def __init__(self, endpoints=None, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, seed=None):
+        """
+        :param dict endpoints: endpoint name -> Endpoint settings (see DEFAULT_ENDPOINTS) - the defaults if not given
+        :param int max_attempts: times a request is sent before its error is raised
+        :param float backoff: seconds of the first backoff - doubled on every further attempt
+        :param float max_backoff: highest backoff, in seconds
+        :param int seed: seed of the backoff jitter
+        """
+        settings = {name: dict(v) for name, v in DEFAULT_ENDPOINTS.items()}
+        for name, v in (endpoints or {}).items():
+            settings.setdefault(name, dict(DEFAULT_ENDPOINTS['timewatch'])).update(v)
+        self._endpoints = {name: Endpoint(name, **v) for name, v in settings.items()}
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._random = random.Random(seed)
+
+    def endpoint(self, name):
+        """
+        :param str name: endpoint name
+        :return Endpoint: its limits
+        """
+        return self._endpoints[name]
+
+    def call(self, endpoint, request, retry_on=()):
+        """
+        Send `request` within the limits of `endpoint`, again after a backoff while it fails with a retryable error.
+
+        :param str endpoint: endpoint name, i.e. 'timewatch' or 'timeline'
+        :param callable request: sends the request and returns its result - raises Throttled if the endpoint
+            refused it for now
+        :param tuple retry_on: other exception types worth a retry (i.e. connection errors and timeouts)
+        :return: what `request` returned
+        :raises: the error of the last attempt, once max_attempts were made
+        """
+        limits = self._endpoints[endpoint]
+        attempt = 0
+        while True:
+            attempt += 1
+            waited = limits.concurrency.acquire()
+            waited += limits.bucket.acquire()
+            if waited:
+                metrics.count('request_wait_seconds', waited)
+            t = time.monotonic()
+            try:
+                result = request()
+            except (Throttled,) + tuple(retry_on) as ex:
+                limits.concurrency.release(congested=True)
+                error = ex
+            except BaseException:
+                # not a sign of overload (i.e. a bad answer) - the limit is kept as is
+                limits.concurrency.release()
+                raise
+            else:
+                limits.concurrency.release(latency=time.monotonic() - t)
+                return result
+            if attempt >= self.max_attempts:
+                logger.warning('%s request failed %d times - giving up: %s', endpoint, attempt, error)
+                raise error
+            delay = self.backoff_delay(attempt)
+            if isinstance(error, Throttled) and error.retry_after is not None:
+                delay = max(delay, error.retry_after)
+            metrics.count('request_retries')
+            logger.info('%s request failed (%s) - attempt %d of %d in %.1f seconds', endpoint, error, attempt + 1,
+                        self.max_attempts, delay)
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        """
+        :param int attempt: number of the attempt that failed, from 1
+        :return float: seconds to wait - uniformly drawn up to the exponential backoff (full jitter),
+            so the retries of concurrent requests do not hit the endpoint together
+        """
+        return self._random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+def retry_after(value):
+    """
+    :param str value: Retry-After header - seconds (an HTTP date is not supported)
+    :return float: the seconds, or None
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+_scheduler = None
+_settings = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler():
+    """
+    :return RequestScheduler: the scheduler shared by every request of this process
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def configure_from_params(params):
+    """
+    Apply the ``requests`` section of the parameters: ``timewatch`` and ``timeline`` endpoint limits (``rate``,
+    ``burst``, ``max_concurrency``, ``target_latency_seconds``), ``max_attempts``, ``backoff_seconds`` and
+    ``max_backoff_seconds``. The scheduler is only replaced when the section changed - its buckets and
+    concurrency limits carry over otherwise. Requests already waiting keep the limits they started with.
+
+    :param dict params: parsed JSON parameters file
+    :return RequestScheduler: the scheduler of this process
+    """
+    global _scheduler, _settings
+    settings = params.get('requests', {})
+    with _scheduler_lock:
+        if _scheduler is not None and settings == _settings:
+            return _scheduler
+        _scheduler = RequestScheduler(endpoints={k: settings[k] for k in DEFAULT_ENDPOINTS if k in settings},
+                                      max_attempts=settings.get('max_attempts', DEFAULT_MAX_ATTEMPTS),
+                                      backoff=settings.get('backoff_seconds', DEFAULT_BACKOFF),
+                                      max_backoff=settings.get('max_backoff_seconds', DEFAULT_MAX_BACKOFF))
+        _settings = json.loads(json.dumps(settings))
+        return _scheduler
@@ -0,0 +1,49 @@
+"""
+This module pipelines a range of dates: the slow per-date preparation (kml download and parsing)
+runs ahead on worker threads while the caller consumes the finished results in date order.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+
+def prefetch(func, items, lookahead):
+    """
+    Ordered, bounded look-ahead map.
+    At most `lookahead` calls of `func` are in flight at any time, and results are yielded
+    in the same order as `items`. An exception raised by `func` is re-raised when its item is reached,
+    and pending work is cancelled if the consumer stops early.
+
+    :param callable func: function applied to every item - runs on worker threads
+    :param iterable items: items to process, in order
+    :param int lookahead: number of items prepared ahead of the consumer. 0 disables threading.
+    :yields: func(item) for every item, in order
+    """
+    if lookahead < 1:
+        for item in items:
+            yield func(item)
+        return
+
+    logger.debug('Start pipeline with look-ahead of %d', lookahead)
+    executor = ThreadPoolExecutor(max_workers=lookahead)
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= lookahead:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
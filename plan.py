@@ -0,0 +1,62 @@
+"""
+This module presents the decisions for a range of dates without touching TimeWatch.
+Holidays and holiday eves are read from TimeWatch itself, so they are not part of a plan.
+"""
+
+import csv
+import json
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+FIELDS = ['date', 'weekday', 'mode', 'source', 'start', 'end']
+
+
+def plan_rows(work_dates):
+    """
+    :param work_dates: iterable of queried work.WorkDate
+    :return list: one dict per date with the FIELDS keys. start/end are ``HH:MM`` or ''.
+    """
+    rows = []
+    for wd in work_dates:
+        times = wd.work_day_times or {}
+        rows.append({
+            'date': wd.date.strftime('%d-%m-%Y'),
+            'weekday': wd.date.strftime('%A'),
+            'mode': wd.mode,
+            'source': wd.source,
+            'start': times['start'].strftime('%H:%M') if times.get('start') else '',
+            'end': times['end'].strftime('%H:%M') if times.get('end') else '',
+        })
+    return rows
+
+
+def format_plan(rows, fields=FIELDS):
+    """
+    :param list rows: rows from :func:`plan_rows`
+    :param list fields: columns of the rows, in order
+    :return str: aligned text table
+    """
+    widths = {f: max([len(f)] + [len(str(r[f])) for r in rows]) for f in fields}
+    lines = ['  '.join(f.ljust(widths[f]) for f in fields)]
+    lines += ['  '.join(str(r[f]).ljust(widths[f]) for f in fields) for r in rows]
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+def write_plan(rows, file_name, fields=FIELDS):
+    """
+    Export the plan - as CSV if `file_name` ends with ``.csv``, otherwise as JSON.
+
+    :param list rows: rows from :func:`plan_rows`
+    :param str file_name: output file
+    :param list fields: columns of the rows, in order
+    """
+    with open(file_name, 'w', newline='') as f:
+        if file_name.lower().endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            f.write(json.dumps(rows, indent=4))
+    logger.info('Written to %s', file_name)
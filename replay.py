@@ -0,0 +1,395 @@
+"""
+This module records a real run into a compact archive and replays it offline.
+
+Record mode runs a range as usual (over the http backend) and keeps every page the TimeWatch session
+received and every timeline kml that was downloaded. Replay mode runs the same range again against a local
+stand-in server that answers with the recorded pages, with the timelines served by a stub downloader -
+no network, no browser, and the same input every time. Both report the wall time and the number of
+round-trips, so versions can be compared on identical input.
+
+Layout of the archive (zip):
+    * ``manifest.json`` - the run (range, options, seed, parameters without the password), its results,
+      and every exchange in order: method, path and query, status, headers and body digest
+    * ``pages/<sha256>.html`` - response bodies, stored once per content
+    * ``kml/<first date>_<last date>.kml`` - downloaded timelines
+"""
+
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+import twlog
+import config
+import downloads
+import httpbackend
+import kmlparse
+import runner
+
+logger = twlog.TimeWatchLogger()
+
+ARCHIVE_VERSION = 1
+RESULT_FIELDS = ['dates', 'handled', 'wall_s', 'round_trips', 'kml_downloads', 'misses']
+
+_TIMELINE_RANGE = re.compile(r'!1i(\d+)!2i(\d+)!3i(\d+)')
+_KEPT_HEADERS = ('Content-Type', 'Location')
+
+
+class Recorder:
+    """
+    Pages and timelines of a run, kept in memory until the archive is written. Thread safe.
+    """
+
+    def __init__(self):
+        self.exchanges = []
+        self.pages = {}
+        self.kmls = {}
+        self.kml_downloads = 0
+        self._lock = threading.Lock()
+
+    def response_hook(self, response, *args, **kwargs):
+        """requests response hook - keeps the response of every request of the session"""
+        url = urlsplit(response.request.url)
+        digest = hashlib.sha256(response.content).hexdigest()
+        with self._lock:
+            self.pages[digest] = response.content
+            self.exchanges.append({
+                'method': response.request.method,
+                'path': url.path + ('?' + url.query if url.query else ''),
+                'status': response.status_code,
+                'headers': {k: response.headers[k] for k in _KEPT_HEADERS if k in response.headers},
+                'body': digest})
+        return response
+
+    def add_kml(self, url, data):
+        with self._lock:
+            self.kmls[_kml_name(url)] = data
+            self.kml_downloads += 1
+
+
+def record(parameters_file, archive, start_date, end_date, url=r'https://checkin.timewatch.co.il/punch/punch.php',
+           lookahead=3, batch_month=False, reconcile=False, seed=None):
+    """
+    Run a range over the http backend and record it.
+    The kml cache, takeout store, ledger and stored session are not used, so that every page and every timeline
+    the run needs is actually fetched - and recorded.
+
+    :param str parameters_file: JSON parameters file
+    :param str archive: archive file to write
+    :param datetime start_date: first date
+    :param datetime end_date: last date
+    :param str url: timewatch login page url
+    :param int lookahead: see runner.run_range
+    :param bool batch_month: see runner.run_range
+    :param bool reconcile: see runner.run_range
+    :param int seed: seed of the randomized work times - a random one is drawn (and recorded) if not given
+    :return dict: results of the run, see RESULT_FIELDS
+    """
+    seed = secrets.randbits(32) if seed is None else seed
+    recorder = Recorder()
+
+    class RecordingTimewatch(httpbackend.HttpTimewatch):
+        def _start_session(self, chrome_driver_path):
+            super()._start_session(chrome_driver_path)
+            self._session.hooks['response'].append(recorder.response_hook)
+
+    def recording_downloader(**kwargs):
+        return RecordingDownloader(downloads.DownloadManager(**kwargs), recorder)
+
+    params = config.load(parameters_file).params
+    options = {'start_date': start_date.strftime('%Y-%m-%d'), 'end_date': end_date.strftime('%Y-%m-%d'),
+               'url': url, 'lookahead': lookahead, 'batch_month': batch_month, 'reconcile': reconcile,
+               'seed': seed}
+    results = _run(params, backend=RecordingTimewatch, downloader_factory=recording_downloader, **options)
+    results.update(round_trips=len(recorder.exchanges), kml_downloads=recorder.kml_downloads, misses=0)
+
+    redacted = json.loads(json.dumps(params))
+    redacted['user']['pswd'] = ''
+    # the token is read from the recorded login page again on replay
+    redacted['user'].pop('token', None)
+    manifest = {'version': ARCHIVE_VERSION, 'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'options': options, 'params': redacted, 'results': results, 'exchanges': recorder.exchanges}
+    tmp = archive + '.tmp'
+    with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('manifest.json', json.dumps(manifest))
+        for digest, body in recorder.pages.items():
+            z.writestr('pages/{}.html'.format(digest), body)
+        for name, data in recorder.kmls.items():
+            z.writestr('kml/{}'.format(name), data)
+    os.replace(tmp, archive)
+    logger.info('Recorded %d exchanges and %d timelines into %s', len(recorder.exchanges), len(recorder.kmls),
+                archive)
+    return results
+
+
+def replay(archive):
+    """
+    Run a recorded range again, offline, against the recorded pages and timelines.
+
+    :param str archive: archive written by :func:`record`
+    :return dict: recorded and replayed results, see RESULT_FIELDS
+    """
+    with zipfile.ZipFile(archive, 'r') as z:
+        manifest = json.loads(z.read('manifest.json').decode('utf-8'))
+        if manifest.get('version') != ARCHIVE_VERSION:
+            raise ValueError('{} is not a supported archive (version {})'.format(archive, manifest.get('version')))
+        pages = {name[len('pages/'):-len('.html')]: z.read(name) for name in z.namelist()
+                 if name.startswith('pages/')}
+        kmls = {name[len('kml/'):]: z.read(name) for name in z.namelist() if name.startswith('kml/')}
+
+    options = dict(manifest['options'])
+    recorded_url = urlsplit(options['url'])
+    with ReplayServer(manifest['exchanges'], pages, origin='{}://{}'.format(recorded_url.scheme,
+                                                                             recorded_url.netloc)) as server:
+        options['url'] = server.origin + recorded_url.path
+        downloader = ReplayDownloader(kmls)
+        results = _run(manifest['params'], backend='http', downloader_factory=lambda **kwargs: downloader,
+                       **options)
+        results.update(round_trips=server.requests, kml_downloads=downloader.downloads,
+                       misses=server.misses + downloader.misses)
+    if results['misses']:
+        logger.warning('%d requests of the replay were not in the archive', results['misses'])
+    return {'recorded': manifest['results'], 'replayed': results}
+
+
+def format_comparison(comparison):
+    """
+    :param dict comparison: result of :func:`replay`
+    :return str: recorded and replayed results side by side
+    """
+    lines = ['{:<14}{:>12}{:>12}'.format('', 'recorded', 'replayed')]
+    for field in RESULT_FIELDS:
+        values = [comparison[k].get(field) for k in ('recorded', 'replayed')]
+        lines.append('{:<14}{:>12}{:>12}'.format(field, *[
+            '{:.2f}'.format(v) if isinstance(v, float) else str(v) for v in values]))
+    return '\n'.join(lines)
+
+
+def write_comparison(comparison, file_name):
+    """
+    Write the recorded and replayed results to a JSON file.
+
+    :param dict comparison: result of :func:`replay`
+    :param str file_name: output file
+    """
+    with open(file_name, 'w') as f:
+        f.write(json.dumps(comparison, indent=4))
+    logger.info('Replay comparison written to %s', file_name)
+
+
+def _run(params, start_date, end_date, url, lookahead, batch_month, reconcile, seed, backend, downloader_factory):
+    """
+    Run the range with its own state directories and without any local source of data.
+
+    :return dict: results of the run - round_trips, kml_downloads and misses are left to the caller
+    """
+    work_dir = tempfile.mkdtemp(prefix='twu-replay-')
+    try:
+        params = json.loads(json.dumps(params))
+        params.pop('browser_profile', None)
+        params['download_dir'] = os.path.join(work_dir, 'downloads')
+        params['journal_dir'] = os.path.join(work_dir, 'journal')
+        params['kml_cache'] = {'enabled': False}
+        params['takeout'] = {'store': os.path.join(work_dir, 'takeout')}
+        params['ledger'] = {'enabled': False}
+        params['session'] = {'enabled': False}
+        os.makedirs(params['download_dir'])
+        params_file = os.path.join(work_dir, 'params.json')
+        with open(params_file, 'w') as f:
+            f.write(json.dumps(params))
+
+        start = dt.datetime.strptime(start_date, '%Y-%m-%d')
+        end = dt.datetime.strptime(end_date, '%Y-%m-%d')
+        t = time.perf_counter()
+        handled = runner.run_range(config_file=config.ConfigFile(params_file), start_date=start, end_date=end,
+                                   backend=backend, url=url, lookahead=lookahead, batch_month=batch_month,
+                                   reconcile=reconcile, seed=seed, downloader_factory=downloader_factory)
+        wall = time.perf_counter() - t
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'dates': (end - start).days + 1, 'handled': handled, 'wall_s': wall}
+
+
+class RecordingDownloader:
+    """
+    Timeline downloader that keeps a copy of every downloaded kml.
+    """
+
+    def __init__(self, downloader, recorder):
+        self._downloader = downloader
+        self._recorder = recorder
+
+    def download(self, url, file_name):
+        self._downloader.download(url=url, file_name=file_name)
+        with open(file_name, 'rb') as f:
+            self._recorder.add_kml(url, f.read())
+        return file_name
+
+    def close(self):
+        self._downloader.close()
+
+
+class ReplayDownloader:
+    """
+    Stand-in for downloads.DownloadManager that writes the recorded timelines instead of starting a browser.
+    A range that was not recorded as such (i.e. a version that splits the range differently)
+    is built from the recorded days it covers.
+    """
+
+    def __init__(self, kmls):
+        """
+        :param dict kmls: archive kml name -> kml data
+        """
+        self._kmls = kmls
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.misses = 0
+
+    def download(self, url, file_name):
+        with self._lock:
+            self.downloads += 1
+        data = self._kmls.get(_kml_name(url))
+        if data is None:
+            data = self._compose(url)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, 'wb') as f:
+            f.write(data)
+        return file_name
+
+    def close(self):
+        pass
+
+    def _compose(self, url):
+        first, last = _timeline_range(url)
+        placemarks = []
+        covered = False
+        for name, data in self._kmls.items():
+            recorded_first, recorded_last = [dt.datetime.strptime(d, '%Y-%m-%d').date()
+                                             for d in name[:-len('.kml')].split('_')]
+            if recorded_last < first or recorded_first > last:
+                continue
+            covered = True
+            days = kmlparse.split_days(kmlparse.iter_placemarks(data), max(first, recorded_first),
+                                       min(last, recorded_last))
+            for day in sorted(days):
+                placemarks += days[day]
+        if not covered:
+            with self._lock:
+                self.misses += 1
+            logger.warning('Timeline of %s to %s was not recorded', first, last)
+        # a placemark crossing midnight is in the days of both sides
+        return kmlparse.dump_placemarks(sorted(set(placemarks), key=lambda p: p.begin))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        # the posted form is not compared - the archive holds no credentials to compare it with
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply()
+
+    def log_message(self, format, *args):
+        logger.debug('replay server: ' + format, *args)
+
+    def _reply(self):
+        exchange, body = self.server.next_response(self.command, self.path)
+        if exchange is None:
+            body, status, headers = b'not recorded', 404, {}
+        else:
+            status, headers = exchange['status'], dict(exchange['headers'])
+            if 'Location' in headers:
+                headers['Location'] = headers['Location'].replace(self.server.recorded_origin, self.server.origin)
+        self.send_response(status)
+        headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded stand-in server answering with the recorded responses.
+    The responses of every method and path are served in the recorded order - the last one is repeated
+    when the replay asks for it more often than the recorded run did.
+
+    :param list exchanges: recorded exchanges (see :class:`Recorder`)
+    :param dict pages: body digest -> body
+    :param str origin: scheme and host of the recorded server - links to it are pointed to this server
+    :param tuple address: (host, port) - port 0 picks a free port
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, exchanges, pages, origin, address=('127.0.0.1', 0)):
+        super().__init__(address, ReplayHandler)
+        self.recorded_origin = origin
+        self.origin = 'http://{}:{}'.format(*self.server_address[:2])
+        self.requests = 0
+        self.misses = 0
+        self._pages = pages
+        self._queues = {}
+        self._last = {}
+        for exchange in exchanges:
+            self._queues.setdefault((exchange['method'], exchange['path']), deque()).append(exchange)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='replay-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exception):
+        self.shutdown()
+        self.server_close()
+
+    def next_response(self, method, path):
+        """
+        :return tuple: (exchange, body) of the next recorded response of the request, or (None, None)
+        """
+        key = (method, path)
+        with self._lock:
+            self.requests += 1
+            queue = self._queues.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            exchange = self._last.get(key)
+            if exchange is None:
+                self.misses += 1
+                logger.warning('No recorded response for %s %s', method, path)
+                return None, None
+        body = self._pages[exchange['body']].replace(self.recorded_origin.encode('utf-8'),
+                                                     self.origin.encode('utf-8'))
+        return exchange, body
+
+
+def _timeline_range(url):
+    """
+    :param str url: timeline kml download link
+    :return tuple: first and last date objects of the link
+    """
+    (y1, m1, d1), (y2, m2, d2) = _TIMELINE_RANGE.findall(url)[:2]
+    return dt.date(int(y1), int(m1) + 1, int(d1)), dt.date(int(y2), int(m2) + 1, int(d2))
+
+
+def _kml_name(url):
+    first, last = _timeline_range(url)
+    return '{}_{}.kml'.format(first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'))
+
@@ -0,0 +1,250 @@
+"""
+This module fills TimeWatch for many workers at once.
+A roster file lists the parameters file of every worker; the workers are run on a pool of processes,
+with a global limit and a limit per tenant (company) on how many of them run at the same time.
+
+Every worker runs in its own process, with its own TimeWatch session and its own timeline browser
+profile, kml cache, takeout store and download folder, so the data of different people never mixes.
+
+    {
+        "max_processes": 4,
+        "max_per_tenant": 2,
+        "workers": [
+            {"name": "dana", "parameters_file": "~/twu/dana.json"},
+            {"name": "omer", "parameters_file": "~/twu/omer.json", "tenant": "acme"}
+        ]
+    }
+
+``tenant`` defaults to the company of the worker. ``max_processes`` and ``max_per_tenant``
+are optional, the command line values are used for missing ones.
+"""
+
+import concurrent.futures
+import json
+import os
+import time
+import traceback
+import zlib
+
+import twlog
+import config
+import metrics
+import runner
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'workers')
+
+
+class RosterEntry:
+    """
+    A single worker of the roster.
+    """
+
+    def __init__(self, name, parameters_file, tenant=None):
+        self.name = name
+        self.parameters_file = os.path.expanduser(parameters_file)
+        self.tenant = tenant
+
+    @classmethod
+    def from_params(cls, entry, roster_dir):
+        """
+        :param dict entry: a ``workers`` item of the roster file
+        :param str roster_dir: directory of the roster file - relative parameters files are relative to it
+        :return RosterEntry:
+        """
+        parameters_file = os.path.join(roster_dir, os.path.expanduser(entry['parameters_file']))
+        return cls(name=entry.get('name', os.path.splitext(os.path.basename(parameters_file))[0]),
+                   parameters_file=parameters_file,
+                   tenant=entry.get('tenant'))
+
+    def load_params(self):
+        """
+        :return dict: the parameters of the worker, with the worker's own state directories
+            for the values the parameters file does not set (see :func:`isolate_params`)
+        """
+        with open(self.parameters_file, 'r') as f:
+            params = json.loads(f.read())
+        if self.tenant is None:
+            self.tenant = str(params['user']['company'])
+        return isolate_params(params)
+
+
+def load_roster(roster_file):
+    """
+    :param str roster_file: roster JSON file
+    :return tuple: (list of RosterEntry, dict of the limits set in the file)
+    """
+    with open(roster_file, 'r') as f:
+        roster = json.loads(f.read())
+    roster_dir = os.path.dirname(os.path.abspath(roster_file))
+    entries = [RosterEntry.from_params(e, roster_dir) for e in roster['workers']]
+    names = [e.name for e in entries]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError('duplicate worker names in roster: {}'.format(', '.join(duplicates)))
+    limits = {k: roster[k] for k in ('max_processes', 'max_per_tenant') if k in roster}
+    return entries, limits
+
+
+def isolate_params(params):
+    """
+    Give a worker its own state: the download folder, timeline browser profile, kml cache and
+    takeout store default to directories of the worker (``~/.cache/twu/workers/<company>-<worker>``).
+    Values set in the parameters file are kept.
+
+    :param dict params: parsed JSON parameters file
+    :return dict: the same params, updated
+    """
+    state_dir = os.path.join(DEFAULT_STATE_DIR, '{}-{}'.format(params['user']['company'], params['user']['worker']))
+    params.setdefault('download_dir', os.path.join(state_dir, 'downloads'))
+    params.setdefault('browser_profile', os.path.join(state_dir, 'chrome'))
+    params.setdefault('kml_cache', {}).setdefault('dir', os.path.join(state_dir, 'kml'))
+    params.setdefault('takeout', {}).setdefault('store', os.path.join(state_dir, 'takeout'))
+    return params
+
+
+def run_roster(roster_file, start_date, end_date, processes=1, per_tenant=1, **run_kwargs):
+    """
+    Fill the date range for every worker of the roster.
+
+    Workers are started in roster order, skipping (for now) workers whose tenant is at its limit,
+    so one large company does not hold back the others.
+
+    :param str roster_file: roster JSON file
+    :param datetime start_date: first date
+    :param datetime end_date: last date
+    :param int processes: global limit of concurrently running workers, if the roster does not set one
+    :param int per_tenant: limit of concurrently running workers of the same tenant, if the roster does not set one
+    :param run_kwargs: passed to runner.run_range (backend, url, lookahead, batch_month, reconcile, seed).
+        A seed is mixed with the worker name, so workers do not get the same times
+    :return list: one result dict per worker, in roster order (see :func:`_run_worker`)
+    """
+    entries, limits = load_roster(roster_file)
+    processes = limits.get('max_processes', processes)
+    per_tenant = limits.get('max_per_tenant', per_tenant)
+    results = {}
+    for e in entries:
+        try:
+            config.Config(e.load_params(), file_name=e.parameters_file)
+        except Exception as ex:
+            # a worker with a broken parameters file fails alone, before any process starts
+            results[e.name] = _failed(e, ex)
+    pending = [e for e in entries if e.name not in results]
+    logger.info('Running %d workers on up to %d processes (%d per tenant)', len(pending), processes, per_tenant)
+
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(processes, max(1, len(pending)))) as pool:
+        while pending or running:
+            for e in list(pending):
+                if len(running) >= processes:
+                    break
+                if sum(1 for r in running.values() if r.tenant == e.tenant) >= per_tenant:
+                    continue
+                pending.remove(e)
+                running[pool.submit(_run_worker, e, start_date, end_date, metrics.is_enabled(), run_kwargs)] = e
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                e = running.pop(future)
+                try:
+                    results[e.name] = future.result()
+                except Exception as ex:
+                    # the worker process itself died
+                    results[e.name] = _failed(e, ex)
+                r = results[e.name]
+                if r['ok']:
+                    logger.info('Worker %s done in %.1f seconds', e.name, r['duration'])
+                else:
+                    logger.warning('Worker %s failed: %s', e.name, r['error'])
+    return [results[e.name] for e in entries]
+
+
+def _run_worker(entry, start_date, end_date, record_metrics, run_kwargs):
+    """
+    Runs in a pool process.
+
+    :return dict: name, tenant, ok, error, dates (non weekend dates handled), duration and the metrics summary
+    """
+    if record_metrics:
+        metrics.enable()
+    if run_kwargs.get('seed') is not None:
+        run_kwargs = dict(run_kwargs, seed=run_kwargs['seed'] ^ zlib.crc32(entry.name.encode('utf-8')))
+    t = time.time()
+    result = {'name': entry.name, 'tenant': entry.tenant, 'ok': True, 'error': None, 'dates': 0}
+    try:
+        config_file = config.ConfigFile(entry.parameters_file, prepare=isolate_params)
+        result['dates'] = runner.run_range(config_file=config_file, start_date=start_date, end_date=end_date,
+                                           **run_kwargs)
+    except Exception as ex:
+        logger.debug(traceback.format_exc())
+        result.update(ok=False, error='{}: {}'.format(type(ex).__name__, ex))
+    result['duration'] = time.time() - t
+    result['summary'] = metrics.summary() if record_metrics else None
+    return result
+
+
+def _failed(entry, ex):
+    return {'name': entry.name, 'tenant': entry.tenant, 'ok': False, 'error': '{}: {}'.format(type(ex).__name__, ex),
+            'dates': 0, 'duration': 0.0, 'summary': None}
+
+
+def aggregate(results):
+    """
+    :param list results: results of :func:`run_roster`
+    :return dict: number of workers, succeeded and failed, and the stage durations and counters
+        summed over all the workers, and the highest peaks
+    """
+    stages = {}
+    counters = {}
+    peaks = {}
+    for r in results:
+        s = r['summary'] or {}
+        for stage, v in s.get('stages', {}).items():
+            a = stages.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0})
+            a['count'] += v['count']
+            a['total'] += v['total']
+            a['max'] = max(a['max'], v['max'])
+        for name, v in s.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + v
+        for name, v in s.get('peaks', {}).items():
+            peaks[name] = max(peaks.get(name, v), v)
+    return {'workers': len(results),
+            'succeeded': sum(1 for r in results if r['ok']),
+            'failed': sum(1 for r in results if not r['ok']),
+            'dates': sum(r['dates'] for r in results),
+            'stages': stages,
+            'counters': counters,
+            'peaks': peaks}
+
+
+def format_report(results):
+    """
+    :param list results: results of :func:`run_roster`
+    :return str: text table of the workers, followed by the aggregated stage timings
+    """
+    fields = ['name', 'tenant', 'status', 'dates', 'seconds']
+    rows = [{'name': r['name'], 'tenant': r['tenant'] or '', 'status': 'ok' if r['ok'] else 'FAILED ' + r['error'],
+             'dates': r['dates'], 'seconds': '{:.1f}'.format(r['duration'])} for r in results]
+    widths = {f: max([len(f)] + [len(str(r[f])) for r in rows]) for f in fields}
+    lines = ['  '.join(f.ljust(widths[f]) for f in fields)]
+    lines += ['  '.join(str(r[f]).ljust(widths[f]) for f in fields) for r in rows]
+    total = aggregate(results)
+    lines.append('')
+    lines.append('{} workers: {} succeeded, {} failed, {} dates'.format(
+        total['workers'], total['succeeded'], total['failed'], total['dates']))
+    for stage, v in sorted(total['stages'].items()):
+        lines.append('{:<12} n={:<5} total {:9.2f} s  mean {:8.2f} ms  max {:8.2f} ms'.format(
+            stage, v['count'], v['total'], v['total'] / v['count'] * 1000, v['max'] * 1000))
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+def write_report(results, file_name):
+    """
+    Write the per worker results and their aggregate to a JSON file.
+
+    :param list results: results of :func:`run_roster`
+    :param str file_name: output file
+    """
+    with open(file_name, 'w') as f:
+        f.write(json.dumps({'workers': results, 'total': aggregate(results)}, indent=4))
+    logger.info('Roster report written to %s', file_name)
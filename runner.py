@@ -0,0 +1,145 @@
+"""
+This module runs a range of dates for one worker: the dates are queried ahead through the pipeline,
+and the TimeWatch session is opened only once the first date that needs to be submitted is reached.
+
+:class:`RangeRunner` keeps the planner (with its timeline browser) and the TimeWatch session open
+between ranges, for long running processes.
+"""
+
+import twlog
+import work
+import pipeline
+import sessionstore
+
+logger = twlog.TimeWatchLogger()
+
+
+class RangeRunner:
+    """
+    Planner and TimeWatch session of a single worker, kept open across ranges.
+    Ranges are run one at a time.
+    """
+
+    def __init__(self, config_file, backend='selenium', url=r'https://checkin.timewatch.co.il/punch/punch.php',
+                 lookahead=3, batch_month=False, reconcile=False, seed=None, downloader_factory=None):
+        """
+        :param config.ConfigFile config_file: parameters file - changes to it apply to the dates queried after the change
+        :param backend: 'selenium', 'http' or a web.Timewatch class
+        :param str url: timewatch login page url
+        :param int lookahead: dates queried ahead of the session (see pipeline.prefetch)
+        :param bool batch_month: see web.Timewatch
+        :param bool reconcile: see web.Timewatch
+        :param int seed: seed of the randomized work times
+        :param callable downloader_factory: see work.WorkPlanner
+        """
+        self._config_file = config_file
+        self._backend = backend
+        self._url = url
+        self._lookahead = lookahead
+        self._batch_month = batch_month
+        self._reconcile = reconcile
+        self.planner = work.WorkPlanner(config_file.current, seed=seed, downloader_factory=downloader_factory)
+        self._tw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        """
+        Close the TimeWatch session, if one was opened, and the planner.
+        """
+        try:
+            self.close_session()
+        finally:
+            self.planner.close()
+
+    def run(self, start_date, end_date):
+        """
+        Fill TimeWatch for every date between `start_date` and `end_date` (included).
+
+        :param datetime start_date: first date
+        :param datetime end_date: last date
+        :return int: number of non weekend dates handled
+        """
+        handled = 0
+        dates = list(work.date_list(start_date=start_date, end_date=end_date))
+        self._apply_config()
+        self.planner.prepare(dates)
+        if self._tw is not None:
+            # the month overviews of a previous range may be outdated
+            self._tw.forget_months()
+        for wd in pipeline.prefetch(self.planner.query, dates, lookahead=self._lookahead):
+            self._apply_config()
+            if wd.mode == 'weekend':
+                continue
+            try:
+                self._session().update_date(wd.date, work_date=wd)
+            except sessionstore.SessionRejected:
+                # a session kept open for long expires on the server - start a new one, once
+                logger.info('TimeWatch session expired - logging in again')
+                self.close_session()
+                self._session().update_date(wd.date, work_date=wd)
+            handled += 1
+        return handled
+
+    def _apply_config(self):
+        conf = self._config_file.current
+        if conf is not self.planner.config:
+            self.planner.set_config(conf)
+            if self._tw is not None:
+                self._tw.set_config(conf)
+
+    def _session(self):
+        if self._tw is None:
+            # the browser/session is started only once there is something to submit
+            tw = get_backend(self._backend)(params=self.planner.config, url=self._url, batch_month=self._batch_month,
+                                            reconcile=self._reconcile, planner=self.planner)
+            self._tw = tw.__enter__()
+        return self._tw
+
+    def close_session(self):
+        """
+        Close the TimeWatch session - the next date to submit opens a new one.
+        """
+        tw, self._tw = self._tw, None
+        if tw is not None:
+            tw.__exit__(None, None, None)
+
+
+def run_range(config_file, start_date, end_date, backend='selenium', url=r'https://checkin.timewatch.co.il/punch/punch.php',
+              lookahead=3, batch_month=False, reconcile=False, seed=None, downloader_factory=None):
+    """
+    Fill TimeWatch for every date between `start_date` and `end_date` (included).
+
+    :param config.ConfigFile config_file: parameters file - changes to it apply to the dates queried after the change
+    :param datetime start_date: first date
+    :param datetime end_date: last date
+    :param backend: 'selenium', 'http' or a web.Timewatch class
+    :param str url: timewatch login page url
+    :param int lookahead: dates queried ahead of the session (see pipeline.prefetch)
+    :param bool batch_month: see web.Timewatch
+    :param bool reconcile: see web.Timewatch
+    :param int seed: seed of the randomized work times
+    :param callable downloader_factory: see work.WorkPlanner
+    :return int: number of non weekend dates handled
+    """
+    with RangeRunner(config_file, backend=backend, url=url, lookahead=lookahead, batch_month=batch_month,
+                     reconcile=reconcile, seed=seed, downloader_factory=downloader_factory) as r:
+        return r.run(start_date, end_date)
+
+
+def get_backend(name):
+    """
+    :param name: 'selenium' or 'http' - or a Timewatch class, returned as is
+    :return: Timewatch class of the backend - its (heavy) module is imported here, on first use
+    """
+    if not isinstance(name, str):
+        return name
+    if name == 'http':
+        import httpbackend
+        return httpbackend.HttpTimewatch
+    import web
+    return web.Timewatch
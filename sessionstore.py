@@ -0,0 +1,99 @@
+"""
+This module keeps the authenticated TimeWatch session of a worker between runs.
+After a login, the session cookies and the employee token are saved with their expiry; the next run
+restores them and starts with the first date right away. A full login is only done when nothing valid
+is stored, or when the server rejects the stored session.
+
+The files are readable by their owner only. The password is never stored.
+"""
+
+import json
+import os
+import time
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_SESSION_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'session')
+
+
+class SessionRejected(Exception):
+    """The server answered with its login page - the session is not (or no longer) valid."""
+    pass
+
+
+class SessionStore:
+    """
+    Stored session of a single worker.
+    """
+
+    def __init__(self, company, worker, session_dir=DEFAULT_SESSION_DIR, max_age_hours=8):
+        """
+        :param company: company No.
+        :param worker: worker ID number
+        :param str session_dir: directory of the session files
+        :param float max_age_hours: a stored session is not used after this many hours,
+            or after its first cookie expires if that is earlier
+        """
+        self._session_dir = session_dir
+        self._file_name = os.path.join(session_dir, 'session-{}-{}.json'.format(company, worker))
+        self._max_age = max_age_hours * 3600
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Build the store from the ``session`` section of the parameters file.
+        ``"session": {"enabled": false}`` always logs in and stores nothing.
+
+        :param dict params: parsed JSON parameters file
+        :return: SessionStore or None if disabled
+        """
+        conf = params['session'] if 'session' in params else {}
+        if not conf.get('enabled', True):
+            return None
+        return cls(company=params['user']['company'], worker=params['user']['worker'],
+                   session_dir=os.path.expanduser(conf.get('dir', DEFAULT_SESSION_DIR)),
+                   max_age_hours=conf.get('max_age_hours', 8))
+
+    def load(self, url):
+        """
+        :param str url: timewatch login page url the session belongs to
+        :return dict: token and cookies (list of dicts with name, value, domain, path, expires and secure)
+            of a stored, unexpired session of `url` - or None
+        """
+        try:
+            with open(self._file_name, 'r') as f:
+                stored = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if stored.get('url') != url or not stored.get('token'):
+            return None
+        if stored.get('expires', 0) <= time.time():
+            logger.debug('stored session expired')
+            self.clear()
+            return None
+        return stored
+
+    def save(self, url, token, cookies):
+        """
+        :param str url: timewatch login page url of the session
+        :param str token: employee token
+        :param list cookies: session cookies, see :meth:`load`
+        """
+        now = time.time()
+        expires = min([now + self._max_age] + [c['expires'] for c in cookies if c.get('expires')])
+        stored = {'url': url, 'token': token, 'cookies': cookies, 'saved': now, 'expires': expires}
+        os.makedirs(self._session_dir, mode=0o700, exist_ok=True)
+        tmp = self._file_name + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(stored))
+        os.replace(tmp, self._file_name)
+        logger.debug('session stored until %s', time.strftime('%Y-%m-%d %H:%M', time.localtime(expires)))
+
+    def clear(self):
+        try:
+            os.remove(self._file_name)
+        except FileNotFoundError:
+            pass
@@ -24,6 +24,12 @@ with open("README.md", "r") as fh:
 params_default = {
     'params_version': "1.0.0",
     'download_dir': os.path.join(os.path.expanduser('~'), 'Downloads'),
+    'kml_cache': {
+        'enabled': True,
+        'dir': os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'kml'),
+        'max_size_mb': 50,
+        'max_age_days': 365
+    },
     'user': {
         'company': 'xxx',
         'worker': 'yyy',
@@ -34,6 +40,7 @@ params_default = {
             'lat': 55.555555,
             'long': 66.666666
         },
+        'radius': 300,
         'weekend': ['Friday', 'Saturday'],
         'work_day': {
             'randomize': True,
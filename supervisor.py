@@ -0,0 +1,375 @@
+"""
+This module supervises the browser processes the tool starts (the timeline download browser and the
+selenium chromedriver with its chrome).
+
+Every browser is started in its own process group, with its output sent to a log file or discarded,
+and is stopped together with all its descendants - chrome renderers and helpers included - so nothing
+is left behind when a run ends or crashes. The number of browsers running at once is capped, and the
+resident memory and cpu time of every browser's process tree is sampled, so the peaks can be reported
+and a browser that grew too big can be restarted.
+
+Memory and cpu are read from ``/proc`` - on other systems the processes are still supervised, but not measured.
+"""
+
+import atexit
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import twlog
+import metrics
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_MAX_INSTANCES = 2
+# a chrome that grew above this is restarted between two downloads - a fresh one uses a few hundred MB
+DEFAULT_MAX_RSS_MB = 1500
+SAMPLE_INTERVAL = 1.0
+
+_PROC = '/proc'
+
+
+class Browser:
+    """
+    A supervised process and its resource peaks.
+    """
+
+    def __init__(self, process, name, counted, own_group):
+        self.process = process
+        self.name = name
+        self.counted = counted
+        self.own_group = own_group
+        self.started = time.monotonic()
+        self.rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        self.cpu_s = 0.0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def poll(self):
+        return self.process.poll()
+
+    def report(self):
+        """
+        :return dict: name, pid, peak_rss_mb, cpu_s and wall_s of the browser
+        """
+        return {'name': self.name, 'pid': self.pid, 'peak_rss_mb': round(self.peak_rss_mb, 1),
+                'cpu_s': round(self.cpu_s, 2), 'wall_s': round(time.monotonic() - self.started, 1)}
+
+
+class BrowserSupervisor:
+    """
+    Starts, measures and stops browser process trees. Thread safe.
+    """
+
+    def __init__(self, max_instances=DEFAULT_MAX_INSTANCES, log_file=None, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 sample_interval=SAMPLE_INTERVAL):
+        """
+        :param int max_instances: browsers allowed to run at once - starting one more waits for one to stop
+        :param str log_file: file the browsers' output is appended to - discarded if not given
+        :param float max_rss_mb: memory of a browser's process tree above which it should be restarted -
+            None for no limit
+        :param float sample_interval: seconds between two samples of the browsers' memory and cpu
+        """
+        self.max_instances = max_instances
+        self.log_file = log_file
+        self.max_rss_mb = max_rss_mb
+        self._sample_interval = sample_interval
+        self._browsers = []
+        self._finished = []
+        self._changed = threading.Condition()
+        self._sampler = None
+
+    def configure(self, max_instances=None, log_file=None, max_rss_mb=None):
+        """
+        Apply new limits - browsers already running keep running. Limits not given are set to their default.
+        """
+        with self._changed:
+            self.max_instances = max_instances if max_instances is not None else DEFAULT_MAX_INSTANCES
+            self.log_file = log_file
+            self.max_rss_mb = max_rss_mb if max_rss_mb is not None else DEFAULT_MAX_RSS_MB
+            self._changed.notify_all()
+
+    def start(self, args, name, counted=True, timeout=300):
+        """
+        Start a browser in its own process group.
+
+        :param list args: command line
+        :param str name: name of the browser in logs and reports
+        :param bool counted: counts against max_instances - False for short lived launchers that hand
+            their work to a running browser and exit
+        :param float timeout: seconds to wait for a free instance
+        :return Browser: the supervised process
+        :raises RuntimeError: if no instance was freed within `timeout` seconds
+        """
+        with self._changed:
+            if counted:
+                deadline = time.monotonic() + timeout
+                while self._running() >= self.max_instances:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RuntimeError('{} browsers already running - could not start {}'.format(
+                            self._running(), name))
+                    self._changed.wait(min(remaining, self._sample_interval))
+                    self._reap_exited()
+            output = open(self.log_file, 'ab') if self.log_file else subprocess.DEVNULL
+            try:
+                process = subprocess.Popen(args=args, stdin=subprocess.DEVNULL, stdout=output,
+                                           stderr=subprocess.STDOUT if self.log_file else subprocess.DEVNULL,
+                                           **_new_group_kwargs())
+            finally:
+                if self.log_file:
+                    output.close()
+            browser = Browser(process, name, counted=counted, own_group=True)
+            self._track(browser)
+        logger.debug('started %s (pid %d)', name, process.pid)
+        return browser
+
+    def adopt(self, process, name):
+        """
+        Supervise a process started elsewhere (i.e. the chromedriver of a selenium session).
+        It is not counted against max_instances - it was started already.
+
+        :param subprocess.Popen process: the process
+        :param str name: name of the browser in logs and reports
+        :return Browser: the supervised process
+        """
+        own_group = _process_group(process.pid) not in (None, _process_group(os.getpid()))
+        browser = Browser(process, name, counted=False, own_group=own_group)
+        with self._changed:
+            self._track(browser)
+        return browser
+
+    def stop(self, browser, timeout=5.0):
+        """
+        Stop a browser and all its descendants: terminate, then kill whatever is left after `timeout` seconds.
+        The final memory and cpu peaks are logged and added to the metrics.
+
+        :param Browser browser: a browser of this supervisor
+        :param float timeout: seconds given to the browser to exit by itself
+        """
+        self._sample(browser)
+        tree = _descendants(browser.pid)
+        if browser.poll() is None or tree:
+            _signal_tree(browser, tree, signal.SIGTERM)
+            deadline = time.monotonic() + timeout
+            try:
+                browser.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                pass
+            # children re-parented to init when their parent died are still waited for, and killed
+            tree = [pid for pid in tree + _descendants(browser.pid) if _alive(pid)]
+            while tree and time.monotonic() < deadline:
+                time.sleep(0.05)
+                tree = [pid for pid in tree if _alive(pid)]
+            if browser.poll() is None or tree:
+                logger.debug('killing %s (pid %d) and %d descendants', browser.name, browser.pid, len(tree))
+                _signal_tree(browser, tree, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                browser.process.wait()
+        with self._changed:
+            if browser not in self._browsers:
+                return
+            self._browsers.remove(browser)
+            self._finished.append(browser)
+            self._changed.notify_all()
+        self._account(browser)
+
+    def over_limit(self, browser):
+        """
+        :param Browser browser: a running browser
+        :return bool: True if the browser's process tree uses more than max_rss_mb
+        """
+        if self.max_rss_mb is None or browser.poll() is not None:
+            return False
+        self._sample(browser)
+        return browser.rss_mb > self.max_rss_mb
+
+    def report(self):
+        """
+        :return list: report (see Browser.report) of every browser started since the supervisor was created
+        """
+        with self._changed:
+            browsers = self._finished + self._browsers
+        return [b.report() for b in browsers]
+
+    def close(self):
+        """
+        Stop every browser still running.
+        """
+        with self._changed:
+            browsers = list(self._browsers)
+        for browser in browsers:
+            self.stop(browser)
+        for r in self.report():
+            logger.debug('%s (pid %d): peak %.1f MB, %.2f cpu seconds', r['name'], r['pid'], r['peak_rss_mb'],
+                         r['cpu_s'])
+
+    def _running(self):
+        return sum(1 for b in self._browsers if b.counted and b.poll() is None)
+
+    def _track(self, browser):
+        self._browsers.append(browser)
+        if self._sampler is None and os.path.isdir(_PROC):
+            self._sampler = threading.Thread(target=self._sample_loop, name='browser-sampler', daemon=True)
+            self._sampler.start()
+
+    def _reap_exited(self):
+        """browsers that exited by themselves (i.e. launchers) - their descendants stay supervised until then"""
+        for browser in [b for b in self._browsers if b.poll() is not None and not _descendants(b.pid)]:
+            self._browsers.remove(browser)
+            self._finished.append(browser)
+            self._account(browser)
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self._sample_interval)
+            with self._changed:
+                self._reap_exited()
+                browsers = list(self._browsers)
+                if not browsers:
+                    self._sampler = None
+                    return
+            for browser in browsers:
+                self._sample(browser)
+
+    def _sample(self, browser):
+        pids = _descendants(browser.pid)
+        if browser.poll() is None:
+            pids.append(browser.pid)
+        rss_mb, cpu_s = _tree_usage(pids)
+        if rss_mb is None:
+            return
+        browser.rss_mb = rss_mb
+        browser.peak_rss_mb = max(browser.peak_rss_mb, rss_mb)
+        # cpu time only grows - the reaped children are counted in their parent's cutime
+        browser.cpu_s = max(browser.cpu_s, cpu_s)
+
+    def _account(self, browser):
+        metrics.count('browser_cpu_seconds', browser.cpu_s)
+        metrics.peak('browser_peak_rss_mb', browser.peak_rss_mb)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def supervisor():
+    """
+    :return BrowserSupervisor: the supervisor of this process - its browsers are stopped when the process exits
+    """
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = BrowserSupervisor()
+            atexit.register(_supervisor.close)
+        return _supervisor
+
+
+def configure_from_params(params):
+    """
+    Apply the ``browsers`` section of the parameters: ``max_instances``, ``log_file`` and ``max_rss_mb``.
+
+    :param dict params: parsed JSON parameters file
+    :return BrowserSupervisor: the supervisor of this process
+    """
+    settings = params.get('browsers', {})
+    log_file = settings.get('log_file')
+    s = supervisor()
+    s.configure(max_instances=settings.get('max_instances'),
+                log_file=os.path.expanduser(log_file) if log_file else None,
+                max_rss_mb=settings.get('max_rss_mb'))
+    return s
+
+
+def _new_group_kwargs():
+    if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def _signal_tree(browser, pids, sig):
+    if browser.own_group and hasattr(os, 'killpg'):
+        try:
+            os.killpg(browser.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+    elif browser.poll() is None:
+        browser.process.send_signal(sig)
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def _stat(pid):
+    """
+    :return list: fields of /proc/<pid>/stat after the command name (the state is the first) - None if gone
+    """
+    try:
+        with open(os.path.join(_PROC, str(pid), 'stat'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data[data.rfind(b')') + 2:].split()
+
+
+def _process_group(pid):
+    if hasattr(os, 'getpgid'):
+        try:
+            return os.getpgid(pid)
+        except OSError:
+            return None
+    return None
+
+
+def _alive(pid):
+    fields = _stat(pid)
+    return fields is not None and fields[0] != b'Z'
+
+
+def _descendants(pid):
+    """
+    :return list: pids of the live descendants of `pid` - empty without /proc
+    """
+    if not os.path.isdir(_PROC):
+        return []
+    children = {}
+    for entry in os.listdir(_PROC):
+        if not entry.isdigit():
+            continue
+        fields = _stat(entry)
+        if fields is not None and fields[0] != b'Z':
+            children.setdefault(int(fields[1]), []).append(int(entry))
+    found = []
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def _tree_usage(pids):
+    """
+    :return tuple: resident memory (MB) and cpu time (seconds) of the processes - (None, None) without /proc
+    """
+    if not os.path.isdir(_PROC):
+        return None, None
+    page_mb = os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    ticks = os.sysconf('SC_CLK_TCK')
+    rss_pages = 0
+    cpu_ticks = 0
+    for pid in pids:
+        fields = _stat(pid)
+        if fields is None:
+            continue
+        # utime, stime, cutime and cstime are fields 14 to 17 of stat, rss is field 24
+        cpu_ticks += sum(int(x) for x in fields[11:15])
+        rss_pages += int(fields[21])
+    return rss_pages * page_mb, cpu_ticks / ticks
@@ -0,0 +1,281 @@
+"""
+This module imports a Google Takeout location history export into a compact local store.
+The export (``Records.json`` and/or ``Semantic Location History`` month files) is stream parsed once
+into columnar numpy arrays sorted by time, with an index of the records of every (local) day.
+Dates covered by the store are then answered locally, without a browser and without network.
+"""
+
+import array
+import datetime as dt
+import json
+import os
+import time
+
+import numpy as np
+
+import twlog
+import kmlparse
+
+logger = twlog.TimeWatchLogger()
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twu', 'takeout')
+
+_COLUMNS = ('begin', 'end', 'lat', 'long')
+# an array item is never larger - even with small chunks
+_MIN_ITEM_LIMIT = 1 << 20
+# a decode error this far before the end of the buffer is not cut by the chunk end
+_DECODE_MARGIN = 16
+
+
+class TakeoutStore:
+    """
+    Memory mapped location records indexed by date.
+
+    Layout of `store_dir`:
+        * ``begin.npy``, ``end.npy`` - record start/end as unix time (seconds, int64).
+          Single location samples have begin == end.
+        * ``lat.npy``, ``long.npy`` - record location in decimal degrees (float32)
+        * ``index.json`` - first and last covered date, and date -> [first, last) record offsets
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        self._store_dir = store_dir
+        with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+            index = json.loads(f.read())
+        self.first_date = dt.datetime.strptime(index['first'], '%Y-%m-%d').date()
+        self.last_date = dt.datetime.strptime(index['last'], '%Y-%m-%d').date()
+        self._days = index['days']
+        self._columns = {c: np.load(os.path.join(store_dir, c + '.npy'), mmap_mode='r') for c in _COLUMNS}
+        logger.debug('Loaded takeout store %s covering %s to %s', store_dir, index['first'], index['last'])
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Open the store configured in the ``takeout`` section of the parameters file.
+
+        :param dict params: parsed JSON parameters file
+        :return: TakeoutStore, or None if no store was imported
+        """
+        store_dir = store_dir_from_params(params)
+        if not os.path.exists(os.path.join(store_dir, 'index.json')):
+            return None
+        return cls(store_dir)
+
+    def covers(self, date):
+        """
+        :param datetime date: date to check
+        :return bool: True if the export this store was built from includes `date`
+        """
+        return self.first_date <= _as_date(date) <= self.last_date
+
+    def placemarks(self, date):
+        """
+        Location records of a single (local) date.
+
+        :param datetime date: date to query
+        :return list: list of kmlparse.Placemark
+        """
+        first, last = self._days.get(_as_date(date).strftime('%Y-%m-%d'), (0, 0))
+        columns = {c: self._columns[c][first:last] for c in _COLUMNS}
+        return [kmlparse.Placemark(begin=dt.datetime.fromtimestamp(int(b), dt.timezone.utc),
+                                   end=dt.datetime.fromtimestamp(int(e), dt.timezone.utc),
+                                   lon=float(lon), lat=float(lat))
+                for b, e, lat, lon in zip(columns['begin'], columns['end'], columns['lat'], columns['long'])]
+
+
+def store_dir_from_params(params):
+    """
+    :param dict params: parsed JSON parameters file
+    :return str: store directory from ``takeout.store``, or the default one
+    """
+    conf = params['takeout'] if 'takeout' in params else {}
+    return os.path.expanduser(conf.get('store', DEFAULT_STORE_DIR))
+
+
+def import_takeout(paths, store_dir=DEFAULT_STORE_DIR):
+    """
+    Build (or rebuild) a store from takeout export files.
+
+    :param list paths: ``Records.json`` files, ``Semantic Location History`` month files,
+        or directories containing them
+    :param str store_dir: directory of the store
+    :return TakeoutStore: the new store
+    """
+    columns = {'begin': array.array('q'), 'end': array.array('q'),
+               'lat': array.array('f'), 'long': array.array('f')}
+    for file_name in _expand_paths(paths):
+        logger.info('Importing %s', file_name)
+        count = 0
+        for begin, end, lat, long in _iter_file_records(file_name):
+            columns['begin'].append(begin)
+            columns['end'].append(end)
+            columns['lat'].append(lat)
+            columns['long'].append(long)
+            count += 1
+        logger.info('Imported %d records from %s', count, file_name)
+
+    if not len(columns['begin']):
+        raise ValueError('no location records found in {}'.format(', '.join(paths)))
+
+    begin = np.frombuffer(columns['begin'], dtype=np.int64)
+    order = np.argsort(begin, kind='stable')
+    arrays = {'begin': begin[order],
+              'end': np.frombuffer(columns['end'], dtype=np.int64)[order],
+              'lat': np.frombuffer(columns['lat'], dtype=np.float32)[order],
+              'long': np.frombuffer(columns['long'], dtype=np.float32)[order]}
+    del columns
+
+    first_date = dt.date.fromtimestamp(int(arrays['begin'][0]))
+    last_date = dt.date.fromtimestamp(int(arrays['begin'][-1]))
+    num_days = (last_date - first_date).days + 1
+    dates = [first_date + dt.timedelta(days=d) for d in range(num_days + 1)]
+    midnights = np.array([time.mktime((d.year, d.month, d.day, 0, 0, 0, 0, 0, -1)) for d in dates])
+    offsets = np.searchsorted(arrays['begin'], midnights, side='left')
+    offsets[-1] = len(arrays['begin'])
+    days = {dates[d].strftime('%Y-%m-%d'): [int(offsets[d]), int(offsets[d + 1])]
+            for d in range(num_days) if offsets[d + 1] > offsets[d]}
+
+    os.makedirs(store_dir, exist_ok=True)
+    for c in _COLUMNS:
+        np.save(os.path.join(store_dir, c + '.npy'), arrays[c])
+    tmp = os.path.join(store_dir, 'index.json.tmp')
+    with open(tmp, 'w') as f:
+        f.write(json.dumps({'first': first_date.strftime('%Y-%m-%d'),
+                            'last': last_date.strftime('%Y-%m-%d'),
+                            'days': days}))
+    os.replace(tmp, os.path.join(store_dir, 'index.json'))
+    logger.info('Takeout store %s: %d records, %s to %s', store_dir, len(arrays['begin']),
+                first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d'))
+    return TakeoutStore(store_dir)
+
+
+def _expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith('.json'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _iter_file_records(file_name):
+    """
+    :yields: (begin, end, lat, long) tuples of every location record in a takeout file
+    """
+    with open(file_name, 'r', encoding='utf-8') as f:
+        head = f.read(4096)
+        f.seek(0)
+        if '"timelineObjects"' in head:
+            for obj in iter_json_array(f, 'timelineObjects'):
+                yield from _semantic_records(obj)
+        else:
+            for obj in iter_json_array(f, 'locations'):
+                record = _raw_record(obj)
+                if record is not None:
+                    yield record
+
+
+def _raw_record(obj):
+    """Record of a ``Records.json`` location sample."""
+    try:
+        t = _timestamp(obj, 'timestampMs', 'timestamp')
+        return t, t, obj['latitudeE7'] / 1e7, obj['longitudeE7'] / 1e7
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _semantic_records(obj):
+    """Records of a ``Semantic Location History`` timeline object - place visits and activity ends."""
+    try:
+        if 'placeVisit' in obj:
+            visit = obj['placeVisit']
+            location = visit['location']
+            yield (_timestamp(visit['duration'], 'startTimestampMs', 'startTimestamp'),
+                   _timestamp(visit['duration'], 'endTimestampMs', 'endTimestamp'),
+                   location['latitudeE7'] / 1e7, location['longitudeE7'] / 1e7)
+        elif 'activitySegment' in obj:
+            segment = obj['activitySegment']
+            start = _timestamp(segment['duration'], 'startTimestampMs', 'startTimestamp')
+            end = _timestamp(segment['duration'], 'endTimestampMs', 'endTimestamp')
+            yield start, start, segment['startLocation']['latitudeE7'] / 1e7, \
+                segment['startLocation']['longitudeE7'] / 1e7
+            yield end, end, segment['endLocation']['latitudeE7'] / 1e7, segment['endLocation']['longitudeE7'] / 1e7
+    except (KeyError, TypeError, ValueError):
+        return
+
+
+def _timestamp(obj, ms_key, iso_key):
+    """Unix time (seconds) from either the old milliseconds field or the newer ISO 8601 field."""
+    if ms_key in obj:
+        return int(obj[ms_key]) // 1000
+    return int(kmlparse.parse_time(obj[iso_key]).timestamp())
+
+
+def iter_json_array(f, key, chunk_size=1 << 20):
+    """
+    Stream the items of the array under `key` of a (possibly huge) JSON document.
+    Only one chunk of the file and one item are held in memory at a time - a malformed item is an error,
+    it is not read on to the end of the file.
+
+    :param f: text file handle
+    :param str key: name of the array member, i.e. ``locations``
+    :param int chunk_size: characters read from the file at a time
+    :yields: decoded array items
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = -1
+    marker = '"{}"'.format(key)
+    while pos < 0:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+        pos = buf.find(marker)
+        if pos < 0:
+            buf = buf[-len(marker):]
+    # a '[' before the marker (i.e. in an earlier member) is not the array
+    start = pos + len(marker)
+    pos = buf.find('[', start)
+    while pos < 0:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+        pos = buf.find('[', start)
+    idx = pos + 1
+    eof = False
+    item_limit = max(4 * chunk_size, _MIN_ITEM_LIMIT)
+    while True:
+        while idx < len(buf) and buf[idx] in ' \t\r\n,':
+            idx += 1
+        if idx < len(buf) and buf[idx] == ']':
+            return
+        try:
+            if idx >= len(buf):
+                raise ValueError
+            item, end = decoder.raw_decode(buf, idx)
+        except ValueError as ex:
+            name = getattr(f, 'name', 'file')
+            if eof:
+                raise ValueError('truncated JSON array {} in {}'.format(key, name))
+            # an unterminated string points at its start - it may still end in the next chunk
+            if (isinstance(ex, json.JSONDecodeError) and ex.pos < len(buf) - _DECODE_MARGIN
+                    and not ex.msg.startswith('Unterminated string')):
+                raise ValueError('malformed item of JSON array {} in {}: {}'.format(key, name, ex))
+            if len(buf) - idx > item_limit:
+                raise ValueError('item of JSON array {} in {} is longer than {} characters'.format(
+                    key, name, item_limit))
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[idx:] + chunk
+            idx = 0
+            continue
+        yield item
+        idx = end
+
+
+def _as_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
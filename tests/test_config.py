@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+import config
+
+
+def _params():
+    return {
+        'user': {'company': '1', 'worker': '2', 'pswd': '3'},
+        'work': {
+            'location': {'lat': 32.0, 'long': 34.0},
+            'weekend': ['Friday', 'Saturday'],
+            'work_day': {'randomize': True, 'max_length': 10, 'nominal_length': 9,
+                         'minimal_start_time': '07:00', 'maximal_end_time': '20:00'},
+        },
+        'home': {'work_from_home_excuse_index': 5},
+        'holiday': {'holiday_eve_index': 3, 'holiday_eve_text': [], 'holiday_index': 4, 'holiday_text': []},
+    }
+
+
+def _write(file_name, params, stamp):
+    with open(file_name, 'w') as f:
+        f.write(json.dumps(params))
+    # a distinct modification time for every edit, however fast the test runs
+    os.utime(file_name, ns=(stamp, stamp))
+
+
+def _infeasible(params):
+    params['work']['work_day']['maximal_end_time'] = '09:00'
+
+
+def _distribution(params):
+    params['work']['work_day']['distribution'] = 'normal'
+
+
+def _excuse(params):
+    params['home']['work_from_home_excuse_index'] = 'five'
+
+
+def _holiday_text(params):
+    params['holiday']['holiday_text'] = ['x']
+
+
+@pytest.mark.parametrize('edit', [_infeasible, _distribution, _excuse, _holiday_text])
+def test_invalid_values_are_config_errors(edit):
+    params = _params()
+    edit(params)
+    with pytest.raises(config.ConfigError):
+        config.Config(params)
+
+
+@pytest.mark.parametrize('edit', [_infeasible, _distribution, _excuse, _holiday_text])
+def test_invalid_edit_keeps_the_previous_config(tmp_path, edit):
+    file_name = str(tmp_path / 'params.json')
+    _write(file_name, _params(), 10 ** 18)
+    params_file = config.ConfigFile(file_name, check_interval=0)
+    previous = params_file.current
+
+    params = _params()
+    edit(params)
+    _write(file_name, params, 2 * 10 ** 18)
+    assert params_file.current is previous
+    assert params_file.reload() is False
+
+    # the same broken file is tried again, and a fixed one is loaded
+    params = _params()
+    params['home']['work_from_home_excuse_index'] = 6
+    _write(file_name, params, 2 * 10 ** 18)
+    assert params_file.current.work_from_home_excuse == 6
+
+
+def test_unchanged_file_is_not_loaded_again(tmp_path):
+    file_name = str(tmp_path / 'params.json')
+    _write(file_name, _params(), 10 ** 18)
+    params_file = config.ConfigFile(file_name, check_interval=0)
+    assert params_file.reload() is False
+    assert params_file.reload(force=True) is True
@@ -0,0 +1,74 @@
+import datetime as dt
+
+import dwell
+import geofence
+import kmlparse
+
+WORK = (32.0, 34.0)
+HOME = (32.1, 34.2)
+
+
+def _at(day, hour, minute=0):
+    return dt.datetime(2020, 7, day, hour, minute).astimezone()
+
+
+def _visit(begin, end, site):
+    return kmlparse.Placemark(begin=begin, end=end, lon=site[1], lat=site[0])
+
+
+def _analyze(placemarks, min_gap=0.0):
+    return dwell.analyze(placemarks, geofence.Geofence([WORK]), min_gap=min_gap)
+
+
+def test_stay_crossing_midnight_belongs_to_its_first_day():
+    days = _analyze([_visit(_at(1, 22), _at(2, 2, 30), WORK)])
+    assert list(days) == [dt.date(2020, 7, 1)]
+    day = days[dt.date(2020, 7, 1)]
+    assert day.arrival == _at(1, 22)
+    assert day.departure == _at(2, 2, 30)
+    assert day.dwell == dt.timedelta(hours=4, minutes=30)
+    assert day.gaps == []
+
+
+def test_night_shift_and_next_day_are_separate_days():
+    days = _analyze([_visit(_at(1, 22), _at(2, 6), WORK), _visit(_at(2, 9), _at(2, 17), WORK),
+                     _visit(_at(2, 6, 30), _at(2, 8, 30), HOME)])
+    assert sorted(days) == [dt.date(2020, 7, 1), dt.date(2020, 7, 2)]
+    assert days[dt.date(2020, 7, 1)].departure == _at(2, 6)
+    assert days[dt.date(2020, 7, 2)].arrival == _at(2, 9)
+
+
+def test_gap_with_a_record_away_is_kept():
+    days = _analyze([_visit(_at(1, 8), _at(1, 12), WORK), _visit(_at(1, 12, 30), _at(1, 13), HOME),
+                     _visit(_at(1, 13, 30), _at(1, 17), WORK)])
+    day = days[dt.date(2020, 7, 1)]
+    assert day.arrival == _at(1, 8)
+    assert day.departure == _at(1, 17)
+    assert day.gaps == [(_at(1, 12), _at(1, 13, 30))]
+    assert day.dwell == dt.timedelta(hours=7, minutes=30)
+
+
+def test_gap_without_data_is_not_leaving():
+    days = _analyze([_visit(_at(1, 8), _at(1, 12), WORK), _visit(_at(1, 13), _at(1, 17), WORK)])
+    day = days[dt.date(2020, 7, 1)]
+    assert day.gaps == []
+    assert day.dwell == dt.timedelta(hours=9)
+
+
+def test_gap_shorter_than_min_gap_is_joined():
+    placemarks = [_visit(_at(1, 8), _at(1, 12), WORK), _visit(_at(1, 12), _at(1, 12, 10), HOME),
+                  _visit(_at(1, 12, 10), _at(1, 17), WORK)]
+    assert len(_analyze(placemarks)[dt.date(2020, 7, 1)].gaps) == 1
+    assert _analyze(placemarks, min_gap=3600)[dt.date(2020, 7, 1)].gaps == []
+
+
+def test_overlapping_records_are_merged_in_any_order():
+    placemarks = [_visit(_at(1, 10), _at(1, 15), WORK), _visit(_at(1, 8), _at(1, 11), WORK),
+                  _visit(_at(1, 14), _at(1, 16), WORK)]
+    day = _analyze(placemarks)[dt.date(2020, 7, 1)]
+    assert (day.arrival, day.departure, day.dwell) == (_at(1, 8), _at(1, 16), dt.timedelta(hours=8))
+
+
+def test_no_record_at_work():
+    assert _analyze([_visit(_at(1, 8), _at(1, 17), HOME)]) == {}
+    assert _analyze([]) == {}
@@ -0,0 +1,45 @@
+import datetime as dt
+
+import httpbackend
+
+EDIT_PAGE = '''<html><body><form action="editwh3.php" method="post">
+<font><b>regular day</b></font>
+<input type="hidden" name="e" value="1234"><input type="hidden" name="d" value="2020-7-31">
+<input type="hidden" name="jd" value="2020-8-1">
+<input type="text" id="ehh0" name="ehh0" value="8"><input type="text" id="emm0" name="emm0" value="30">
+<input type="text" id="xhh0" name="xhh0" value="17"><input type="text" id="xmm0" name="xmm0" value="15">
+<select name="excuse"><option value="0"></option><option value="5" selected>home</option></select>
+{extra}
+<input type="image" src="/images/update.jpg" name="update">
+</form></body></html>'''
+
+
+def _form(extra=''):
+    page = httpbackend.PageParser()
+    page.feed(EDIT_PAGE.format(extra=extra))
+    page.close()
+    form = page.form_with_input('ehh0')
+    form.date = dt.datetime(2020, 7, 31)
+    return form
+
+
+def test_url_date_after_the_last_day_of_a_month():
+    assert httpbackend._url_date(dt.datetime(2020, 7, 31), 1) == '2020-8-1'
+    assert httpbackend._url_date(dt.datetime(2020, 12, 31), 1) == '2021-1-1'
+    assert httpbackend._url_date(dt.datetime(2020, 2, 28), 1) == '2020-2-29'
+
+
+def test_form_for_another_date_carries_no_values_of_its_date():
+    form = _form()
+    assert form.rebuildable()
+    other = form.for_date(dt.datetime(2020, 7, 5))
+    assert other.fields['d'] == '2020-7-5' and other.fields['jd'] == '2020-7-6' and other.fields['e'] == '1234'
+    assert [other.value(i) for i in ('ehh0', 'emm0', 'xhh0', 'xmm0')] == ['', '', '', '']
+    assert other.fields['excuse'] == '0'
+    # the loaded form keeps its own values
+    assert form.value('ehh0') == '8' and form.fields['excuse'] == '5'
+
+
+def test_form_with_other_values_is_not_rebuilt():
+    assert not _form('<input type="text" name="remark" value="doctor">').rebuildable()
+    assert not _form('<textarea name="remark">doctor</textarea>').rebuildable()
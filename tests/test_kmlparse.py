@@ -0,0 +1,54 @@
+import datetime as dt
+
+import kmlparse
+
+KML = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Placemark><name>Office</name><Point><coordinates>34.8,32.1,0</coordinates></Point>
+<TimeSpan><begin>2020-07-01T05:00:00.000Z</begin><end>2020-07-01T09:00:00.000Z</end></TimeSpan></Placemark>
+<Placemark><name>Driving</name><LineString><coordinates>34.0,32.0,0 34.1,32.0,0 34.2,32.0,0 34.3,32.0,0</coordinates>
+</LineString><TimeSpan><begin>2020-07-01T09:00:00Z</begin><end>2020-07-01T10:00:00+00:00</end></TimeSpan></Placemark>
+<Placemark><name>No time</name><Point><coordinates>34.8,32.1,0</coordinates></Point></Placemark>
+</Document></kml>
+'''.encode('utf-8')
+
+
+def _utc(hour, minute=0, day=1):
+    return dt.datetime(2020, 7, day, hour, minute, tzinfo=dt.timezone.utc)
+
+
+def test_point_placemark():
+    first = next(kmlparse.iter_placemarks(KML))
+    assert first == kmlparse.Placemark(begin=_utc(5), end=_utc(9), lon=34.8, lat=32.1)
+
+
+def test_line_string_is_split_in_equal_time_shares():
+    track = list(kmlparse.iter_placemarks(KML))[1:]
+    assert [(p.begin, p.end) for p in track] == [(_utc(9), _utc(9, 15)), (_utc(9, 15), _utc(9, 30)),
+                                                 (_utc(9, 30), _utc(9, 45)), (_utc(9, 45), _utc(10))]
+    assert [p.lon for p in track] == [34.0, 34.1, 34.2, 34.3]
+
+
+def test_placemark_without_time_is_skipped():
+    assert len(list(kmlparse.iter_placemarks(KML))) == 5
+
+
+def test_dump_round_trip():
+    placemarks = list(kmlparse.iter_placemarks(KML))
+    assert list(kmlparse.iter_placemarks(kmlparse.dump_placemarks(placemarks))) == placemarks
+
+
+def test_split_days_puts_a_record_crossing_midnight_in_both_days():
+    local = dt.datetime(2020, 7, 1, 23).astimezone()
+    crossing = kmlparse.Placemark(begin=local, end=local + dt.timedelta(hours=2), lon=34.0, lat=32.0)
+    until_midnight = kmlparse.Placemark(begin=local, end=local + dt.timedelta(hours=1), lon=34.0, lat=32.0)
+    days = kmlparse.split_days([crossing, until_midnight], dt.date(2020, 7, 1), dt.date(2020, 7, 3))
+    assert days == {dt.date(2020, 7, 1): [crossing, until_midnight], dt.date(2020, 7, 2): [crossing]}
+    assert kmlparse.split_days([crossing], dt.date(2020, 7, 2), dt.date(2020, 7, 2)) == \
+        {dt.date(2020, 7, 2): [crossing]}
+
+
+def test_parse_time_formats():
+    assert kmlparse.parse_time('2020-07-01T05:12:33.123Z') == _utc(5, 12).replace(second=33, microsecond=123000)
+    assert kmlparse.parse_time('2020-07-01T08:00:00+03:00') == _utc(5)
+    assert kmlparse.format_time(_utc(5)) == '2020-07-01T05:00:00.000Z'
@@ -0,0 +1,157 @@
+import datetime as dt
+import os
+
+import numpy as np
+import pytest
+
+import ledger
+
+P_HASH = 1234
+
+
+@pytest.fixture
+def book(tmp_path):
+    book = ledger.Ledger(str(tmp_path / 'ledger.bin'))
+    yield book
+    book.close()
+
+
+def _times(date, start, end):
+    midnight = dt.datetime(date.year, date.month, date.day)
+    return {'start': midnight + dt.timedelta(minutes=start), 'end': midnight + dt.timedelta(minutes=end)}
+
+
+def _size(days):
+    return ledger._HEADER.itemsize + days * ledger._RECORD.itemsize
+
+
+def test_record_is_17_bytes():
+    assert ledger._RECORD.itemsize == 17
+
+
+def test_grows_by_whole_years_and_keeps_records(tmp_path, book):
+    file_name = str(tmp_path / 'ledger.bin')
+    july = dt.datetime(2020, 7, 1)
+    book.record_decision(july, 'gps', 'gps', _times(july, 8 * 60, 17 * 60), P_HASH)
+    assert os.path.getsize(file_name) == _size(366)
+    assert book.get(july + dt.timedelta(days=1)) is None
+
+    # an earlier year moves the records, a later one appends
+    march = dt.datetime(2019, 3, 1)
+    book.record_decision(march, 'non_gps', 'spoofed', _times(march, 9 * 60, 18 * 60), P_HASH)
+    book.commit(dt.datetime(2021, 1, 5), 'holiday', 4)
+    assert os.path.getsize(file_name) == _size(365 + 366 + 365)
+    assert book._base == dt.date(2019, 1, 1).toordinal()
+
+    assert book.get(july)['start'] == '08:00' and book.get(july)['end'] == '17:00'
+    assert book.get(march)['mode'] == 'non_gps' and book.get(march)['source'] == 'spoofed'
+    assert book.get(dt.datetime(2021, 1, 5))['kind'] == 'holiday'
+    assert book.get(dt.datetime(2018, 1, 1)) is None
+    assert [r['date'] for r in book.range(dt.datetime(2018, 1, 1), dt.datetime(2022, 1, 1))] == \
+        [dt.date(2019, 3, 1), dt.date(2020, 7, 1), dt.date(2021, 1, 5)]
+
+
+def test_records_written_while_another_ledger_grows_the_file(tmp_path, book):
+    # as a standalone run next to the daemon - every ledger maps the file on its own
+    other = ledger.Ledger(str(tmp_path / 'ledger.bin'))
+    try:
+        july, march, august = dt.datetime(2020, 7, 1), dt.datetime(2019, 3, 1), dt.datetime(2020, 8, 1)
+        book.commit(july, 'gps', None)
+        # an earlier year - the other ledger rewrites the file under the first one
+        other.commit(march, 'holiday', 2)
+        book.commit(august, 'non_gps', 3)
+        assert book.get(march)['kind'] == 'holiday'
+        assert other.get(august)['kind'] == 'non_gps'
+    finally:
+        other.close()
+    book.close()
+    reopened = ledger.Ledger(str(tmp_path / 'ledger.bin'))
+    try:
+        assert [r['kind'] for r in reopened.range(march, august)] == ['holiday', 'gps', 'non_gps']
+    finally:
+        reopened.close()
+
+
+def test_records_survive_reopening(tmp_path, book):
+    date = dt.datetime(2020, 2, 29)
+    book.record_decision(date, 'gps', 'gps', _times(date, 7 * 60 + 5, 16 * 60 + 45), P_HASH)
+    book.commit(date, 'gps', None)
+    book.close()
+    reopened = ledger.Ledger(str(tmp_path / 'ledger.bin'))
+    try:
+        record = reopened.get(date)
+    finally:
+        reopened.close()
+    assert (record['kind'], record['excuse'], record['start'], record['end']) == ('gps', None, '07:05', '16:45')
+
+
+def test_stay_crossing_midnight_keeps_its_end(book):
+    date = dt.datetime(2020, 7, 1)
+    book.record_decision(date, 'gps', 'gps', _times(date, 22 * 60, 26 * 60 + 30), P_HASH)
+    book.commit(date, 'gps', None)
+    assert book.get(date)['end'] == '26:30'
+    decision = book.decision(date, P_HASH)
+    assert decision['work_day_times'] == {'start': dt.datetime(2020, 7, 1, 22), 'end': dt.datetime(2020, 7, 2, 2, 30)}
+    assert ledger.report_totals(book.range(date, date))['hours'] == 4.5
+
+
+def test_decision_is_reused_only_with_the_same_parameters(book):
+    date = dt.datetime(2020, 7, 1)
+    book.record_decision(date, 'gps', 'gps', _times(date, 8 * 60, 17 * 60), P_HASH)
+    assert book.decision(date, P_HASH)['mode'] == 'gps'
+    assert book.decision(date, P_HASH + 1) is None
+    assert book.decision(date + dt.timedelta(days=1), P_HASH) is None
+
+
+def test_decision_ending_before_its_start_is_decided_again(book):
+    date = dt.datetime(2020, 7, 1)
+    book.record_decision(date, 'gps', 'gps', _times(date, 17 * 60, 8 * 60), P_HASH)
+    assert book.decision(date, P_HASH) is None
+    book.commit(date, 'gps', None)
+    assert ledger.report_totals(book.range(date, date))['hours'] == 0
+
+
+@pytest.mark.parametrize('excuse', [0, 1, 127, 128, 255, 9999])
+def test_excuse_indexes(book, excuse):
+    date = dt.datetime(2020, 7, 1)
+    book.commit(date, 'non_gps', excuse)
+    assert book.get(date)['excuse'] == excuse
+
+
+def test_excuse_out_of_range_is_rejected(book):
+    with pytest.raises(ValueError):
+        book.commit(dt.datetime(2020, 7, 1), 'non_gps', ledger.NO_EXCUSE)
+    with pytest.raises(ValueError):
+        book.commit(dt.datetime(2020, 7, 1), 'non_gps', -1)
+
+
+def test_first_version_file_is_converted(tmp_path):
+    file_name = str(tmp_path / 'ledger.bin')
+    base = dt.date(2020, 1, 1).toordinal()
+    header = np.zeros(1, dtype=ledger._HEADER)
+    header['magic'] = ledger._MAGIC_V1
+    header['base'] = base
+    records = np.zeros(366, dtype=ledger._RECORD_V1)
+    records['start'] = records['end'] = ledger.NO_TIME
+    # 1 July: night shift 22:00 to 02:30, no excuse - 2 July: 08:00 to 17:00, excuse 5
+    for i, (start, end, excuse) in zip((182, 183), ((22 * 60, 2 * 60 + 30, -1), (8 * 60, 17 * 60, 5))):
+        records[i] = (ledger.MODES.index('gps'), ledger.KINDS.index('gps'), ledger.SOURCES.index('gps'), excuse,
+                      start, end, P_HASH, 1)
+    with open(file_name, 'wb') as f:
+        f.write(header.tobytes() + records.tobytes())
+
+    book = ledger.Ledger(file_name)
+    try:
+        first, second = book.get(dt.datetime(2020, 7, 1)), book.get(dt.datetime(2020, 7, 2))
+    finally:
+        book.close()
+    assert (first['end'], first['excuse']) == ('26:30', None)
+    assert (second['start'], second['end'], second['excuse']) == ('08:00', '17:00', 5)
+    assert os.path.getsize(file_name) == _size(366)
+
+
+def test_not_a_ledger_file(tmp_path):
+    file_name = tmp_path / 'ledger.bin'
+    file_name.write_bytes(b'not a ledger at all')
+    with pytest.raises(ValueError):
+        ledger.Ledger(str(file_name))
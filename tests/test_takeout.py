@@ -0,0 +1,66 @@
+import datetime as dt
+import io
+import json
+
+import pytest
+
+import takeout
+
+DOCUMENT = '{"other": [9, [9]], "locations"' + ' ' * 50 + ': [{"a": 1}, {"a": [2, "]"]}, {"a": 3}]}'
+
+
+@pytest.mark.parametrize('chunk_size', list(range(1, 20)) + [64, 1 << 20])
+def test_streamed_items_whatever_the_chunk_size(chunk_size):
+    items = list(takeout.iter_json_array(io.StringIO(DOCUMENT), 'locations', chunk_size=chunk_size))
+    assert items == [{'a': 1}, {'a': [2, ']']}, {'a': 3}]
+
+
+def test_array_bracket_after_the_key_in_a_later_chunk():
+    # the key ends the first chunk - the '[' of the earlier member must not be taken for the array
+    document = '{"o": [1], "locations"' + ' ' * 100 + ': [{"a": 1}]}'
+    chunk_size = document.index('"locations"') + len('"locations"')
+    assert list(takeout.iter_json_array(io.StringIO(document), 'locations', chunk_size=chunk_size)) == [{'a': 1}]
+
+
+def test_empty_and_missing_arrays():
+    assert list(takeout.iter_json_array(io.StringIO('{"locations": []}'), 'locations', chunk_size=4)) == []
+    assert list(takeout.iter_json_array(io.StringIO('{"other": [1]}'), 'locations', chunk_size=4)) == []
+
+
+def test_truncated_array_is_an_error():
+    with pytest.raises(ValueError):
+        list(takeout.iter_json_array(io.StringIO('{"locations": [{"a": 1}, {"a"'), 'locations', chunk_size=8))
+
+
+@pytest.mark.parametrize('chunk_size', [8, 1 << 20])
+def test_malformed_item_is_an_error_before_the_end_of_the_file(chunk_size):
+    document = '{"locations": [{"a": 1}, {"a" 2}, ' + ', '.join(['{"a": 1}'] * 200000) + ']}'
+    f = io.StringIO(document)
+    items = takeout.iter_json_array(f, 'locations', chunk_size=chunk_size)
+    assert next(items) == {'a': 1}
+    with pytest.raises(ValueError, match='malformed'):
+        next(items)
+    assert f.tell() < len(document)
+
+
+def test_oversized_item_is_an_error():
+    document = '{"locations": ["' + 'x' * (3 << 20) + '"]}'
+    with pytest.raises(ValueError, match='longer than'):
+        list(takeout.iter_json_array(io.StringIO(document), 'locations', chunk_size=1 << 16))
+
+
+def test_import_records_into_days(tmp_path):
+    def sample(day, hour, lat):
+        t = dt.datetime(2020, 7, day, hour).astimezone()
+        return {'timestampMs': str(int(t.timestamp()) * 1000), 'latitudeE7': int(lat * 1e7),
+                'longitudeE7': 348000000}
+
+    records = tmp_path / 'Records.json'
+    records.write_text(json.dumps({'locations': [sample(2, 9, 32.1), sample(1, 8, 32.0), sample(1, 17, 32.0),
+                                                 {'timestampMs': 'bad'}]}))
+    store = takeout.import_takeout([str(records)], store_dir=str(tmp_path / 'store'))
+    assert (store.first_date, store.last_date) == (dt.date(2020, 7, 1), dt.date(2020, 7, 2))
+    assert store.covers(dt.datetime(2020, 7, 2)) and not store.covers(dt.datetime(2020, 7, 3))
+    first_day = store.placemarks(dt.datetime(2020, 7, 1))
+    assert [p.begin.astimezone().hour for p in first_day] == [8, 17]
+    assert [round(p.lat, 4) for p in store.placemarks(dt.datetime(2020, 7, 2))] == [32.1]
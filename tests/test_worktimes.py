@@ -0,0 +1,95 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+import worktimes
+
+MASK = (1 << 64) - 1
+
+
+def _splitmix64(seed, ordinal, stream):
+    """reference splitmix64 of (seed, date, stream) in plain python integers"""
+    x = (ordinal * 0x9E3779B97F4A7C15 + seed + (stream * worktimes._STREAM_STEP & MASK)) & MASK
+    x ^= x >> 30
+    x = x * 0xBF58476D1CE4E5B9 & MASK
+    x ^= x >> 27
+    x = x * 0x94D049BB133111EB & MASK
+    x ^= x >> 31
+    return (x >> 11) * 2.0 ** -53
+
+
+def _sampler(distribution='uniform', seed=7, **kwargs):
+    settings = dict(minimal_start=7 * 60, maximal_end=20 * 60, nominal_length=9 * 60, max_length=10 * 60,
+                    start_window=180, distribution=distribution, seed=seed)
+    settings.update(kwargs)
+    return worktimes.WorkTimeSampler(**settings)
+
+
+def _dates(count, first=dt.datetime(2020, 1, 1)):
+    return [first + dt.timedelta(days=i) for i in range(count)]
+
+
+@pytest.mark.parametrize('seed', [0, 7, MASK])
+def test_uniform_matches_splitmix64(seed):
+    ordinals = [dt.date(2020, 1, 1).toordinal() + i for i in range(50)]
+    values = worktimes._uniform(seed, np.array(ordinals, dtype=np.uint64), worktimes._STREAM_LENGTH)
+    assert values.tolist() == [_splitmix64(seed, o, worktimes._STREAM_LENGTH) for o in ordinals]
+
+
+def test_uniform_range_and_mean():
+    values = worktimes._uniform(3, np.arange(700000, 720000, dtype=np.uint64), worktimes._STREAM_START)
+    assert values.min() >= 0.0 and values.max() < 1.0
+    assert abs(values.mean() - 0.5) < 0.01
+
+
+def test_streams_are_independent():
+    ordinals = np.arange(737000, 737100, dtype=np.uint64)
+    assert not np.array_equal(worktimes._uniform(3, ordinals, worktimes._STREAM_START),
+                              worktimes._uniform(3, ordinals, worktimes._STREAM_LENGTH))
+
+
+def test_date_times_do_not_depend_on_the_range():
+    dates = _dates(60)
+    start, end = _sampler().sample(dates)
+    single_start, single_end = _sampler().sample([dates[30]])
+    assert (start[30], end[30]) == (single_start[0], single_end[0])
+    assert _sampler().times_of(dates[30]) == _sampler().times_of(dates[30])
+
+
+def test_seed_changes_the_times():
+    dates = _dates(30)
+    assert not np.array_equal(_sampler(seed=1).sample(dates)[0], _sampler(seed=2).sample(dates)[0])
+
+
+@pytest.mark.parametrize('distribution', worktimes.DISTRIBUTIONS)
+def test_times_stay_in_the_feasible_window(distribution):
+    start, end = _sampler(distribution).sample(_dates(5000))
+    length = end - start
+    assert start.min() >= 7 * 60 and start.max() < 10 * 60
+    assert end.max() <= 20 * 60
+    assert length.min() >= 8 * 60 and length.max() <= 10 * 60
+
+
+def test_late_starts_leave_room_for_the_shortest_day():
+    start, end = _sampler(minimal_start=11 * 60, start_window=300).sample(_dates(2000))
+    assert start.max() <= 12 * 60
+    assert end.max() <= 20 * 60
+    assert (end - start).min() >= 8 * 60
+
+
+def test_short_nominal_day_never_ends_before_its_start():
+    start, end = _sampler(nominal_length=30, max_length=60).sample(_dates(2000))
+    assert (end - start).min() >= 0
+    assert (end - start).max() <= 60
+    with pytest.raises(worktimes.InfeasibleWorkDay):
+        _sampler(nominal_length=-90)
+
+
+def test_infeasible_work_day_is_rejected():
+    with pytest.raises(worktimes.InfeasibleWorkDay):
+        _sampler(minimal_start=13 * 60)
+    with pytest.raises(worktimes.InfeasibleWorkDay):
+        _sampler(max_length=7 * 60)
+    with pytest.raises(ValueError):
+        _sampler(distribution='normal')
@@ -3,6 +3,8 @@ import os
 import datetime as dt
 import platform
 
+import twlog
+
 
 class TWArgs:
 
@@ -19,6 +21,62 @@ class TWArgs:
                                  dest='parameters_file',
                                  default=os.path.join(os.path.dirname(__file__), 'params', 'params.json'),
                                  help='full path to local parameters file')
+        self.parser.add_argument('--backend', dest='backend', choices=['selenium', 'http'], default='selenium',
+                                 help='fill timewatch through a chrome browser (selenium) or directly over http')
+        self.parser.add_argument('--timewatch-url', dest='timewatch_url',
+                                 default=r'https://checkin.timewatch.co.il/punch/punch.php',
+                                 help='timewatch login page url')
+        self.parser.add_argument('--batch-month', dest='batch_month', action='store_true',
+                                 help='read the holidays of a whole month from the month overview page at once')
+        self.parser.add_argument('--reconcile', dest='reconcile', action='store_true',
+                                 help='only write dates whose current values differ, and skip dates already '
+                                      'committed by a previous (i.e. interrupted) run')
+        self.parser.add_argument('--plan', dest='plan', action='store_true',
+                                 help='only print what would be written for each date - no browser, no timewatch')
+        self.parser.add_argument('--plan-output', dest='plan_output',
+                                 help='with --plan or --report, also export the table to this file (.csv or .json)')
+        self.parser.add_argument('--report', dest='report', action='store_true',
+                                 help='only print what the ledger holds for each date - no browser, no timewatch')
+        self.parser.add_argument('--seed', dest='seed', type=int,
+                                 help='seed of the randomized work times - the same seed gives the same times')
+        self.parser.add_argument('--metrics-dir', dest='metrics_dir',
+                                 help='record per stage timings and write twu-metrics.json and twu.prom '
+                                      '(prometheus text format) into this directory at the end of the run')
+        self.parser.add_argument('--roster', dest='roster',
+                                 help='roster file listing the parameters files of many workers - '
+                                      'the range is filled for all of them on a pool of processes')
+        self.parser.add_argument('--processes', dest='processes', type=int, default=os.cpu_count() or 1,
+                                 help='with --roster, maximal number of workers processed at the same time')
+        self.parser.add_argument('--per-tenant', dest='per_tenant', type=int, default=2,
+                                 help='with --roster, maximal number of workers of the same company processed '
+                                      'at the same time')
+        self.parser.add_argument('--record', dest='record', metavar='ARCHIVE',
+                                 help='fill the range over http and record every page and timeline of the run '
+                                      'into this archive, for --replay')
+        self.parser.add_argument('--replay', dest='replay', metavar='ARCHIVE',
+                                 help='run a recorded archive again offline - no network, no browser - and compare '
+                                      'its wall time and round-trips with the recorded run')
+        self.parser.add_argument('--daemon', dest='daemon', action='store_true',
+                                 help='keep running: fill the new dates on the daemon.schedule times through a session '
+                                      'kept open, and accept requests on a local control socket')
+        self.parser.add_argument('--daemon-request', dest='daemon_request',
+                                 choices=['run', 'catch_up', 'status', 'stop'],
+                                 help='send a request to the running daemon of the parameters file worker - '
+                                      'run fills the --start-date to --end-date range')
+        self.parser.add_argument('--import-takeout', dest='import_takeout', nargs='+', metavar='PATH',
+                                 help='import a google takeout location history export (Records.json, '
+                                      'Semantic Location History files or folders) into the local takeout store')
+        self.parser.add_argument('--lookahead', dest='lookahead', type=int, default=3,
+                                 help='number of dates whose kml is fetched and parsed ahead of the browser '
+                                      '(0 processes dates strictly one after the other)')
+        self.parser.add_argument('--log-level', dest='log_level', default='DEBUG',
+                                 choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                                 help='level of the modules not listed in --log-levels')
+        self.parser.add_argument('--log-levels', dest='log_levels', type=twlog.parse_levels, default={},
+                                 metavar='MODULE=LEVEL,...',
+                                 help='level of single modules, i.e. downloads=INFO,web=WARNING')
+        self.parser.add_argument('--log-json', dest='log_json', metavar='FILE',
+                                 help='also write every log record as a JSON line to this file')
 
     def parse_args(self, argv):
         args_output = self.parser.parse_args(args=argv[1::])
@@ -26,6 +84,16 @@ class TWArgs:
         if args_output.start_date and args_output.end_date:
             if args_output.start_date > args_output.end_date:
                 raise ValueError('start date is after end date')
+        if args_output.lookahead < 0:
+            raise ValueError('lookahead must not be negative')
+        if args_output.processes < 1 or args_output.per_tenant < 1:
+            raise ValueError('processes and per-tenant must be at least 1')
+        if args_output.roster and not (args_output.start_date and args_output.end_date):
+            raise ValueError('roster requires start and end dates')
+        if args_output.record and not (args_output.start_date and args_output.end_date):
+            raise ValueError('record requires start and end dates')
+        if args_output.daemon_request == 'run' and not args_output.start_date:
+            raise ValueError('a run request requires a start date')
 
         return args_output
 
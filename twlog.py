@@ -1,14 +1,204 @@
+"""
+This module sets up the logging of the tool.
+
+Every module gets its own logger (``twu.<module>``) from :class:`TimeWatchLogger`. The loggers put their records
+on one shared queue, and a single background thread formats them and writes them to the console - and to a JSON
+lines file when one is configured. A log call on the per date path only costs putting a record on the queue, and
+a filtered out call (see :func:`configure` for the per module levels) costs a level check.
+
+Messages are formatted on the logging thread: pass values as arguments (``'%s'``), not as preformatted strings,
+and wrap arguments that are costly to turn into text with :class:`Lazy` (or :func:`day` for dates).
+"""
+
+import atexit
+import datetime as dt
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+ROOT = 'twu'
+FORMAT = '%(levelname)8s - %(asctime)s - %(module)s - %(message)s'
+
+_lock = threading.RLock()
+_queue = queue.SimpleQueue()
+_listener = None
+_default_level = logging.DEBUG
+_levels = {}
+_json_file = None
 
 
 class TimeWatchLogger(logging.Logger):
     """
-    Subclass for the logger - predefined
+    Logger of the calling module - ``TimeWatchLogger()`` returns the logger ``twu.<module>``, shared by every
+    call from the same module. Its level is the one configured for the module (see :func:`configure`).
+    """
+
+    def __new__(cls, log_level=None, name=None):
+        """
+        :param int log_level: level of this module's logger - the configured level if not given
+        :param str name: module name - the calling module if not given
+        """
+        name = name if name is not None else sys._getframe(1).f_globals.get('__name__', ROOT)
+        with _lock:
+            _root()
+            logger = logging.getLogger('{}.{}'.format(ROOT, name))
+            if log_level is not None:
+                _levels.setdefault(name, log_level)
+            logger.setLevel(_levels.get(name, _default_level))
+        return logger
+
+
+class Lazy:
+    """
+    Log argument whose text is computed only when (and where) the record is written, i.e. ``Lazy(json.dumps, v)``.
+    """
+
+    __slots__ = ('_func', '_args')
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+    def __str__(self):
+        return str(self._func(*self._args))
+
+
+def day(date):
+    """
+    :param datetime date: a date
+    :return Lazy: the date as ``YYYY-MM-DD``, formatted when the record is written
+    """
+    return Lazy(date.strftime, '%Y-%m-%d')
+
+
+def configure(level=None, levels=None, json_file=None):
+    """
+    Set the log levels and sinks, once, at start - loggers already created follow.
+
+    :param level: level of the modules without their own level (name or number) - DEBUG if not given
+    :param dict levels: module name -> level, i.e. ``{'downloads': 'INFO', 'web': 'WARNING'}``
+    :param str json_file: also write every record as a JSON line to this file
+    """
+    global _default_level, _levels, _json_file
+    with _lock:
+        _default_level = logging.DEBUG if level is None else _level(level)
+        _levels = {name: _level(v) for name, v in (levels or {}).items()}
+        _json_file = json_file
+        prefix = ROOT + '.'
+        for name, logger in list(logging.Logger.manager.loggerDict.items()):
+            if name.startswith(prefix) and isinstance(logger, logging.Logger):
+                logger.setLevel(_levels.get(name[len(prefix):], _default_level))
+        _restart_listener()
+
+
+def parse_levels(text):
+    """
+    :param str text: comma separated ``module=LEVEL`` pairs, i.e. ``downloads=INFO,web=WARNING``
+    :return dict: module name -> level name
+    :raises ValueError: if a pair or a level is not valid
+    """
+    levels = {}
+    for pair in filter(None, (p.strip() for p in text.split(','))):
+        name, sep, value = pair.partition('=')
+        if not sep or not name.strip():
+            raise ValueError('expected module=LEVEL, got {}'.format(pair))
+        levels[name.strip()] = _level(value.strip())
+    return levels
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
     """
-    def __init__(self, log_level=logging.DEBUG):
-        super().__init__(name='time_watch_logger')
-        self.handlers = []
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(log_level)
-        console_handler.setFormatter(logging.Formatter('%(levelname)8s - %(asctime)s - %(module)s - %(message)s'))
-        self.addHandler(console_handler)
+    Puts the records on the queue as they are - message and arguments are merged on the logging thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, module, logger, message and exception.
+    """
+
+    def format(self, record):
+        entry = {'time': dt.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'module': record.module, 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError('unknown log level {}'.format(value))
+    return level
+
+
+def _root():
+    """the parent of all the module loggers - its only handler is the queue"""
+    root = logging.getLogger(ROOT)
+    if not root.handlers:
+        root.propagate = False
+        root.setLevel(logging.NOTSET)
+        root.addHandler(_QueueHandler(_queue))
+        _restart_listener()
+        atexit.register(_stop_listener)
+    return root
+
+
+def _sinks():
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(FORMAT))
+    sinks = [console]
+    if _json_file:
+        json_sink = logging.FileHandler(_json_file, encoding='utf-8')
+        json_sink.setFormatter(JsonFormatter())
+        sinks.append(json_sink)
+    return sinks
+
+
+def _restart_listener():
+    """the records queued before are written by the old sinks - the listener stops once it reached them"""
+    global _listener
+    _stop_listener()
+    _listener = logging.handlers.QueueListener(_queue, *_sinks())
+    _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+        if listener is not None:
+            listener.stop()
+            for sink in listener.handlers:
+                sink.close()
+
+
+def _after_fork():
+    """a forked child (i.e. a roster worker) has no logging thread - it gets its own queue and thread"""
+    global _lock, _queue, _listener
+    # another thread may have held the lock at the time of the fork
+    _lock = threading.RLock()
+    _queue = queue.SimpleQueue()
+    _listener = None
+    root = logging.getLogger(ROOT)
+    for handler in root.handlers:
+        handler.queue = _queue
+    if root.handlers:
+        _restart_listener()
+        # multiprocessing children end with os._exit - atexit is not run, its finalizers are
+        import multiprocessing.util
+        multiprocessing.util.Finalize(None, _stop_listener, exitpriority=0)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
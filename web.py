@@ -2,71 +2,282 @@
 This module deals with all the webpage aspects of the reporting.
 Login, filling in the correct boxes, saving, etc.
 """
-from selenium import webdriver
-from selenium.webdriver.support.ui import Select
 import re
-import json
 import platform
 import os
+from urllib.parse import urljoin
 
 import twlog
 import work
+import monthview
+import journal
+import sessionstore
+import config
+import metrics
+import editpage
+import supervisor
+import pacing
 
 import datetime as dt
 
 logger = twlog.TimeWatchLogger()
 
+# seconds a page load may take before it fails (and is retried)
+PAGE_LOAD_TIMEOUT = 60
+
+_TOKEN_LINK = re.compile(r'editwh\.php\?[^"\'>]*?ee=(\d+)&(?:amp;)?e')
+
 
 class Timewatch:
 
     def __init__(self, chrome_driver_path=os.path.join(os.path.dirname(__file__), 'executables', 'chromedriver'),
                  params_file=os.path.join(os.path.dirname(__file__), 'params', 'params.json'),
-                 url=r'https://checkin.timewatch.co.il/punch/punch.php'):
-
-        with open(params_file, 'r') as f:
-            params = json.loads(f.read())
+                 url=r'https://checkin.timewatch.co.il/punch/punch.php',
+                 batch_month=False, reconcile=False, planner=None, params=None):
 
-        self.params = params
+        self.config = config.load(params_file) if params is None else config.as_config(params)
+        self._token = self.config.token
+        self._own_planner = planner is None
+        self.planner = planner if planner is not None else work.WorkPlanner(self.config)
         self._url = url
+        self._batch_month = batch_month
+        self._month_tables = {}
+        self._current_date = None
+        self._reconcile = reconcile
+        self._excuse_texts = None
+        self._journal = journal.Journal.from_params(self.config.params)
+        self._session_store = sessionstore.SessionStore.from_params(self.config.params)
+        self._restored = False
+        self._edit_page = None
+        self._start_session(chrome_driver_path)
+
+    def set_config(self, conf: config.Config) -> None:
+        """
+        Use a new configuration (i.e. a reloaded parameters file) for the following dates.
+        The session keeps the credentials it logged in with.
 
+        :param config.Config conf: new configuration
+        """
+        self.config = conf
+
+    def _start_session(self, chrome_driver_path: str) -> None:
+        # selenium is heavy - imported only when a browser session is actually started
+        from selenium import webdriver
         if platform.system() == 'Windows':
             self._driver = webdriver.Chrome(chrome_driver_path + '.exe')
         elif platform.system() == 'Linux':
             self._driver = webdriver.Chrome(chrome_driver_path)
+        # chromedriver and the chrome it started are reaped as one tree when the session ends
+        self._browser = supervisor.supervisor().adopt(self._driver.service.process, name='timewatch browser')
+        self._driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+
+    def _close_session(self) -> None:
+        try:
+            # quit (unlike close) also ends chromedriver
+            self._driver.quit()
+        finally:
+            supervisor.supervisor().stop(self._browser)
+
+    def _session_cookies(self) -> list:
+        return [{'name': c['name'], 'value': c['value'], 'domain': c.get('domain'), 'path': c.get('path', '/'),
+                 'expires': c.get('expiry'), 'secure': c.get('secure', False)} for c in self._driver.get_cookies()]
+
+    def _restore_cookies(self, cookies: list) -> None:
+        # cookies can only be added to the domain of the current page
+        self._open_url(self._url)
+        self._driver.delete_all_cookies()
+        for c in cookies:
+            cookie = {'name': c['name'], 'value': c['value'], 'path': c['path'], 'secure': c['secure']}
+            if c.get('expires'):
+                cookie['expiry'] = int(c['expires'])
+            self._driver.add_cookie(cookie)
 
-    def update_date(self, date: dt.datetime)-> None:
+    def update_date(self, date: dt.datetime, work_date: work.WorkDate = None) -> None:
         """
         Updates current date
         :param datetime date: This is the current date which is an instance of the datetime.datetime.date class
+        :param WorkDate work_date: already queried work date for `date` (i.e. prefetched by the pipeline).
+            If not provided, the date is queried here.
         :return: Nothing
         """
-        work_location = self.params['work']['location'] if 'location' in self.params['work'] else None
-        download_dir = self.params['download_dir'] if 'download_dir' in self.params else None
-        wd = work.WorkDate(date=date,
-                           download_dir=download_dir,
-                           work_location=work_location)
-        work_day_times = wd.query_work_date(work_day=self.params['work']['work_day'], weekend=self.params['work']['weekend'])
-        if not wd.mode == 'weekend':
-            self._driver.get(self._generate_specific_date_url(edit_date=date))
-            if self.is_holiday():
-                self._clear_all_hours()
-                self._set_excuse_value(int(self.params['holiday']['holiday_index']))
-                logger.info('Set date as vacation')
-            elif self.is_holdiay_eve():
-                self._clear_all_hours()
-                self._set_excuse_value(int(self.params['holiday']['holiday_eve_index']))
-                logger.info('Set date as holiday eve')
-            elif wd.mode == 'non_gps':
-                self._clear_all_hours()
-                self._fill_hours(work_day_times)
-                self._set_excuse_value(self.params['home']['work_from_home_excuse_index'])
-            elif wd.mode == 'gps':
-                self._clear_all_hours()
-                self._fill_hours(work_day_times)
-            else:
-                raise RuntimeError(
-                    'date {} is neither holiday, nor eve nor work home nor office'.format(date.strftime('%d-%m-%Y')))
+        wd = work_date if work_date is not None else self.planner.query(date)
+        if wd.mode == 'weekend':
+            return
+        self._current_date = date
+        if self._batch_month or self._reconcile:
+            self.load_month(date)
+
+        page_loaded = False
+        if self._month_table(date) is None or (self._reconcile and self._excuse_texts is None):
+            with metrics.span('page_load', date):
+                self._authenticated(self._load_date_page, date)
+            page_loaded = True
+            if self._reconcile and self._excuse_texts is None:
+                self._excuse_texts = self._get_excuse_texts()
+
+        entry = self._plan_entry(wd)
+        if self._reconcile and self._is_journaled(wd, entry):
+            logger.info('Date %s already committed - skipped', twlog.Lazy(date.strftime, '%d-%m-%Y'))
+            metrics.count('dates_skipped')
+            return
+        if self._reconcile and self._is_up_to_date(wd, entry):
+            logger.info('Date %s is already correct - skipped', twlog.Lazy(date.strftime, '%d-%m-%Y'))
+            metrics.count('dates_skipped')
+            return
+        if not page_loaded:
+            with metrics.span('page_load', date):
+                self._authenticated(self._load_date_page, date)
+
+        self._clear_all_hours()
+        if entry['hours'] is not None:
+            self._fill_hours(entry['hours'])
+        if entry['excuse'] is not None:
+            self._set_excuse_value(entry['excuse'])
+        if entry['kind'] == 'holiday':
+            logger.info('Set date as vacation')
+        elif entry['kind'] == 'holiday_eve':
+            logger.info('Set date as holiday eve')
+        with metrics.span('submit', date):
             self._click_enter()
+        metrics.count('dates_submitted')
+        self._journal.commit(date, mode=entry['kind'], source=wd.source, excuse=entry['excuse'],
+                             start=entry['hours']['start'] if entry['hours'] else None,
+                             end=entry['hours']['end'] if entry['hours'] else None)
+        if self.planner.ledger is not None:
+            try:
+                self.planner.ledger.commit(date, kind=entry['kind'], excuse=entry['excuse'])
+            except Exception as ex:
+                # the date is submitted and journaled already - a missing ledger entry only affects reports
+                logger.error('Ledger entry of %s not written: %s', twlog.day(date), ex)
+
+    def _plan_entry(self, wd: work.WorkDate) -> dict:
+        """
+        Decide what is written for a (non weekend) date.
+
+        :param WorkDate wd: queried work date
+        :return dict: kind (holiday, holiday_eve, non_gps or gps),
+            hours (dict of start and end datetime objects, or None to leave hours empty)
+            and excuse (excuse index, or None to leave the excuse as is)
+        """
+        if self.is_holiday():
+            return {'kind': 'holiday', 'hours': None, 'excuse': self.config.holiday_index}
+        elif self.is_holdiay_eve():
+            return {'kind': 'holiday_eve', 'hours': None, 'excuse': self.config.holiday_eve_index}
+        elif wd.mode == 'non_gps':
+            return {'kind': 'non_gps', 'hours': wd.work_day_times,
+                    'excuse': self.config.work_from_home_excuse}
+        elif wd.mode == 'gps':
+            return {'kind': 'gps', 'hours': wd.work_day_times, 'excuse': None}
+        else:
+            raise RuntimeError(
+                'date {} is neither holiday, nor eve nor work home nor office'.format(wd.date.strftime('%d-%m-%Y')))
+
+    def _is_journaled(self, wd: work.WorkDate, entry: dict) -> bool:
+        """
+        Compare the last commit of a date in the journal with what would be written - a date committed with
+        other parameters (i.e. another work from home excuse) is written again.
+        Spoofed times are random by design - any committed start and end are accepted for them.
+
+        :param WorkDate wd: queried work date
+        :param dict entry: planned entry, see :meth:`_plan_entry`
+        :return bool: True if the same entry was committed already
+        """
+        committed = self._journal.get(wd.date)
+        if committed is None or committed.get('mode') != entry['kind'] or committed.get('excuse') != entry['excuse']:
+            return False
+        if entry['hours'] is None:
+            return committed.get('start') is None and committed.get('end') is None
+        if committed.get('start') is None or committed.get('end') is None:
+            return False
+        if wd.source == 'spoofed':
+            return True
+        # entries read back from the file hold the times as text
+        return (str(committed['start']) == str(entry['hours']['start'])
+                and str(committed['end']) == str(entry['hours']['end']))
+
+    def _is_up_to_date(self, wd: work.WorkDate, entry: dict) -> bool:
+        """
+        Compare what TimeWatch already holds for a date (month overview) with what would be written.
+        Spoofed times are random by design - any filled start and end are accepted for them.
+
+        :param WorkDate wd: queried work date
+        :param dict entry: planned entry, see :meth:`_plan_entry`
+        :return bool: True if nothing needs to be written
+        """
+        table = self._month_table(wd.date)
+        if table is None:
+            return False
+        row = table[wd.date]
+        if entry['excuse'] is not None:
+            try:
+                if row.excuse != self._excuse_texts[entry['excuse']].strip():
+                    return False
+            except IndexError:
+                return False
+        elif row.excuse:
+            # no excuse is written - one left from an earlier submit is not what was planned
+            return False
+        if entry['hours'] is None:
+            return not row.start and not row.end
+        if not row.start or not row.end:
+            return False
+        if wd.source == 'spoofed':
+            return True
+        return (_hour_minute(row.start) == (entry['hours']['start'].hour, entry['hours']['start'].minute)
+                and _hour_minute(row.end) == (entry['hours']['end'].hour, entry['hours']['end'].minute))
+
+    def load_month(self, date: dt.datetime) -> monthview.MonthTable:
+        """
+        Load and parse the month overview page of `date` - once per month.
+        Holiday checks of all the dates of that month are then done against the parsed table.
+
+        :param datetime date: any date in the month
+        :return MonthTable: parsed month overview
+        """
+        key = (date.year, date.month)
+        if key not in self._month_tables:
+            logger.debug('loading month overview %d-%d', date.month, date.year)
+            with metrics.span('month_load'):
+                self._month_tables[key] = monthview.MonthTable(
+                    self._authenticated(lambda: self._get_page_source(self._generate_month_url(date))))
+        return self._month_tables[key]
+
+    def forget_months(self) -> None:
+        """
+        Drop the loaded month overviews - they are loaded again when needed.
+        """
+        self._month_tables = {}
+        self._excuse_texts = None
+
+    def _month_table(self, date: dt.datetime):
+        """
+        :return MonthTable: parsed month overview of `date` if it was loaded and lists `date`, otherwise None
+        """
+        table = self._month_tables.get((date.year, date.month)) if date is not None else None
+        return table if table is not None and date in table else None
+
+    def _open_url(self, url: str) -> None:
+        """
+        Load `url` in the browser through the scheduler (``timewatch`` endpoint) - again after a backoff
+        when the load fails or times out.
+        """
+        from selenium.common.exceptions import WebDriverException
+        pacing.scheduler().call('timewatch', lambda: self._driver.get(url), retry_on=(WebDriverException,))
+
+    def _get_page_source(self, url: str) -> str:
+        self._open_url(url)
+        source = self._driver.page_source
+        if _is_login_page(source):
+            raise sessionstore.SessionRejected(url)
+        return source
+
+    def _load_date_page(self, date: dt.datetime) -> None:
+        url = self._generate_specific_date_url(edit_date=date)
+        self._open_url(url)
+        # everything the date needs from the page, in one round-trip
+        self._edit_page = editpage.EditPage.read(self._driver)
+        if self._edit_page.login_page:
+            raise sessionstore.SessionRejected(url)
 
     def _fill_hours(self, work_day_times: dict) -> None:
         self._enter_value(element_id='ehh', value=work_day_times['start'].hour)
@@ -75,17 +286,17 @@ class Timewatch:
         self._enter_value(element_id='xmm', value=work_day_times['end'].minute)
 
     def _click_enter(self) -> None:
-        enter_possibles = [x for x in self._driver.find_elements_by_tag_name('input') if
-                           'update.jpg' in x.get_attribute('src')]
-        if len(enter_possibles) > 1:
+        if self._edit_page.update_buttons > 1:
             raise TooManyUpdateButtons('too many inputs with update.jpg image found')
-        enter_possibles[0].click()
+        self._edit_page.submit(self._driver)
+        self._edit_page = None
+
+    def _get_excuse_texts(self) -> list:
+        return self._edit_page.excuse_options
 
     def _set_excuse_value(self, excuse_index: int) -> None:
         if excuse_index:
-            element_options = Select(self._driver.find_element_by_name('excuse'))
-            element_options.select_by_index(excuse_index)
-            logger.debug('Set excuse %s', element_options.options[excuse_index].text)
+            self._edit_page.select_excuse(excuse_index)
 
     def is_holiday(self) -> bool:
         """
@@ -95,7 +306,7 @@ class Timewatch:
             True if the headline has the exact set of expected ascii characters,
             False otherwise
         """
-        return set(self._get_date_text_ascii()) == set([int(x) for x in self.params['holiday']['holiday_text']])
+        return set(self._headline_ascii()) == self.config.holiday_text
 
     def is_holdiay_eve(self) -> bool:
         """
@@ -105,31 +316,33 @@ class Timewatch:
              True if the headline has the exact set of expected ascii characters,
              False otherwise
          """
-        return set(self._get_date_text_ascii()) == set([int(x) for x in self.params['holiday']['holiday_eve_text']])
+        return set(self._headline_ascii()) == self.config.holiday_eve_text
+
+    def _headline_ascii(self) -> list:
+        """
+        Headline of the current date - from the month overview if loaded, otherwise from the edit page.
+        """
+        table = self._month_table(self._current_date)
+        if table is not None:
+            return table.headline_ascii(self._current_date)
+        return self._get_date_text_ascii()
 
     def _get_date_text_ascii(self) -> list:
-        element = self._driver.find_element_by_xpath(
-            '/html/body/div/span/form/table/tbody/tr[7]/td/table/tbody/tr/td[2]/font[2]/b')
-        return [ord(x) for x in getattr(element, 'text').strip()]
+        return [ord(x) for x in self._edit_page.headline.strip()]
 
     def _clear_all_hours(self) -> None:
-        element_list = ['ehh', 'xhh', 'emm', 'xmm']
-        row_number = [0, 1, 2, 3]
-        for row in row_number:
-            for e in element_list:
-                element = self._driver.find_elements_by_id('{}{}'.format(e, str(row)))
-                element[0].clear()
+        self._edit_page.clear_hours()
 
     def _enter_value(self, element_id: str, value: str) -> None:
         """
-        Enter values into specific place in webpage - specified by id
+        Enter values into specific place in webpage - specified by id.
+        Written to the page together with the other fields when the date is submitted.
 
         :param str id: id of the element into which value will be entered
         :param str value: hours/minute in 24H format to be entered to the element located using x_path parameter
         :return:
         """
-        element = self._driver.find_element_by_id('{}0'.format(element_id))
-        element.send_keys(value)
+        self._edit_page.type_value('{}0'.format(element_id), value)
 
     def _generate_specific_date_url(self, edit_date: dt.datetime) -> str:
         """
@@ -140,43 +353,101 @@ class Timewatch:
         :return str: url for direct edit form for edit_date
         """
         self._set_token()
-        base_url = 'http://checkin.timewatch.co.il/punch/editwh2.php?ie='
-        comp_num = str(self.params['user']['company']) + '&e=' + str(self.params['user']['token']) + '&d='
+        base_url = urljoin(self._url, 'editwh2.php') + '?ie='
+        comp_num = self.config.company + '&e=' + self._token + '&d='
+        next_date = edit_date + dt.timedelta(days=1)
         start_date = str(edit_date.year) + '-' + str(edit_date.month) + '-' + str(edit_date.day) + '&jd='
-        end_date = str(edit_date.year) + '-' + str(edit_date.month) + '-' + str(edit_date.day + 1) + '&tl=' \
-                   + str(self.params['user']['token'])
+        end_date = str(next_date.year) + '-' + str(next_date.month) + '-' + str(next_date.day) + '&tl=' \
+                   + self._token
         return base_url + comp_num + start_date + end_date
 
+    def _generate_month_url(self, date: dt.datetime) -> str:
+        """
+        generate url for the month overview page in the TimeWatch webpage.
+        requires session to be logged in
+
+        :param datetime date: any date in the required month
+        :return str: url of the month overview of `date`
+        """
+        self._set_token()
+        return urljoin(self._url, 'editwh.php') + '?ee={}&e={}&m={}&y={}'.format(
+            self._token, self.config.company, date.month, date.year)
+
     def _set_token(self) -> None:
         """
         checks if user token has already been processed. if so, does nothing.
-        if not, this function recovers user token from source of web page and puts it in this class user credential paramters.
+        if not, this function recovers user token from the links in the source of the web page
+        (one read of the page source) and keeps it for the session.
         :return: Nothing
 
         """
-        if 'token' in self.params['user'].keys():
+        if self._token is not None:
             logger.debug('user token already set')
         else:
             logger.debug('setting user token')
-
-            elems = [e.get_attribute('href') for e in self._driver.find_elements_by_xpath("//a[@href]")]
-            elems = [e for e in elems if 'editwh.php' in e]
-            try:
-                match = re.search(pattern=r'(?<=ee\=)\d*(?=\&e)', string=elems[0])
-            except IndexError:
-                raise IndexError('source of html page has no href with token')
-
-            if match:
-                self.params['user']['token'] = match[0]
-            else:
-                raise ValueError('did not extract token from %s', elems[0])
+            self._token = _token_from_page(self._driver.page_source)
 
     def __enter__(self):
-        self.login_into_time_watch()
+        with metrics.span('login'):
+            if not self._restore_session():
+                self.login_into_time_watch()
+                self._set_token()
+                self._save_session()
         return self
 
     def __exit__(self, *exception):
-        self._driver.close()
+        if self._own_planner:
+            self.planner.close()
+        try:
+            # the server may have renewed the cookies during the run
+            self._save_session()
+        finally:
+            self._close_session()
+
+    def _restore_session(self) -> bool:
+        """
+        Continue the session stored by a previous run, if there is a valid one.
+        It is only checked by the server with the first page load (see :meth:`_authenticated`).
+
+        :return bool: True if a session was restored
+        """
+        stored = self._session_store.load(self._url) if self._session_store is not None else None
+        if stored is None:
+            return False
+        self._restore_cookies(stored['cookies'])
+        self._token = stored['token']
+        self._restored = True
+        metrics.count('sessions_restored')
+        logger.info('Restored the session of worker %s', self.config.worker)
+        return True
+
+    def _save_session(self) -> None:
+        if self._session_store is not None and self._token is not None:
+            self._session_store.save(self._url, self._token, self._session_cookies())
+
+    def _authenticated(self, load, *args):
+        """
+        Run a page load - if the server rejects a restored session, log in again and repeat it.
+
+        :param load: page load function
+        :param args: arguments of `load`
+        :return: what `load` returns
+        """
+        try:
+            return load(*args)
+        except sessionstore.SessionRejected:
+            if not self._restored:
+                raise
+        logger.info('Stored session was rejected - logging in')
+        metrics.count('sessions_rejected')
+        self._restored = False
+        self._session_store.clear()
+        self._token = None
+        with metrics.span('login'):
+            self.login_into_time_watch()
+            self._set_token()
+        self._save_session()
+        return load(*args)
 
     def login_into_time_watch(self) -> None:
         """
@@ -186,16 +457,40 @@ class Timewatch:
         :return: Nothing
         """
         logger.debug('Try to login to %s', self._url)
-        self._driver.get(self._url)
+        self._open_url(self._url)
         self._driver.find_element_by_xpath(
-            '// *[@id="compKeyboard"]').send_keys(self.params['user']['company'])
+            '// *[@id="compKeyboard"]').send_keys(self.config.company)
         self._driver.find_element_by_xpath(
-            '//*[@id="nameKeyboard"]').send_keys(self.params['user']['worker'])
+            '//*[@id="nameKeyboard"]').send_keys(self.config.worker)
         self._driver.find_element_by_xpath(
-            '//*[@id="pwKeyboard"]').send_keys(self.params['user']['pswd'])
+            '//*[@id="pwKeyboard"]').send_keys(self.config.password)
         self._driver.find_element_by_xpath(
             '//*[@id="cpick"]/table/tbody/tr[1]/td/div/div[2]/p/table/tbody/tr[4]/td[2]/input').click()
-        logger.info('Logged in for worker %s', self.params['user']['worker'])
+        logger.info('Logged in for worker %s', self.config.worker)
+
+
+def _token_from_page(source: str) -> str:
+    """
+    :param str source: html of the page received after login
+    :return str: employee token, from the link to the month overview (``editwh.php?ee=<token>&e=...``)
+    """
+    match = _TOKEN_LINK.search(source)
+    if not match:
+        raise IndexError('source of html page has no href with token')
+    return match.group(1)
+
+
+def _is_login_page(source: str) -> bool:
+    return 'compKeyboard' in source
+
+
+def _hour_minute(text: str) -> tuple:
+    """
+    :param str text: time as ``HH:MM``
+    :return tuple: (hour, minute) integers, or None if `text` is not a time
+    """
+    match = re.search(pattern=r'(?P<hour>\d+)\:(?P<minute>\d+)', string=text)
+    return (int(match.group('hour')), int(match.group('minute'))) if match else None
 
 
 class TooManyUpdateButtons(Exception):
@@ -5,30 +5,53 @@ and meta data about and from this specific date: gps data, determining if work d
 
 import os
 import datetime as dt
-import platform
-from random import randint
-from math import isclose
-import subprocess
-import time
-from fastkml import kml
-import calendar
-import re
+import threading
+import collections
 
 import twlog
+import config
+import downloads
+import supervisor
+import pacing
+import kmlcache
+import ledger
+import kmlparse
+import geofence
+import dwell
+import takeout
+import metrics
+import worktimes
 
 logger = twlog.TimeWatchLogger()
 
+# longest range of dates downloaded as a single timeline kml
+TIMELINE_WINDOW_DAYS = 31
+# mode of a date whose timeline is needed but not available without a download (dry runs only)
+NO_TIMELINE = 'no_timeline'
+
 
 class WorkDate:
 
-    def __init__(self, date, download_dir, work_location):
+    def __init__(self, date, download_dir, work_fence, downloader=None, kml_cache=None, takeout_store=None,
+                 sampler=None, timeline=None, offline=False):
         self._date = date
         self.mode = ''
+        self.source = ''
         self.excuse = None
         self.work_day_times = {}
         self._download_dir = download_dir
-        self._work_location = work_location
-        logger.debug('Initialized date %s', date.strftime('%Y-%m-%d'))
+        self._work_fence = work_fence
+        self._downloader = downloader
+        self._kml_cache = kml_cache
+        self._takeout_store = takeout_store
+        self._sampler = sampler
+        self._timeline = timeline
+        self._offline = offline
+        logger.debug('Initialized date %s', twlog.day(date))
+
+    @property
+    def date(self):
+        return self._date
 
     def query_work_date(self, work_day, weekend):
         """
@@ -37,93 +60,252 @@ class WorkDate:
         mode is set to 'gps' if the kml file indicated that were at work at current date.
         Otherwise `mode` will be 'non-gps'.
         In case the day a weekend, mode will be set to 'weekend'
-        :param dict work_day: workday configuration from the JSON parameters file
-        :param list weekend: list of the names of the days in the weekend
+        :param config.WorkDay work_day: compiled workday configuration
+        :param set weekend: weekday numbers (Monday is 0) of the days in the weekend
         :return:
         """
         if self.is_work_day(weekend):
-            logger.debug('Data %s is a work day', self._date.strftime('%Y-%m-%d'))
+            logger.debug('Data %s is a work day', twlog.day(self._date))
             self.mode = 'non_gps'
-            if self._work_location is not None:
-            with KMLFile(file_date=self._date, download_dir=self._download_dir) as f:
-                kml_data = f.read()
-            k = KMLData(kml_data=kml_data)
-            if k.is_at_work(work_location=self._work_location):
-                self.mode = 'gps'
+            if self._work_fence is not None:
+                k = self._location_data()
+                if k is None:
+                    logger.debug('Date %s has no timeline without a download', twlog.day(self._date))
+                    self.mode = NO_TIMELINE
+                    return self.work_day_times
+                if k.is_at_work(work_fence=self._work_fence):
+                    self.mode = 'gps'
             if self.mode == 'gps':
-                logger.debug('Date %s has valid gps data - work from office', self._date.strftime('%Y-%m-%d'))
-                return k.get_work_times(work_location=self._work_location)
+                logger.debug('Date %s has valid gps data - work from office', twlog.day(self._date))
+                self.source = 'gps'
+                self.work_day_times = k.get_work_times(work_fence=self._work_fence)
             elif self.mode == 'non_gps':
-                logger.debug('Date %s has no valid gps data - not in office', self._date.strftime('%Y-%m-%d'))
-                if work_day['randomize']:
-                    return self.spoof_times(work_day=work_day)
+                logger.debug('Date %s has no valid gps data - not in office', twlog.day(self._date))
+                if work_day.randomize:
+                    self.source = 'spoofed'
+                    self.work_day_times = self.spoof_times(work_day=work_day)
                 else:
-                    return self.fixed_times(work_day=work_day)
+                    self.source = 'fixed'
+                    self.work_day_times = self.fixed_times(work_day=work_day)
+            return self.work_day_times
         else:
             self.mode = 'weekend'
 
+    def _location_data(self):
+        """
+        Location data of the current date - from the imported takeout store if it covers the date,
+        then from the timeline window of the range, otherwise from the kml of the date.
+
+        :return KMLData: the location data - None if it is not available offline and the date is offline
+        """
+        if self._takeout_store is not None and self._takeout_store.covers(self._date):
+            logger.debug('Date %s is read from the takeout store', twlog.day(self._date))
+            metrics.count('takeout_hits')
+            return KMLData.from_placemarks(self._takeout_store.placemarks(self._date), date=self._date)
+        if self._timeline is not None and self._timeline.covers(self._date):
+            placemarks = self._timeline.placemarks(self._date)
+            if placemarks is not None:
+                return KMLData.from_placemarks(placemarks, date=self._date)
+        kml_data = self._read_kml()
+        return KMLData(kml_data=kml_data, date=self._date) if kml_data is not None else None
+
+    def _read_kml(self):
+        """
+        Get the kml of the current date - from the kml cache if possible, otherwise from google timeline.
+
+        :return bytes: raw kml data - None if it is not cached and the date is offline
+        """
+        if self._kml_cache is not None:
+            kml_data = self._kml_cache.get(self._date)
+            if kml_data is not None:
+                metrics.count('kml_cache_hits')
+                return kml_data
+            metrics.count('kml_cache_misses')
+        if self._offline:
+            return None
+        with KMLFile(file_date=self._date, download_dir=self._download_dir,
+                     downloader=self._downloader) as f:
+            kml_data = f.read()
+        if self._kml_cache is not None:
+            self._kml_cache.put(self._date, kml_data)
+        return kml_data
+
     def is_work_day(self, weekend):
         """
         Check is current date is a weekday based on provided data in the parameters file.
-        :param list weekend: Names of the weekend days
-        :return: bool. True if current date is part of :param: weekend.
+        :param set weekend: weekday numbers (Monday is 0) of the weekend days
+        :return: bool. True if current date is not part of :param: weekend.
         """
-        return not self._date.weekday() in [ii for ii, x in enumerate(list(calendar.day_name)) if x in weekend]
+        return self._date.weekday() not in weekend
 
-    def spoof_times(self, work_day: dict) -> dict:
+    def spoof_times(self, work_day) -> dict:
         """
         Randomizes start and end times in the day.
-        Randomization is based on [work][work_day] parameters.
+        Randomization is based on [work][work_day] parameters (see worktimes.WorkTimeSampler).
 
-        Randomize starting from the minimal start time with 0-2 hours.
-        Randomize end such that work day won't be longer than max length day [hours] or shorter than nominal-1 [hours]
-        or that is won't end past maximal end time, as provided in the parameters file.
+        Start is drawn in the start window after the minimal start time.
+        End is drawn such that work day won't be longer than max length day [hours] or shorter than nominal-1 [hours]
+        and that is won't end past maximal end time, as provided in the parameters file.
 
-        :param dict work_day: the parsed input from JSON parameters file section [work][work_day]
+        :param config.WorkDay work_day: compiled workday configuration
         :return: dict with start datetime object and end datetime object representing the start/end of workday
         """
-        ptn = r'(?P<hour>\d+)\:(?P<minute>\d+)'
-        match_min = re.search(pattern=ptn, string=work_day['minimal_start_time'])
-        match_max = re.search(pattern=ptn, string=work_day['maximal_end_time'])
-        start_time = dt.datetime(
-            year=self._date.year, month=self._date.month, day=self._date.day,
-            hour=int(match_min.group('hour')) + randint(0, 2),
-            minute=int(randint(0, 59)))
-        end_time = start_time
-        delta = end_time - start_time
-        while delta.seconds // 3600 > work_day['max_length'] or \
-                delta.seconds // 3600 < work_day['nominal_length'] - 1 or \
-                end_time.hour > int(match_max.group('hour')):
-            end_time = dt.datetime(
-                year=self._date.year, month=self._date.month, day=self._date.day,
-                hour=start_time.hour + work_day['nominal_length'] + randint(-1, 1),
-                minute=int(randint(0, 59)))
-            delta = end_time - start_time
-
-        return {'start': start_time, 'end': end_time}
-
-    def fixed_times(self, work_day: dict) -> dict:
+        sampler = self._sampler if self._sampler is not None else worktimes.WorkTimeSampler.from_work_day(work_day)
+        return sampler.times_of(self._date)
+
+    def fixed_times(self, work_day) -> dict:
         """
         Generate start and end dates according to the provided parameters.
         Start time is set to the minimal_start_time value, and
         end time is set to the maximal_start_time value.
 
-        :param dict work_day: the parsed input from JSON parameters file section [work][work_day]
+        :param config.WorkDay work_day: compiled workday configuration
         :return: dict with start datetime object and end datetime object representing the start/end of workday
         """
-        ptn = r'(?P<hour>\d+)\:(?P<minute>\d+)'
-        match_min = re.search(pattern=ptn, string=work_day['minimal_start_time'])
-        match_max = re.search(pattern=ptn, string=work_day['maximal_end_time'])
-        start_time = dt.datetime(
-            year=self._date.year, month=self._date.month, day=self._date.day,
-            hour=int(match_min.group('hour')),
-            minute=int(match_min.group('minute')))
-        end_time = dt.datetime(
-            year=self._date.year, month=self._date.month, day=self._date.day,
-            hour=int(match_max.group('hour')),
-            minute=int(match_max.group('minute')))
+        day = dt.datetime(year=self._date.year, month=self._date.month, day=self._date.day)
+        return {'start': day + dt.timedelta(minutes=work_day.minimal_start),
+                'end': day + dt.timedelta(minutes=work_day.maximal_end)}
+
+
+class WorkPlanner:
+    """
+    Decides what should be written for each date, independently of the TimeWatch session.
+    Holds the parts of the parameters file that :class:`WorkDate` needs, so the decision
+    for a date can be computed ahead of (and in parallel to) the web page that consumes it.
+    """
+
+    def __init__(self, params, seed=None, downloader_factory=None, dry_run=False):
+        """
+        :param params: config.Config, or parsed JSON parameters file
+        :param int seed: seed of the randomized work times (see worktimes.WorkTimeSampler).
+            Raises worktimes.InfeasibleWorkDay if no work day fits the ``work_day`` parameters.
+        :param callable downloader_factory: builds the timeline downloader from `download_dir` and `profile_dir`
+            keyword arguments - downloads.DownloadManager if not given
+        :param bool dry_run: decide without side effects (i.e. --plan): no timeline is downloaded - dates whose
+            timeline is not in the takeout store or the kml cache get the NO_TIMELINE mode - and no decision
+            is recorded in the ledger
+        """
+        self._seed = seed
+        self._dry_run = dry_run
+        self._downloader_factory = downloader_factory if downloader_factory is not None \
+            else downloads.DownloadManager
+        self.set_config(config.as_config(params))
+        self._download_dir = self.config.download_dir
+        self._browser_profile = self.config.browser_profile
+        self._kml_cache = kmlcache.KMLCache.from_params(self.config.params)
+        self._takeout_store = takeout.TakeoutStore.from_params(self.config.params)
+        self._downloader = None
+        self._downloader_lock = threading.Lock()
+        self._windows = []
+        self.ledger = ledger.Ledger.from_params(self.config.params)
+
+    def set_config(self, conf):
+        """
+        Decide the dates queried from now on with `conf` (i.e. a reloaded parameters file), and apply its
+        browser and request limits. Directories, the kml cache, the takeout store and the ledger keep the ones
+        they were opened with.
+
+        :param config.Config conf: new configuration
+        """
+        work_fence = geofence.Geofence(sites=conf.sites, radius=conf.radius) if conf.sites else None
+        sampler = worktimes.WorkTimeSampler.from_work_day(conf.work_day, seed=self._seed) \
+            if conf.work_day.randomize else None
+        # swapped as a whole - queries running in other threads see either the old or the new one
+        self._decider = _Decider(work_fence=work_fence, work_day=conf.work_day, weekend=conf.weekend_days,
+                                 sampler=sampler, params_hash=ledger.params_hash(conf.params))
+        # the planner starts the first browser and request of a run - the limits of the process follow its config
+        supervisor.configure_from_params(conf.params)
+        pacing.configure_from_params(conf.params)
+        self.config = conf
+
+    def close(self):
+        """
+        Close the timeline download browser, if one was started, the kml cache and the ledger.
+        """
+        self._windows = []
+        with self._downloader_lock:
+            if self._downloader is not None:
+                self._downloader.close()
+                self._downloader = None
+        if self._kml_cache is not None:
+            self._kml_cache.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+    def _get_downloader(self):
+        with self._downloader_lock:
+            if self._downloader is None:
+                self._downloader = self._downloader_factory(download_dir=self._download_dir,
+                                                            profile_dir=self._browser_profile)
+            return self._downloader
+
+    def prepare(self, dates):
+        """
+        Prepare a whole range at once, ahead of the queries of its dates: draw the randomized work times,
+        and set up the timeline windows of the dates that need a download (see :class:`KMLWindow`) -
+        a single download per TIMELINE_WINDOW_DAYS days instead of one per date.
+
+        :param list dates: datetime objects
+        """
+        dates = list(dates)
+        d = self._decider
+        # the days of the previous range are freed
+        self._windows = []
+        if d.sampler is not None:
+            d.sampler.prepare(dates)
+        if d.work_fence is None or self._dry_run:
+            return
+        missing = [x for x in dates
+                   if x.weekday() not in d.weekend
+                   and (self._takeout_store is None or not self._takeout_store.covers(x))
+                   and (self._kml_cache is None or x not in self._kml_cache)
+                   and (self.ledger is None or self.ledger.decision(x, d.params_hash) is None)]
+        windows = []
+        for x in missing:
+            if windows and (x - windows[-1][0]).days < TIMELINE_WINDOW_DAYS:
+                windows[-1][1] = x
+            else:
+                windows.append([x, x])
+        self._windows = [KMLWindow(first, last, download_dir=self._download_dir,
+                                   get_downloader=self._get_downloader, kml_cache=self._kml_cache)
+                         for first, last in windows]
+        if self._windows:
+            logger.debug('%d dates to download in %d timeline windows', len(missing), len(self._windows))
+
+    def query(self, date):
+        """
+        Build a :class:`WorkDate` for `date` and run its gps/non-gps/weekend decision.
+
+        :param datetime date: date to query
+        :return: WorkDate with `mode` and `work_day_times` set
+        """
+        d = self._decider
+        decision = self.ledger.decision(date, d.params_hash) if self.ledger is not None else None
+        wd = WorkDate(date=date,
+                      download_dir=self._download_dir,
+                      work_fence=d.work_fence,
+                      downloader=self._get_downloader()
+                      if d.work_fence is not None and decision is None and not self._dry_run else None,
+                      kml_cache=self._kml_cache,
+                      takeout_store=self._takeout_store,
+                      sampler=d.sampler,
+                      timeline=next((w for w in self._windows if w.covers(date)), None),
+                      offline=self._dry_run)
+        if decision is not None:
+            logger.debug('Date %s is reused from the ledger', twlog.day(date))
+            metrics.count('ledger_hits')
+            wd.mode, wd.source, wd.work_day_times = decision['mode'], decision['source'], decision['work_day_times']
+            return wd
+        with metrics.span('query_date', date):
+            wd.query_work_date(work_day=d.work_day, weekend=d.weekend)
+        if self.ledger is not None and not self._dry_run:
+            self.ledger.record_decision(date, mode=wd.mode, source=wd.source, work_day_times=wd.work_day_times,
+                                        p_hash=d.params_hash)
+        return wd
+
+
+_Decider = collections.namedtuple('_Decider', ['work_fence', 'work_day', 'weekend', 'sampler', 'params_hash'])
 
-        return {'start': start_time, 'end': end_time}
 
 class KMLFile:
     """
@@ -131,13 +313,27 @@ class KMLFile:
     Encapsulate file operations on KML file
     """
 
-    def __init__(self, file_date, download_dir):
+    def __init__(self, file_date, download_dir, downloader=None, end_date=None):
+        """
+        :param datetime file_date: date of the timeline - the first date of a range
+        :param str download_dir: directory the browser saves the file to
+        :param downloads.DownloadManager downloader: shared download browser - a new one is started if not given
+        :param datetime end_date: last date (included) of a multi day timeline. A single day if not given.
+        """
         self.file_date = file_date
+        self.end_date = end_date if end_date is not None else file_date
         self._file_dir = download_dir
-        self._download_process = None
+        self._downloader = downloader
+        self._own_downloader = downloader is None
 
     def __enter__(self):
-        self._download_file()
+        if self._own_downloader:
+            self._downloader = downloads.DownloadManager(download_dir=self._file_dir)
+        try:
+            self._download_file()
+        except Exception:
+            self._close_downloader()
+            raise
         return self
 
     def __exit__(self, *exception):
@@ -147,8 +343,13 @@ class KMLFile:
         except PermissionError:
             logger.debug('unable to remove file %s',
                          self._generate_file_name())
-        logger.debug('attempt to close download file browser window')
-        self._download_process.kill()
+        self._close_downloader()
+
+    def _close_downloader(self):
+        if self._own_downloader and self._downloader is not None:
+            logger.debug('attempt to close download file browser window')
+            self._downloader.close()
+            self._downloader = None
 
     def read(self):
         """
@@ -158,9 +359,15 @@ class KMLFile:
         with open(file=self._generate_file_name(), mode='rb') as f:
             return f.read()
 
+    def open(self):
+        """
+        :return: binary file handle of the saved file, for streaming reads
+        """
+        return open(file=self._generate_file_name(), mode='rb')
+
     def _generate_file_name(self):
         """
-        Generate file name for the downloaded kml file.
+        Generate file name for the downloaded kml file - google names it after the first date.
 
         :return str: full path to file name with .kml extension
         """
@@ -169,16 +376,18 @@ class KMLFile:
 
     def _generate_timeline_url(self):
         """
-        Generates url to download kml file from google based on required date.
+        Generates url to download kml file from google based on required dates.
 
-        :return str: kml download link for class instance date
+        :return str: kml download link for class instance dates
         """
 
         base_url = r'https://www.google.com/maps/timeline/kml?authuser=0&pb=!1m8!1m3!1'
         start_date_str = ('i' + str(self.file_date.year)
                           + '!2i' + str(self.file_date.month - 1)
                           + '!3i' + str(self.file_date.day))
-        end_date_str = start_date_str
+        end_date_str = ('i' + str(self.end_date.year)
+                        + '!2i' + str(self.end_date.month - 1)
+                        + '!3i' + str(self.end_date.day))
 
         out = base_url + start_date_str + '!2m3!1' + end_date_str
         logger.debug('Google Timeline download link is %s', out)
@@ -186,36 +395,78 @@ class KMLFile:
 
     def _download_file(self):
         logger.debug('Start download of kml file')
-        if platform.system() == 'Linux':
-            self._download_process = subprocess.Popen(args=('google-chrome', self._generate_timeline_url()),
-                                                      stdout=subprocess.PIPE,
-                                                      stdin=subprocess.PIPE,
-                                                      stderr=subprocess.PIPE)
-        elif platform.system() == 'Windows':
-            chrome_path = "C:\\Program Files (x86)\\Google\\Chrome\\Application\\chrome.exe"
-            self._download_process = subprocess.Popen(args=(chrome_path, self._generate_timeline_url()),
-                                                      stdout=subprocess.PIPE,
-                                                      stdin=subprocess.PIPE,
-                                                      stderr=subprocess.PIPE)
-        else:
-            raise ValueError(f'{platform.system()} is not a supported os')
-
-        file_name = self._generate_file_name()
-
-        counter = 0
-        max_cycles = 1000
-        sleep_time = 0.5  # seconds
-        while not os.path.exists(file_name):
-            if counter > max_cycles:
-                raise RuntimeError(
-                    'more that {} seconds waiting for file to be download - stopping'.format(
-                        str(sleep_time * max_cycles)))
-            else:
-                time.sleep(sleep_time)
-                counter += 1
+        with metrics.span('kml_download', self.file_date):
+            # a throttled download never starts - it is asked again after a backoff
+            pacing.scheduler().call('timeline', lambda: self._downloader.download(
+                url=self._generate_timeline_url(), file_name=self._generate_file_name()),
+                retry_on=(downloads.DownloadTimeout,))
+        metrics.count('kml_downloads')
 
-        else:
-            logger.debug('Finished kml file download: %s', file_name)
+
+class KMLWindow:
+    """
+    Timeline of a range of dates, downloaded from google as a single kml when the first of its dates
+    is read, and split into days in one streaming pass. The days are kept - a date may be read again -
+    until the planner prepares its next range.
+    Thread safe - the dates of the range are read from the pipeline threads.
+    """
+
+    def __init__(self, first_date, last_date, download_dir, get_downloader, kml_cache=None):
+        """
+        :param datetime first_date: first date of the range
+        :param datetime last_date: last date of the range (included)
+        :param str download_dir: directory the browser saves the file to
+        :param callable get_downloader: returns the shared downloads.DownloadManager
+        :param kmlcache.KMLCache kml_cache: the days are stored in it as well, if given
+        """
+        self.first_date = _as_date(first_date)
+        self.last_date = _as_date(last_date)
+        self._start = first_date
+        self._end = last_date
+        self._download_dir = download_dir
+        self._get_downloader = get_downloader
+        self._kml_cache = kml_cache
+        self._lock = threading.Lock()
+        self._days = None
+        self._failed = False
+
+    def covers(self, date):
+        """
+        :param datetime date: date to check
+        :return bool: True if `date` is in the range and its timeline can still be read from the window
+        """
+        return not self._failed and self.first_date <= _as_date(date) <= self.last_date
+
+    def placemarks(self, date):
+        """
+        :param datetime date: date of the range
+        :return list: kmlparse.Placemark records of the date, or None if the range could not be downloaded
+        """
+        with self._lock:
+            if self._days is None and not self._failed:
+                try:
+                    self._fetch()
+                except Exception as ex:
+                    # the dates fall back to a download each
+                    logger.error('Timeline download of %s to %s failed: %s', self.first_date, self.last_date, ex)
+                    self._failed = True
+            if self._failed:
+                return None
+            return self._days.get(_as_date(date), [])
+
+    def _fetch(self):
+        with KMLFile(file_date=self._start, end_date=self._end, download_dir=self._download_dir,
+                     downloader=self._get_downloader()) as f, f.open() as source:
+            with metrics.span('kml_parse', self._start):
+                days = kmlparse.split_days(kmlparse.iter_placemarks(source), self.first_date, self.last_date)
+        metrics.count('placemarks_parsed', sum(len(p) for p in days.values()))
+        logger.debug('Timeline of %s to %s split into %d days', self.first_date, self.last_date, len(days))
+        if self._kml_cache is not None:
+            day = self.first_date
+            while day <= self.last_date:
+                self._kml_cache.put(day, kmlparse.dump_placemarks(days.get(day, [])))
+                day += dt.timedelta(days=1)
+        self._days = days
 
 
 class KMLData:
@@ -228,48 +479,86 @@ class KMLData:
     download_date = ''
     _driver = ''
 
-    def __init__(self, kml_data):
-        self.kml_data = kml.KML()
-        self.kml_data.from_string(kml_data)
+    def __init__(self, kml_data, date=None):
+        """
+        :param kml_data: raw kml (bytes) or a binary file handle opened on a kml file
+        :param datetime date: date of the kml data - its work times are the ones of the stays starting on it
+        """
+        self.kml_data = kml_data
+        self._date = date
         self.work_date_times = {'start': {'hour': None, 'minute': None}, 'end': {'hour': None, 'minute': None}}
-        self.work_location_tolerance = 3
+        self._placemarks = None
+        self._days = None
 
-    def is_at_work(self, work_location):
+    @classmethod
+    def from_placemarks(cls, placemarks, date=None):
+        """
+        Build from already parsed placemarks (i.e. from the takeout store) instead of raw kml.
+
+        :param list placemarks: list of kmlparse.Placemark
+        :param datetime date: date of the placemarks
+        :return KMLData:
+        """
+        k = cls(kml_data=None, date=date)
+        k._placemarks = list(placemarks)
+        return k
+
+    def is_at_work(self, work_fence):
         try:
-            work_times = self.get_work_times(work_location=work_location)
+            work_times = self.get_work_times(work_fence=work_fence)
             return bool(work_times)
         except ValueError:
             return False
 
     def _gen_placemarks(self):
-        try:
-            for p in self.kml_data._features[0]._features:
-                yield {'t': p._time_span, 'coords': p._geometry.geometry.coords}
-        except IndexError:
-            return
+        """
+        Placemarks of the kml data. The kml is parsed once and the records are kept for following calls.
 
-    def get_work_times(self, work_location):
+        :return list: list of kmlparse.Placemark
         """
-        Parses all the placemarks in the kml data and extract coordinates of each mark.
-        Coordinates are measured for distance from work location (provided :param:)
-        Each placemark that is deemed to be close enough to the work location is measured for
-        time at arrival and departure.
-        The largest difference (first arrival and last departure) are returned as total time spent at work.
+        if self._placemarks is None:
+            with metrics.span('kml_parse', self._date):
+                self._placemarks = list(kmlparse.iter_placemarks(self.kml_data))
+            metrics.count('placemarks_parsed', len(self._placemarks))
+        return self._placemarks
 
-        :param dict work_location: lat and long work location - from JSON paramters
+    def dwell(self, work_fence):
+        """
+        Time at work per day (see the dwell module). Computed once, following calls return the same result.
 
-        :returns: dict minimal start time and maximal end time
+        :param Geofence work_fence: work sites and radius - from JSON paramters
+        :return dict: date -> dwell.DayDwell
         """
-        start_times = list()
-        end_times = list()
-        for p in self._gen_placemarks():
-            if is_within_distance(work_location, p['coords'][0], self.work_location_tolerance):
-                start_times.append(p['t'].begin[0].astimezone())
-                end_times.append(p['t'].end[0].astimezone())
-        try:
-            return {'start': min(start_times), 'end': max(start_times)}
-        except ValueError:
+        if self._days is None:
+            with metrics.span('dwell', self._date):
+                self._days = dwell.analyze(self._gen_placemarks(), work_fence=work_fence)
+        return self._days
+
+    def get_work_times(self, work_fence):
+        """
+        Arrival and departure of the date: every placemark (and every vertex of a track) is an interval
+        in or out of the work geofence. The intervals at work are merged into stays, and the first arrival and
+        last departure of the stays starting on the date are returned.
+        Without a date, the day with the most time at work is used.
+
+        :param Geofence work_fence: work sites and radius - from JSON paramters
+
+        :returns: dict of start (arrival) and end (departure) times, or None if not at work
+        """
+        days = self.dwell(work_fence)
+        if not days:
             return None
+        if self._date is not None:
+            day = days.get(dt.date(self._date.year, self._date.month, self._date.day))
+            if day is None:
+                return None
+        else:
+            day = max(days.values(), key=lambda d: d.dwell)
+        return {'start': day.arrival, 'end': day.departure}
+
+
+def _as_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
 
 
 def date_list(start_date, end_date):
@@ -284,23 +573,3 @@ def date_list(start_date, end_date):
         tmp_date = start_date + dt.timedelta(days=d)
         yield tmp_date
 
-
-def is_within_distance(work_location, coordinates, tolerance):
-    """
-    Checks if coordinates provided are withhin a tolerance of the work location.
-
-    :param lst coordinates: list of coordinates: lat, long, elevation in Decimal degrees notation
-    :param int tolerance: multiplier to determine final search radius around coordinates
-    :param dict work_location: lat and long of work location
-    :return: True if provided coordinates are within tolerance of work coordinates
-    """
-
-    # round to 3 decimal places - gives a ~100 meters precision
-    # assumes to be neighborhood or street
-    # https://en.wikipedia.org/wiki/Decimal_degrees
-    precision = pow(10, -3)
-
-    is_close_long = isclose(coordinates[0], round(float(work_location['long']), 5), abs_tol=tolerance * precision)
-    is_close_lat = isclose(coordinates[1], round(float(work_location['lat']), 5), abs_tol=tolerance * precision)
-
-    return is_close_lat and is_close_long
@@ -0,0 +1,174 @@
+"""
+This module draws the start and end times of days without gps data (``randomize``).
+
+The feasible window of the day is computed once from the ``work_day`` parameters: the start is drawn from
+``minimal_start_time`` plus the start window, and the end from the lengths between ``nominal_length - 1`` (at least 0)
+and ``max_length`` hours that still end by ``maximal_end_time``. Both are drawn directly inside their window - there is
+no retry, and a configuration with no feasible day is rejected when the sampler is built.
+
+Draws are vectorized over all the dates of a range. They depend only on the seed and on the date,
+so a date gets the same times whatever the range it is drawn in.
+"""
+
+import datetime as dt
+import secrets
+
+import numpy as np
+
+import twlog
+
+logger = twlog.TimeWatchLogger()
+
+DISTRIBUTIONS = ('uniform', 'triangular')
+
+_STREAM_START = 1
+_STREAM_LENGTH = 2
+_STREAM_STEP = 0xD1B54A32D192ED03
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+class InfeasibleWorkDay(ValueError):
+    pass
+
+
+class WorkTimeSampler:
+    """
+    Draws start and end times (in minutes after midnight) of work days.
+
+    With the ``uniform`` distribution all the feasible starts and lengths are equally likely.
+    With ``triangular`` the start is most likely in the middle of its window and the length around
+    ``nominal_length``.
+    """
+
+    def __init__(self, minimal_start, maximal_end, nominal_length, max_length, start_window=180,
+                 distribution='uniform', seed=None):
+        """
+        :param int minimal_start: earliest start, minutes after midnight
+        :param int maximal_end: latest end, minutes after midnight
+        :param int nominal_length: nominal day length, minutes
+        :param int max_length: maximal day length, minutes
+        :param int start_window: starts are drawn in [minimal_start, minimal_start + start_window) minutes
+        :param str distribution: one of DISTRIBUTIONS
+        :param int seed: the same seed gives the same times for the same dates. Random if not given.
+        """
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError('unknown work day distribution {} (expected one of {})'.format(
+                distribution, ', '.join(DISTRIBUTIONS)))
+        self._nominal_length = nominal_length
+        # a nominal day under one hour may be as short as nothing, never negative
+        self._min_length = max(0, nominal_length - 60)
+        # lengths drawn around the nominal one - at most one hour longer than nominal
+        self._max_length = min(max_length, nominal_length + 60)
+        self._first_start = minimal_start
+        if self._min_length > self._max_length:
+            raise InfeasibleWorkDay('nominal_length - 1 hour is longer than max_length')
+        # the last start that still leaves room for the shortest day
+        self._last_start = min(minimal_start + max(start_window, 1) - 1, maximal_end - self._min_length)
+        if self._last_start < self._first_start:
+            raise InfeasibleWorkDay('a day of at least {} starting at {} ends after {}'.format(
+                _format_minutes(self._min_length), _format_minutes(minimal_start), _format_minutes(maximal_end)))
+        self._maximal_end = maximal_end
+        self._distribution = distribution
+        self._seed = secrets.randbits(64) if seed is None else int(seed) & _MASK
+        self._cache = {}
+
+    @classmethod
+    def from_work_day(cls, work_day, seed=None):
+        """
+        :param config.WorkDay work_day: compiled ``work.work_day`` parameters
+        :param int seed: overrides the ``seed`` parameter
+        :return WorkTimeSampler:
+        """
+        return cls(minimal_start=work_day.minimal_start,
+                   maximal_end=work_day.maximal_end,
+                   nominal_length=work_day.nominal_length,
+                   max_length=work_day.max_length,
+                   start_window=work_day.start_window,
+                   distribution=work_day.distribution,
+                   seed=seed if seed is not None else work_day.seed)
+
+    def sample(self, dates):
+        """
+        Draw the times of many dates at once.
+
+        :param list dates: datetime objects
+        :return tuple: (start, end) int arrays of minutes after midnight, one item per date
+        """
+        ordinals = np.fromiter((d.toordinal() for d in dates), dtype=np.uint64, count=len(dates))
+        u_start = _uniform(self._seed, ordinals, _STREAM_START)
+        u_length = _uniform(self._seed, ordinals, _STREAM_LENGTH)
+
+        lo, hi = self._first_start, self._last_start + 1
+        if self._distribution == 'triangular':
+            start = _triangular(u_start, lo, (lo + hi) / 2, hi)
+        else:
+            start = lo + u_start * (hi - lo)
+        start = np.clip(np.floor(start), self._first_start, self._last_start).astype(np.int64)
+
+        # the longest day of every start still ends by maximal_end
+        lo = np.full(len(dates), self._min_length, dtype=np.float64)
+        hi = np.minimum(self._max_length, self._maximal_end - start) + 1
+        if self._distribution == 'triangular':
+            length = _triangular(u_length, lo, np.clip(self._nominal_length, lo, hi), hi)
+        else:
+            length = lo + u_length * (hi - lo)
+        length = np.clip(np.floor(length), lo, hi - 1).astype(np.int64)
+        return start, start + length
+
+    def prepare(self, dates):
+        """
+        Draw the times of a whole range in one call - following :meth:`times_of` calls of these dates are lookups.
+
+        :param list dates: datetime objects
+        """
+        dates = [d for d in dates if d not in self._cache]
+        if not dates:
+            return
+        start, end = self.sample(dates)
+        for d, s, e in zip(dates, start.tolist(), end.tolist()):
+            self._cache[d] = (s, e)
+        logger.debug('Drew work times of %d dates', len(dates))
+
+    def times_of(self, date):
+        """
+        :param datetime date: date to draw
+        :return dict: start and end datetime objects of `date`
+        """
+        if date not in self._cache:
+            self.prepare([date])
+        start, end = self._cache[date]
+        return {'start': _time_of(date, start), 'end': _time_of(date, end)}
+
+
+def _uniform(seed, ordinals, stream):
+    """
+    Counter based uniform numbers in [0, 1) - splitmix64 of (seed, date, stream).
+    Vectorized, and independent of which other dates are drawn.
+    """
+    with np.errstate(over='ignore'):
+        x = ordinals * np.uint64(0x9E3779B97F4A7C15) + np.uint64(seed) + np.uint64(stream * _STREAM_STEP & _MASK)
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def _triangular(u, lo, mode, hi):
+    """inverse cdf of the triangular distribution on [lo, hi) peaking at `mode`"""
+    lo, mode, hi = np.broadcast_arrays(np.asarray(lo, dtype=np.float64), np.asarray(mode, dtype=np.float64),
+                                       np.asarray(hi, dtype=np.float64))
+    width = hi - lo
+    split = np.divide(mode - lo, width, out=np.zeros_like(width), where=width > 0)
+    left = lo + np.sqrt(u * width * (mode - lo))
+    right = hi - np.sqrt((1 - u) * width * (hi - mode))
+    return np.where(u < split, left, right)
+
+
+def _format_minutes(minutes):
+    return '{:02d}:{:02d}'.format(*divmod(minutes, 60))
+
+
+def _time_of(date, minutes):
+    return dt.datetime(date.year, date.month, date.day, *divmod(minutes, 60))